@@ -84,11 +84,18 @@ async def startup_event():
     os.makedirs("data", exist_ok=True)
     os.makedirs("logs", exist_ok=True)
     
+    # 启动后台任务队列，恢复上次未完成的任务
+    from services.job_service import job_queue
+    await job_queue.start()
+    
     logger.info("co-novel AI小说助手启动完成")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("co-novel AI小说助手正在关闭...")
+    # 运行中的任务保持运行中状态，下次启动时重新执行
+    from services.job_service import job_queue
+    await job_queue.stop()
 
 # 根路由
 @app.get("/")
@@ -112,8 +119,8 @@ async def root():
 async def health_check():
     try:
         # 检查各种服务状态
-        from services.data_service import data_manager
-        stats = data_manager.get_statistics()
+        from services.novel_service import novel_service
+        stats = novel_service.get_statistics().data
         
         return {
             "status": "healthy",
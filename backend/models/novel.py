@@ -32,6 +32,15 @@ class ChapterStatus(str, Enum):
     REVIEWED = "已审阅"
 
 
+class JobStatus(str, Enum):
+    """后台任务状态枚举"""
+    QUEUED = "排队中"
+    RUNNING = "运行中"
+    SUCCEEDED = "已完成"
+    FAILED = "失败"
+    CANCELLED = "已取消"
+
+
 class CreationStep(int, Enum):
     """创作步骤枚举"""
     BASIC_SETUP = 0      # 基础设置
@@ -41,6 +50,13 @@ class CreationStep(int, Enum):
     CHAPTER_GENERATION = 4  # 章节生成
 
 
+class OutlineChapter(BaseModel):
+    """大纲中的一章"""
+    number: int
+    title: str = ""
+    summary: str = ""
+
+
 class NovelProject(BaseModel):
     """小说项目数据模型"""
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -48,6 +64,11 @@ class NovelProject(BaseModel):
     genre: NovelGenre
     theme: str
     outline: Optional[str] = None
+    # 从outline解析出的章节列表，outline格式无法识别时为空
+    outline_chapters: List[OutlineChapter] = Field(default_factory=list)
+    # 滚动前情提要：第1章到第summary_through章的压缩摘要，之后的章节只保留各自的摘要
+    story_summary: str = ""
+    summary_through: int = 0
     status: NovelStatus = NovelStatus.DRAFT
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
@@ -78,6 +99,8 @@ class Chapter(BaseModel):
     chapter_number: int
     title: Optional[str] = None
     content: Optional[str] = None
+    # 保存后异步生成的章节摘要，用于后续章节的前情提要
+    summary: Optional[str] = None
     status: ChapterStatus = ChapterStatus.DRAFT
     word_count: int = 0
     created_at: datetime = Field(default_factory=datetime.now)
@@ -154,6 +177,10 @@ class AIGenerationCache(BaseModel):
     created_at: datetime = Field(default_factory=datetime.now)
     hit_count: int = 1  # 缓存命中次数
     last_hit: datetime = Field(default_factory=datetime.now)
+    # 提示词的MinHash签名，用于近似命中
+    prompt_signature: Optional[List[int]] = None
+    # 生成这条内容的耗时（秒），命中时计为节省的延迟
+    generation_latency: Optional[float] = None
     
     class Config:
         json_encoders = {
@@ -174,6 +201,32 @@ class AIGenerationCache(BaseModel):
         self.last_hit = datetime.now()
 
 
+class GenerationJob(BaseModel):
+    """后台生成任务模型"""
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    job_type: str  # novel_draft, outline, chapter等
+    params: Dict[str, Any] = Field(default_factory=dict)
+    priority: int = 0  # 越大越先执行
+    status: JobStatus = JobStatus.QUEUED
+    progress: Dict[str, Any] = Field(default_factory=dict)
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    # 开始执行的次数，被服务重启中断后重新执行时累加
+    attempts: int = 0
+    created_at: datetime = Field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        json_encoders = {
+            datetime: lambda v: v.isoformat()
+        }
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+
 class APIResponse(BaseModel):
     """统一API响应模型"""
     success: bool
@@ -211,7 +264,25 @@ class ChapterGenerationRequest(BaseModel):
     outline: str
     chapter_number: int = Field(ge=1)
     custom_title: Optional[str] = None
-    word_count_target: int = Field(default=1500, ge=500, le=3000)  # 目标字数
+    novel_id: Optional[str] = None  # 为空时按标题查找已保存的小说，用于带上前情提要
+    word_count_target: Optional[int] = Field(default=None, ge=500, le=3000)  # 目标字数，为空时使用CHAPTER_WORD_COUNT_TARGET
+
+
+class NovelDraftRequest(BaseModel):
+    """整本小说初稿生成请求"""
+    title: str
+    outline: str
+    genre: NovelGenre = NovelGenre.FANTASY
+    theme: str = "默认主题"
+    chapter_count: Optional[int] = Field(default=None, ge=1, le=20)  # 为空时按大纲中的章节数
+    parallelism: Optional[int] = Field(default=None, ge=1, le=8)  # 同时生成的章节数，为空时使用默认配置
+
+
+class JobSubmitRequest(BaseModel):
+    """后台任务提交请求"""
+    job_type: str  # novel_draft（整本初稿）、outline（大纲）、chapter（单章）
+    params: Dict[str, Any] = Field(default_factory=dict)  # 对应生成接口的请求参数
+    priority: int = Field(default=0, ge=-10, le=10)  # 越大越先执行
 
 
 class CreationSessionRequest(BaseModel):
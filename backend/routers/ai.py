@@ -1,8 +1,8 @@
 # co-novel - AI相关API路由
-from fastapi import APIRouter, HTTPException, Response
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Header, HTTPException, Response
 from typing import Dict, Any, List, Optional
 from pydantic import BaseModel, Field
+import asyncio
 import json
 import time
 import logging
@@ -10,9 +10,12 @@ import logging
 # 导入业务服务和数据模型
 from services.novel_service import novel_service
 from services.ai_service import AIService
+from services.job_service import job_queue
+from utils.tokenizer import TokenUsage, current_usage
+from utils.sse import SSEResponse, ChunkEnvelope, ResumeGapError, stream_registry, coalesce, coalesce_settings
 from models.novel import (
     TitleGenerationRequest, OutlineGenerationRequest, ChapterGenerationRequest,
-    NovelGenre, APIResponse
+    NovelDraftRequest, NovelGenre, APIResponse, JobSubmitRequest
 )
 
 # 设置日志
@@ -44,6 +47,8 @@ class LegacyGenerateChapterRequest(BaseModel):
     outline: str
     chapter_number: int = 1
     custom_title: Optional[str] = None
+    novel_id: Optional[str] = None
+    word_count_target: Optional[int] = None  # 为空时使用CHAPTER_WORD_COUNT_TARGET
 
 class LegacyGenerateContentRequest(BaseModel):
     prompt: str
@@ -91,96 +96,39 @@ def handle_errors(func):
 
 # 流式生成帮助函数
 def create_stream_generator(content_generator, content_type: str):
-    """创建流式响应生成器"""
-    def stream_generator():
+    """
+    创建流式响应生成器，content_generator为异步生成器
+
+    上游的小片段按content_type对应的合并参数合并后再发送，见utils.sse.coalesce
+    """
+    async def stream_generator():
         # 生成唯一的ID
         import uuid
         completion_id = str(uuid.uuid4()).replace("-", "")
+        # AI服务调用上游时写入提示词token和上游返回的真实用量，输出token随片段累加估算
+        usage = TokenUsage()
+        current_usage.set(usage)
+        chunks = coalesce(content_generator, coalesce_settings.for_route(content_type))
+        envelope = ChunkEnvelope(completion_id, "deepseek-ai/DeepSeek-R1")
         
         try:
             # 生成初始响应
-            initial_data = {
-                "id": completion_id,
-                "object": "chat.completion.chunk",
-                "created": int(time.time()),
-                "model": "deepseek-ai/DeepSeek-R1",
-                "choices": [{
-                    "index": 0,
-                    "delta": {
-                        "content": None,
-                        "reasoning_content": "",
-                        "role": "assistant"
-                    },
-                    "finish_reason": None
-                }],
-                "system_fingerprint": "",
-                "usage": {
-                    "prompt_tokens": 4,
-                    "completion_tokens": 0,
-                    "total_tokens": 4
-                }
-            }
-            yield f"data: {json.dumps(initial_data, ensure_ascii=False)}\n\n"
+            yield envelope.encode(None, usage.prompt_tokens, usage.completion_tokens, usage_details=False)
             
-            # 生成内容块
-            content_chunks = []
-            for chunk in content_generator:
+            # 生成内容块：用量随片段累加，信封只转义内容后拼接
+            async for chunk in chunks:
                 if chunk:  # 检查chunk不为空
-                    content_chunks.append(chunk)
-                    # 构造响应数据
-                    chunk_data = {
-                        "id": completion_id,
-                        "object": "chat.completion.chunk",
-                        "created": int(time.time()),
-                        "model": "deepseek-ai/DeepSeek-R1",
-                        "choices": [{
-                            "index": 0,
-                            "delta": {
-                                "content": chunk,
-                                "reasoning_content": "",
-                                "role": "assistant"
-                            },
-                            "finish_reason": None
-                        }],
-                        "system_fingerprint": "",
-                        "usage": {
-                            "prompt_tokens": 4,
-                            "completion_tokens": len("".join(content_chunks)),
-                            "total_tokens": 4 + len("".join(content_chunks)),
-                            "completion_tokens_details": {
-                                "reasoning_tokens": 0
-                            }
-                        }
-                    }
-                    yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
+                    usage.add_completion(chunk)
+                    yield envelope.encode(chunk, usage.prompt_tokens, usage.completion_tokens)
             
             # 生成结束响应
-            end_data = {
-                "id": completion_id,
-                "object": "chat.completion.chunk",
-                "created": int(time.time()),
-                "model": "deepseek-ai/DeepSeek-R1",
-                "choices": [{
-                    "index": 0,
-                    "delta": {
-                        "content": "",
-                        "reasoning_content": "",
-                        "role": "assistant"
-                    },
-                    "finish_reason": "stop"
-                }],
-                "system_fingerprint": "",
-                "usage": {
-                    "prompt_tokens": 4,
-                    "completion_tokens": len("".join(content_chunks)),
-                    "total_tokens": 4 + len("".join(content_chunks)),
-                    "completion_tokens_details": {
-                        "reasoning_tokens": 0
-                    }
-                }
-            }
-            yield f"data: {json.dumps(end_data, ensure_ascii=False)}\n\n"
+            yield envelope.encode("", usage.prompt_tokens, usage.completion_tokens, finish_reason="stop")
             
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客户端断开：AI服务关闭上游连接并记录取消的用量，这里记录已发送的部分
+            logger.info(f"Client disconnected during {content_type} stream: "
+                        f"{usage.completion_tokens} completion tokens sent")
+            raise
         except Exception as e:
             logger.error(f"Stream generation error for {content_type}: {str(e)}")
             # 发送错误信息
@@ -194,6 +142,52 @@ def create_stream_generator(content_generator, content_type: str):
                 }
             }
             yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+        finally:
+            # 提前结束时逐层关闭内容生成器，不等垃圾回收；合并层可能正在读取内容生成器，先关闭
+            await chunks.aclose()
+            await content_generator.aclose()
+    
+    return stream_generator
+
+
+def stream_response(stream_gen, last_event_id: Optional[str] = None) -> SSEResponse:
+    """
+    在后台运行流式生成，响应从可续传的缓冲中读取
+
+    每个事件带“生成ID-序号”形式的id。断线后带Last-Event-ID重新请求时，
+    对应的生成仍在缓冲中则从断点续传，不再调用上游；否则重新生成。
+    """
+    try:
+        resumed = stream_registry.resume(last_event_id)
+    except ResumeGapError as e:
+        logger.info(f"Cannot resume stream, regenerating: {e}")
+        resumed = None
+    if resumed is not None:
+        return SSEResponse(resumed, media_type="text/event-stream; charset=utf-8")
+    buffer = stream_registry.start(stream_gen())
+    return SSEResponse(stream_registry.subscribe(buffer), media_type="text/event-stream; charset=utf-8",
+                       headers={"X-Generation-Id": buffer.id})
+
+
+def create_event_stream_generator(event_generator, content_type: str):
+    """创建多路复用的流式响应生成器，event_generator产出带chapter_number等字段的事件字典"""
+    async def stream_generator():
+        try:
+            async for event in event_generator:
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            logger.error(f"Stream generation error for {content_type}: {str(e)}")
+            error_data = {
+                "event": "error",
+                "error": {
+                    "message": f"{content_type} generation failed",
+                    "type": "generation_error",
+                    "code": "internal_error"
+                }
+            }
+            yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+        finally:
+            await event_generator.aclose()
     
     return stream_generator
 
@@ -229,7 +223,7 @@ async def generate_title(request: LegacyGenerateTitleRequest):
         )
         
         # 调用业务服务
-        response = novel_service.generate_titles(title_request)
+        response = await novel_service.generate_titles_async(title_request)
         
         if response.success and response.data:
             return {"title": response.data["titles"][0]}
@@ -243,12 +237,12 @@ async def generate_title(request: LegacyGenerateTitleRequest):
         raise HTTPException(status_code=500, detail="Title generation failed")
 
 @router.post("/generate-content-stream")
-async def generate_content_stream(request: LegacyGenerateContentRequest):
+async def generate_content_stream(request: LegacyGenerateContentRequest, last_event_id: Optional[str] = Header(None)):
     """流式生成小说内容"""
     try:
-        content_generator = ai_service.generate_novel_content_stream(request.prompt, request.max_tokens)
+        content_generator = ai_service.generate_novel_content_stream_async(request.prompt, request.max_tokens)
         stream_gen = create_stream_generator(content_generator, "content")
-        return StreamingResponse(stream_gen(), media_type="text/event-stream; charset=utf-8")
+        return stream_response(stream_gen, last_event_id)
     except Exception as e:
         logger.error(f"Content stream error: {str(e)}")
         raise HTTPException(status_code=500, detail="Content stream generation failed")
@@ -266,7 +260,7 @@ async def generate_outline(request: LegacyGenerateOutlineRequest):
         )
         
         # 调用业务服务
-        response = novel_service.generate_outline(outline_request)
+        response = await novel_service.generate_outline_async(outline_request)
         
         if response.success and response.data:
             return {"outline": response.data["outline"]}
@@ -289,11 +283,13 @@ async def generate_chapter(request: LegacyGenerateChapterRequest):
             title=request.title,
             outline=request.outline,
             chapter_number=request.chapter_number,
-            custom_title=request.custom_title
+            custom_title=request.custom_title,
+            novel_id=request.novel_id,
+            word_count_target=request.word_count_target
         )
         
         # 调用业务服务
-        response = novel_service.generate_chapter(chapter_request)
+        response = await novel_service.generate_chapter_async(chapter_request)
         
         if response.success and response.data:
             return {"content": response.data["content"]}
@@ -307,32 +303,160 @@ async def generate_chapter(request: LegacyGenerateChapterRequest):
         raise HTTPException(status_code=500, detail="Chapter generation failed")
 
 @router.post("/generate-chapter-stream")
-async def generate_chapter_stream(request: LegacyGenerateChapterRequest):
+async def generate_chapter_stream(request: LegacyGenerateChapterRequest, last_event_id: Optional[str] = Header(None)):
     """流式生成指定章节内容"""
     try:
-        content_generator = ai_service.generate_chapter_content_stream(
-            request.title, 
-            request.outline, 
-            request.chapter_number, 
-            request.custom_title
+        chapter_request = ChapterGenerationRequest(
+            title=request.title,
+            outline=request.outline,
+            chapter_number=request.chapter_number,
+            custom_title=request.custom_title,
+            novel_id=request.novel_id,
+            word_count_target=request.word_count_target
         )
+        content_generator = novel_service.generate_chapter_stream_async(chapter_request)
         stream_gen = create_stream_generator(content_generator, "chapter")
-        return StreamingResponse(stream_gen(), media_type="text/event-stream; charset=utf-8")
+        return stream_response(stream_gen, last_event_id)
     except Exception as e:
         logger.error(f"Chapter stream error: {str(e)}")
         raise HTTPException(status_code=500, detail="Chapter stream generation failed")
 
+@router.post("/generate-novel-stream")
+async def generate_novel_stream(request: NovelDraftRequest, last_event_id: Optional[str] = Header(None)):
+    """并行生成整本小说初稿，各章节的内容在同一个SSE连接中交错返回，按chapter_number区分"""
+    try:
+        novel_service.draft_chapter_count(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        event_generator = novel_service.generate_novel_draft_stream_async(request)
+        stream_gen = create_event_stream_generator(event_generator, "novel")
+        return stream_response(stream_gen, last_event_id)
+    except Exception as e:
+        logger.error(f"Novel stream error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Novel stream generation failed")
+
 @router.post("/generate-outline-stream")
-async def generate_outline_stream(request: LegacyGenerateOutlineRequest):
+async def generate_outline_stream(request: LegacyGenerateOutlineRequest, last_event_id: Optional[str] = Header(None)):
     """流式生成小说大纲"""
     try:
-        content_generator = ai_service.generate_novel_outline_stream(request.genre, request.theme, request.title)
+        content_generator = ai_service.generate_novel_outline_stream_async(request.genre, request.theme, request.title)
         stream_gen = create_stream_generator(content_generator, "outline")
-        return StreamingResponse(stream_gen(), media_type="text/event-stream; charset=utf-8")
+        return stream_response(stream_gen, last_event_id)
     except Exception as e:
         logger.error(f"Outline stream error: {str(e)}")
         raise HTTPException(status_code=500, detail="Outline stream generation failed")
 
+@router.get("/streams/{generation_id}")
+async def resume_stream(generation_id: str, last_event_id: Optional[str] = Header(None), after: int = -1):
+    """续传一次仍在缓冲中的流式生成：从Last-Event-ID（或after指定的序号）之后开始，不带时从头读取"""
+    buffer = stream_registry.get(generation_id)
+    if buffer is None:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    if not last_event_id:
+        if not buffer.can_resume(after):
+            raise HTTPException(status_code=410, detail=f"序号 {after} 之后的部分内容已不在缓冲中")
+        return SSEResponse(stream_registry.subscribe(buffer, after), media_type="text/event-stream; charset=utf-8")
+    try:
+        resumed = stream_registry.resume(last_event_id)
+    except ResumeGapError as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    if resumed is None:
+        # Last-Event-ID属于其他（或已过期的）生成
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    return SSEResponse(resumed, media_type="text/event-stream; charset=utf-8")
+
+@router.delete("/streams/{generation_id}")
+async def cancel_stream(generation_id: str):
+    """停止一次流式生成并关闭上游连接（断线后生成会在宽限期内继续，用户主动停止时调用）"""
+    return {"cancelled": stream_registry.cancel(generation_id)}
+
+@router.get("/stream-stats")
+async def get_stream_stats():
+    """获取可续传流式生成的统计（进行中、缓冲中的生成和事件数，续传和放弃次数）"""
+    return stream_registry.get_stats()
+
+# === 后台生成任务 ===
+
+@router.post("/jobs")
+async def submit_job(request: JobSubmitRequest):
+    """提交后台生成任务（novel_draft、outline、chapter），立即返回任务ID，之后轮询任务状态"""
+    try:
+        job = await job_queue.submit(request.job_type, request.params, request.priority)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"job_id": job.id, "status": job.status}
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """获取任务状态和进度（不含结果）"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job.dict(exclude={"params", "result"})
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """获取任务结果，任务未结束时返回409"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if not job.finished:
+        raise HTTPException(status_code=409, detail=f"任务{job.status.value}，尚未结束")
+    return {"job_id": job.id, "status": job.status, "result": job.result, "error": job.error}
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """取消排队中或运行中的任务"""
+    job = await job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {"job_id": job.id, "status": job.status}
+
+@router.get("/job-stats")
+async def get_job_stats():
+    """获取后台任务统计（提交、完成、失败、取消、重启后恢复的任务数，排队和运行中的任务数）"""
+    return job_queue.get_stats()
+
+@router.get("/cache-stats")
+async def get_cache_stats():
+    """获取AI缓存统计（查询、命中、未命中、命中率、占用、淘汰、节省的延迟和token）"""
+    response = novel_service.get_cache_stats()
+    if not response.success:
+        raise HTTPException(status_code=500, detail=response.message)
+    return response.data
+
+@router.get("/prefetch-stats")
+async def get_prefetch_stats():
+    """获取章节预取统计（预取次数、token花费和命中率）"""
+    response = novel_service.get_prefetch_stats()
+    return response.data
+
+@router.get("/scheduler-stats")
+async def get_scheduler_stats():
+    """获取上游模型调用的调度统计（排队深度、在途请求数、排队等待时间、拒绝次数）"""
+    return ai_service.get_scheduler_stats()
+
+@router.get("/resilience-stats")
+async def get_resilience_stats():
+    """获取上游模型调用的重试、对冲和超时统计"""
+    return ai_service.get_resilience_stats()
+
+@router.get("/route-stats")
+async def get_route_stats():
+    """获取各内容类型的模型路由配置，以及按路由统计的调用数、延迟、token和估算成本"""
+    return ai_service.get_route_stats()
+
+@router.get("/provider-stats")
+async def get_provider_stats():
+    """获取各服务商的健康状况（EWMA首字延迟、延迟、错误率、在途请求数）"""
+    return ai_service.get_provider_stats()
+
+@router.get("/circuit-stats")
+async def get_circuit_stats():
+    """获取各服务商/模型的熔断状态（closed/open/half_open）和近期错误率、慢调用比例"""
+    return ai_service.get_circuit_stats()
+
 # 移除重复的标题生成路由，使用上面的generate_title函数
 
 @router.post("/suggestions", response_model=GetSuggestionsResponse)
@@ -340,12 +464,28 @@ async def generate_outline_stream(request: LegacyGenerateOutlineRequest):
 async def get_suggestions(request: GetSuggestionsRequest):
     """获取AI建议"""
     try:
-        suggestions = ai_service.get_ai_suggestions(request.current_content, request.suggestion_type)
+        suggestions = await ai_service.get_ai_suggestions_async(request.current_content, request.suggestion_type)
         return {"suggestions": suggestions}
     except Exception as e:
         logger.error(f"Suggestions generation error: {str(e)}")
         raise HTTPException(status_code=500, detail="Suggestions generation failed")
 
+@router.post("/suggestions-stream")
+async def get_suggestions_stream(request: GetSuggestionsRequest, last_event_id: Optional[str] = Header(None)):
+    """流式获取AI建议（与/suggestions共用缓存，相同的并发请求共享一次生成）"""
+    try:
+        content_generator = ai_service.get_ai_suggestions_stream_async(request.current_content, request.suggestion_type)
+        stream_gen = create_stream_generator(content_generator, "suggestion")
+        return stream_response(stream_gen, last_event_id)
+    except Exception as e:
+        logger.error(f"Suggestions stream error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Suggestions stream generation failed")
+
+@router.get("/suggestion-stats")
+async def get_suggestion_stats():
+    """获取AI建议的请求合并统计（实际生成次数、被合并的请求数和比例）"""
+    return ai_service.get_suggestion_stats()
+
 # === 章节管理相关API ===
 
 class SaveChapterRequest(BaseModel):
@@ -1,8 +1,10 @@
 # co-novel - AI服务
-# co-novel - AI服务
 import os
-from openai import OpenAI
-from typing import Iterator, Optional, List
+import re
+import json
+import asyncio
+import hashlib
+from typing import AsyncIterator, Iterator, Optional, List
 import random
 import time
 from datetime import datetime, timedelta
@@ -11,122 +13,554 @@ from datetime import datetime, timedelta
 from dotenv import load_dotenv
 load_dotenv()
 
+from utils.async_bridge import run_sync, iterate_sync
+from utils.singleflight import SingleFlight
+from utils.outline_parser import parse_outline, outline_window
+from utils.tokenizer import estimate_tokens, estimate_chat_tokens, truncate_tokens, TokenUsage, WordLimit, current_usage, split_chunks
+from services.rate_limiter import llm_scheduler
+from services.resilience import resilient_caller, classify_error
+from services.circuit_breaker import circuit_breakers, CircuitOpenError
+from services.provider_pool import provider_pool
+from services.model_router import model_router
+
 # 处理循环导入问题
 try:
     from models.novel import AIGenerationCache, NovelGenre
     from services.data_service import data_manager
+    from services.cache_service import cache_manager
 except ImportError:
     print("Warning: Some modules not available for import, using fallback mode")
     AIGenerationCache = None
     NovelGenre = None
     data_manager = None
+    cache_manager = None
+
+
+# 系统提示词
+NOVEL_SYSTEM_PROMPT = "你是一个擅长创作小说的AI助手。请根据用户的要求生成高质量的小说内容。"
+OUTLINE_SYSTEM_PROMPT = "你是一个擅长创作小说的AI助手。请根据用户的要求生成高质量的小说大纲。"
+TITLE_SYSTEM_PROMPT = "你是一个擅长为小说起名的AI助手。请严格按照要求的格式输出书名。"
+SUMMARY_SYSTEM_PROMPT = "你是一个擅长提炼小说情节的AI助手。请客观、简洁地概括，不要添加原文没有的内容。"
+
+# 生成章节摘要时最多截取的正文长度
+SUMMARY_SOURCE_CHARS = 4000
+
+# 模型输出标题时常带的序号和列表符号，如“1.”“2、”“- ”
+_TITLE_NOISE = re.compile(r"^\s*(?:\d+[.、)）:：]|[-*•·])\s*")
+
+# 失败时返回给用户的提示
+UNAVAILABLE_MESSAGE = "抱歉，AI服务暂时不可用，请检查配置。"
+ERROR_MESSAGE = "抱歉，AI生成内容时出现错误。"
+STREAM_ERROR_MESSAGE = "抱歉，AI流式生成内容时出现错误。"
+EMPTY_MESSAGE = "抱歉，AI生成内容为空。"
+
+
+class GenerationError(Exception):
+    """生成失败（服务不可用或上游出错）"""
+
+    def __init__(self, content_type: str, message: Optional[str] = None):
+        super().__init__(message or f"{content_type}生成失败")
+        self.content_type = content_type
+
+
+class StreamGenerationError(GenerationError):
+    """流式生成失败；已输出的部分不是完整内容，不能再接上备用内容或错误提示"""
+
+    def __init__(self, content_type: str, produced: int = 0):
+        super().__init__(content_type, f"{content_type}流式生成失败（已输出{produced}字）")
+        self.produced = produced
 
-# 初始化OpenAI客户端
-try:
-    client = OpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_BASE_URL")
-    )
-except:
-    client = None
-    print("Warning: OpenAI client initialization failed, using fallback mode")
 
 class AIService:
-    """AI服务类，用于与OpenAI API交互"""
+    """
+    AI服务类，用于与OpenAI API交互
+
+    所有生成方法都以异步实现（`*_async`，流式方法为异步生成器），供FastAPI路由
+    直接await，不阻塞事件循环。同名的同步方法保留给脚本使用，内部在后台事件循环中
+    执行对应的异步方法。
+    """
     
     def __init__(self):
-        self.client = client
+        # 可用的OpenAI兼容服务商，调用时按路由策略选择并自动故障切换
+        self.providers = provider_pool
         self.model = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+        # 按内容类型选择模型、max_tokens和temperature，并分路由统计用量
+        self.router = model_router
+        # 所有上游调用共用的并发与速率限制
+        self.scheduler = llm_scheduler
+        # 可重试错误的退避重试、截止时间和对冲请求
+        self.resilience = resilient_caller
+        # 按服务商和模型熔断，上游持续故障时切换服务商或直接走备用结果
+        self.circuit_breakers = circuit_breakers
+        # 章节提示词只带目标章节及前后各outline_window章的大纲
+        self.outline_window = int(os.getenv("CHAPTER_OUTLINE_WINDOW", "1"))
+        # 流式调用时请求上游在最后一个片段返回usage（stream_options.include_usage）
+        self.stream_usage = os.getenv("LLM_STREAM_USAGE", "true").lower() in ("true", "1", "yes")
+        # 章节未指定目标字数时使用；max_tokens按目标字数加上留给收尾的余量换算
+        self.chapter_word_target = int(os.getenv("CHAPTER_WORD_COUNT_TARGET", "1500"))
+        self.chapter_length_headroom = float(os.getenv("CHAPTER_LENGTH_HEADROOM", "0.25"))
+        # 流式返回备用内容时片段之间的间隔（秒）
+        self.fallback_stream_interval = float(os.getenv("FALLBACK_STREAM_INTERVAL", "0.03"))
+        # 编辑器频繁触发相同的建议请求：进行中或刚结束（窗口内）的相同请求共用一次生成
+        self.suggestion_flight = SingleFlight(float(os.getenv("SUGGESTION_DEDUPE_WINDOW", "2")))
+        
+        # 登记各类提示词的模板部分，近似缓存只比较用户输入带来的差异
+        if cache_manager is not None:
+            cache_manager.register_prompt_skeleton("outline", self._build_outline_prompt("", "", ""))
+            cache_manager.register_prompt_skeleton("suggestion", self._build_suggestion_prompt("", ""))
     
-    def _get_cached_content(self, content_type: str, **kwargs) -> Optional[str]:
+    def _get_cached_content(self, content_type: str, stream: bool = False, prompt: Optional[str] = None, **kwargs) -> Optional[str]:
         """
         获取缓存内容
         
         Args:
             content_type: 内容类型
+            stream: 是否来自流式接口
+            prompt: 渲染后的提示词，用于近似命中
             **kwargs: 缓存参数
             
         Returns:
             缓存的内容，如果没有缓存则返回None
         """
-        if data_manager is None:
+        if cache_manager is None:
             return None
             
         try:
-            # 使用AIGenerationCache生成缓存键
-            if AIGenerationCache is not None:
-                cache_key = AIGenerationCache.generate_cache_key(content_type, **kwargs)
-                cache = data_manager.get_cache(cache_key)
-                if cache:
-                    return cache.generated_content
+            return cache_manager.get(content_type, stream=stream, prompt=prompt, **kwargs)
         except Exception as e:
             print(f"获取缓存失败: {e}")
         
         return None
     
-    def _save_to_cache(self, content_type: str, content: str, **kwargs) -> bool:
+    def _save_to_cache(self, content_type: str, content: str, stream: bool = False, prompt: Optional[str] = None,
+                       latency: Optional[float] = None, **kwargs) -> bool:
         """
         保存内容到缓存
         
         Args:
             content_type: 内容类型
             content: 生成的内容
+            stream: 是否来自流式接口
+            prompt: 渲染后的提示词，用于近似命中
+            latency: 生成耗时（秒），用于统计命中后节省的延迟
             **kwargs: 缓存参数
             
         Returns:
             是否保存成功
         """
-        if data_manager is None or AIGenerationCache is None:
+        if cache_manager is None:
             return False
             
         try:
-            # 生成缓存键
-            cache_key = AIGenerationCache.generate_cache_key(content_type, **kwargs)
-            
-            # 保存到缓存
-            data_manager.save_cache(
-                cache_key=cache_key,
-                content_type=content_type,
-                content=content,
-                **kwargs
-            )
-            return True
+            return cache_manager.save(content_type, content, stream=stream, prompt=prompt, latency=latency, **kwargs)
         except Exception as e:
             print(f"保存缓存失败: {e}")
             return False
     
-    def generate_novel_content(self, prompt: str, max_tokens: int = 500) -> str:
+    def get_cache_stats(self) -> dict:
+        """获取各内容类型的缓存命中率"""
+        return cache_manager.get_stats() if cache_manager is not None else {}
+    
+    def get_scheduler_stats(self) -> dict:
+        """获取上游调用调度统计（队列深度、在途数、等待时间）"""
+        return self.scheduler.get_stats()
+    
+    def get_resilience_stats(self) -> dict:
+        """获取上游调用的重试、对冲和超时统计"""
+        return self.resilience.get_stats()
+    
+    def get_route_stats(self) -> dict:
+        """获取各内容类型的模型路由配置和用量（延迟、token、成本）"""
+        return self.router.get_stats()
+    
+    def get_provider_stats(self) -> dict:
+        """获取各服务商的健康状况（EWMA首字延迟、延迟、错误率）"""
+        return self.providers.get_stats()
+    
+    def get_circuit_stats(self) -> dict:
+        """获取各模型的熔断状态"""
+        return self.circuit_breakers.get_stats()
+    
+    def get_suggestion_stats(self) -> dict:
+        return self.suggestion_flight.get_stats()
+    
+    def get_cache_report(self) -> dict:
+        """获取完整的缓存观测报告"""
+        return cache_manager.get_report() if cache_manager is not None else {}
+    
+    def _fit_prompt(self, prompt: str, system_prompt: str, max_tokens: int, content_type: str) -> tuple:
         """
-        生成小说内容
+        按路由的token预算检查提示词，超出时保留开头和结尾、截断中间部分
+        
+        预算为上下文长度减去max_tokens，路由配置了max_prompt_tokens时取两者较小值。
+        
+        Returns:
+            (提示词, 估算的输入token数)
+        """
+        route = self.router.get(content_type)
+        prompt_tokens = estimate_chat_tokens(system_prompt, prompt)
+        budget = route.context_window - max_tokens
+        if route.max_prompt_tokens:
+            budget = min(budget, route.max_prompt_tokens)
+        if prompt_tokens <= budget:
+            return prompt, prompt_tokens
+        
+        overhead = prompt_tokens - estimate_tokens(prompt)
+        fitted = truncate_tokens(prompt, max(budget - overhead, 0))
+        fitted_tokens = estimate_chat_tokens(system_prompt, fitted)
+        self.router.record_truncation(content_type, prompt_tokens - fitted_tokens)
+        print(f"{content_type}提示词超出预算（{prompt_tokens} > {budget} token），已截断中间部分")
+        return fitted, fitted_tokens
+    
+    @staticmethod
+    def _record_breaker_failure(breaker, error: BaseException, started: Optional[float]):
+        """
+        按错误类型更新熔断器：上游故障计为失败，参数错误、本地排队拒绝等不计；
+        被截止时间取消的调用若已超过慢调用阈值也计为失败
+        """
+        if isinstance(error, Exception) and classify_error(error) is not None:
+            breaker.on_failure()
+        elif started is not None and time.monotonic() - started >= breaker.slow_call_seconds:
+            breaker.on_failure()
+        else:
+            breaker.on_ignored()
+    
+    async def _call_provider(self, model: str, tokens: int, stream: bool, invoke):
+        """
+        按路由顺序选择服务商执行一次调用，上游故障时切换到下一个服务商
         
         Args:
-            prompt: 生成内容的提示词
-            max_tokens: 最大生成token数
+            model: 模型名
+            tokens: 预计消耗的token数
+            stream: 是否流式调用（流式以首个片段的到达时间衡量延迟）
+            invoke: 接收客户端、返回调用结果的协程函数
             
         Returns:
-            生成的小说内容
+            (服务商, 调用结果)。流式调用成功时仍占用该服务商的许可，读完后需归还
+            
+        Raises:
+            所有候选服务商都失败时抛出最后一个错误；全部熔断时抛出CircuitOpenError
         """
-        if self.client is None:
-            return "抱歉，AI服务暂时不可用，请检查配置。"
+        last_error: Optional[BaseException] = None
+        for provider in self.providers.candidates(model, stream, tokens):
+            breaker = self.circuit_breakers.get(f"{provider.name}/{model}")
+            try:
+                # 熔断打开时直接跳过，不占用排队名额
+                breaker.before_call()
+            except CircuitOpenError as e:
+                last_error = e
+                continue
+            
+            started = None
+            try:
+                await provider.scheduler.acquire(tokens)
+            except BaseException as e:
+                self._record_breaker_failure(breaker, e, None)
+                raise
+            try:
+                started = time.monotonic()
+                result = await invoke(provider.client)
+            except BaseException as e:
+                provider.scheduler.release()
+                self._record_breaker_failure(breaker, e, started)
+                if isinstance(e, Exception) and classify_error(e) is not None:
+                    provider.record_failure()
+                    last_error = e
+                    print(f"服务商 {provider.name} 调用失败，尝试下一个: {e}")
+                    continue
+                raise
             
+            latency = time.monotonic() - started
+            breaker.on_success(latency)
+            provider.record_success(latency, stream)
+            if not stream:
+                provider.scheduler.release()
+            return provider, result
+        
+        raise last_error or RuntimeError(f"没有支持模型 {model} 的AI服务商")
+    
+    async def _request_completion(self, prompt: str, max_tokens: Optional[int] = None, system_prompt: str = NOVEL_SYSTEM_PROMPT,
+                                  content_type: str = "content") -> str:
+        """
+        调用模型生成完整内容，可重试的错误会自动重试，最终失败时抛出异常
+        
+        模型和temperature由内容类型的路由决定；max_tokens为None时使用路由的设置。
+        """
+        route = self.router.get(content_type)
+        max_tokens = max_tokens or route.max_tokens
+        prompt, prompt_tokens = self._fit_prompt(prompt, system_prompt, max_tokens, content_type)
+        tokens = prompt_tokens + max_tokens
+        
+        async def invoke(client):
+            return await client.chat.completions.create(
+                model=route.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=max_tokens,
+                temperature=route.temperature
+            )
+        
+        async def attempt():
+            async with self.scheduler.slot(tokens):
+                _, response = await self._call_provider(route.model, tokens, False, invoke)
+            return response
+        
+        started = time.monotonic()
         try:
-            # 使用Chat API更加稳定
-            response = self.client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
+            response = await self.resilience.call(content_type, attempt, hedge=True)
+        except Exception:
+            self.router.record(content_type, time.monotonic() - started, failed=True)
+            raise
+        content = response.choices[0].message.content
+        content = content.strip() if content else ""
+        self.router.record(content_type, time.monotonic() - started, prompt=system_prompt + prompt,
+                           completion=content, usage=getattr(response, "usage", None))
+        return content
+    
+    @staticmethod
+    async def _iter_stream_content(response, usage: Optional[TokenUsage] = None) -> AsyncIterator[str]:
+        """从流式响应中取出文本片段，上游在末尾返回的usage写入usage"""
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content is not None:
+                yield chunk.choices[0].delta.content
+            if usage is not None and getattr(chunk, "usage", None) is not None:
+                usage.set_upstream(chunk.usage)
+    
+    @staticmethod
+    async def _prepend(first: str, contents: AsyncIterator[str]) -> AsyncIterator[str]:
+        yield first
+        async for content in contents:
+            yield content
+    
+    @staticmethod
+    async def _close_stream(response):
+        close = getattr(response, "close", None)
+        if close is not None:
+            await close()
+    
+    async def _request_completion_stream(self, prompt: str, max_tokens: Optional[int] = None,
+                                         system_prompt: str = NOVEL_SYSTEM_PROMPT,
+                                         content_type: str = "content",
+                                         max_words: Optional[int] = None) -> AsyncIterator[str]:
+        """
+        调用模型流式生成内容，失败时抛出异常；提前结束迭代时关闭上游连接
+        
+        收到首个片段之前的错误会切换服务商或按重试策略重试，截止时间也只约束到首个片段；
+        已经输出部分内容后出错不再重试，避免重复输出。
+        设置max_words时，字数达到目标后在句末结束并关闭上游连接，不再为多余的输出付费。
+        """
+        route = self.router.get(content_type)
+        max_tokens = max_tokens or route.max_tokens
+        prompt, prompt_tokens = self._fit_prompt(prompt, system_prompt, max_tokens, content_type)
+        tokens = prompt_tokens + max_tokens
+        # 流式接口设置了当前请求的用量记录时写入其中，上游返回usage后以真实值为准
+        usage = current_usage.get() or TokenUsage()
+        usage.prompt_tokens = prompt_tokens
+        stream_options = {"stream_options": {"include_usage": True}} if self.stream_usage else {}
+        
+        async def invoke(client):
+            response = await client.chat.completions.create(
+                model=route.model,
                 messages=[
-                    {"role": "system", "content": "你是一个擅长创作小说的AI助手。请根据用户的要求生成高质量的小说内容。"},
+                    {"role": "system", "content": system_prompt},
                     {"role": "user", "content": prompt}
                 ],
                 max_tokens=max_tokens,
-                temperature=0.7
+                temperature=route.temperature,
+                stream=True,  # 启用流式响应
+                **stream_options
             )
-            content = response.choices[0].message.content
-            return content.strip() if content else "抱歉，AI生成内容为空。"
+            contents = self._iter_stream_content(response, usage)
+            try:
+                first = await contents.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except BaseException:
+                await self._close_stream(response)
+                raise
+            return response, contents, first
+        
+        async def open_stream():
+            # 流式调用在读完整个响应前一直占用许可
+            await self.scheduler.acquire(tokens)
+            try:
+                return await self._call_provider(route.model, tokens, True, invoke)
+            except BaseException:
+                self.scheduler.release()
+                raise
+        
+        started = time.monotonic()
+        try:
+            provider, (response, contents, first) = await self.resilience.call(f"{content_type}_stream", open_stream)
+        except Exception:
+            self.router.record(content_type, time.monotonic() - started, failed=True)
+            raise
+        
+        chunks = []
+        failed = False
+        cancelled = False
+        limit = WordLimit(max_words) if max_words else None
+        try:
+            if first is not None:
+                async for content in self._prepend(first, contents):
+                    if limit is not None:
+                        content = limit.clip(content)
+                    if content:
+                        chunks.append(content)
+                        yield content
+                    if limit is not None and limit.done:
+                        break
+        except (asyncio.CancelledError, GeneratorExit):
+            # 调用方不再读取（客户端断开），立即关闭上游，不再为后续输出付费
+            cancelled = True
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            completion = "".join(chunks)
+            cancelled_tokens = None
+            if cancelled:
+                cancelled_tokens = max_tokens - estimate_tokens(completion)
+                print(f"流式生成被取消({content_type})：已输出{len(completion)}字，未用的max_tokens约{cancelled_tokens}")
+            self.router.record(content_type, time.monotonic() - started, prompt=system_prompt + prompt,
+                               completion=completion, usage=usage.upstream, failed=failed,
+                               cancelled_tokens=cancelled_tokens)
+            await contents.aclose()
+            await self._close_stream(response)
+            provider.scheduler.release()
+            self.scheduler.release()
+    
+    def _error_message(self) -> str:
+        """生成失败时返回给用户的提示"""
+        return ERROR_MESSAGE if self.providers.available else UNAVAILABLE_MESSAGE
+    
+    async def _generate_with_cache(self, content_type: str, prompt: str, max_tokens: Optional[int],
+                                   cache_params: dict, system_prompt: str = NOVEL_SYSTEM_PROMPT) -> Optional[str]:
+        """
+        按缓存策略生成完整内容
+        
+        Args:
+            content_type: 内容类型
+            prompt: 提示词
+            max_tokens: 最大生成token数，为None时使用该类型路由的设置
+            cache_params: 缓存参数
+            system_prompt: 系统提示词
+            
+        Returns:
+            生成的内容；服务不可用或生成失败时返回None，失败结果不会写入缓存
+        """
+        cached_content = self._get_cached_content(content_type, prompt=prompt, **cache_params)
+        if cached_content:
+            return cached_content
+        
+        if not self.providers.available:
+            return None
+        
+        start_time = time.time()
+        try:
+            content = await self._request_completion(prompt, max_tokens, system_prompt, content_type)
         except Exception as e:
-            print(f"AI生成错误: {e}")
-            return "抱歉，AI生成内容时出现错误。"
+            print(f"AI生成错误({content_type}): {e}")
+            return None
+        
+        self._save_to_cache(content_type, content, prompt=prompt, latency=time.time() - start_time, **cache_params)
+        return content
     
-    def generate_novel_content_stream(self, prompt: str, max_tokens: int = 500) -> Iterator[str]:
+    async def _stream_with_cache(self, content_type: str, prompt: str, max_tokens: Optional[int], cache_params: dict,
+                                 system_prompt: str = NOVEL_SYSTEM_PROMPT, fallback: Optional[str] = None,
+                                 max_words: Optional[int] = None, raise_on_error: bool = False) -> AsyncIterator[str]:
+        """
+        按缓存策略流式生成内容
+        
+        缓存命中时直接返回缓存内容；完整生成成功后才写入缓存。
+        尚未输出任何内容时失败，返回备用内容或错误提示；已输出部分内容后失败，
+        抛出StreamGenerationError，不把备用内容拼接在已输出的内容之后。
+        raise_on_error为True时任何失败都抛出StreamGenerationError，供需要区分成败的调用方使用。
+        
+        Args:
+            content_type: 内容类型
+            prompt: 提示词
+            max_tokens: 最大生成token数，为None时使用该类型路由的设置
+            cache_params: 缓存参数
+            system_prompt: 系统提示词
+            fallback: 服务不可用或出错时返回的备用内容，为None时返回错误提示
+            max_words: 字数上限，达到后在句末提前结束
+            raise_on_error: 失败时抛出异常而不是返回备用内容或错误提示
+            
+        Yields:
+            生成的内容片段
+            
+        Raises:
+            StreamGenerationError: 已输出部分内容后生成失败，或raise_on_error为True时生成失败
+        """
+        cached_content = self._get_cached_content(content_type, stream=True, prompt=prompt, **cache_params)
+        if cached_content:
+            yield cached_content
+            return
+        
+        if not self.providers.available:
+            if raise_on_error:
+                raise StreamGenerationError(content_type)
+            if fallback is not None:
+                async for chunk in self._iter_fallback(fallback):
+                    yield chunk
+            else:
+                yield UNAVAILABLE_MESSAGE
+            return
+        
+        chunks = []
+        start_time = time.time()
+        try:
+            async for chunk in self._request_completion_stream(prompt, max_tokens, system_prompt, content_type, max_words):
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            print(f"AI流式生成错误({content_type}): {e}")
+            if chunks or raise_on_error:
+                raise StreamGenerationError(content_type, sum(len(chunk) for chunk in chunks)) from e
+            if fallback is not None:
+                async for chunk in self._iter_fallback(fallback):
+                    yield chunk
+            else:
+                yield STREAM_ERROR_MESSAGE
+            return
+        
+        self._save_to_cache(content_type, "".join(chunks), stream=True, prompt=prompt,
+                            latency=time.time() - start_time, **cache_params)
+    
+    async def _iter_fallback(self, text: str) -> AsyncIterator[str]:
+        """
+        按短句返回备用内容
+        
+        上游故障时所有流式请求都会走到这里。片段之间的间隔用asyncio.sleep等待，
+        不占用线程；间隔为0时一次性输出全部片段。
+        """
+        for i, chunk in enumerate(split_chunks(text)):
+            if i and self.fallback_stream_interval > 0:
+                await asyncio.sleep(self.fallback_stream_interval)  # 模拟流式效果
+            yield chunk
+    
+    async def generate_novel_content_async(self, prompt: str, max_tokens: int = 500) -> str:
+        """
+        生成小说内容
+        
+        Args:
+            prompt: 生成内容的提示词
+            max_tokens: 最大生成token数
+            
+        Returns:
+            生成的小说内容
+        """
+        cache_params = {"user_prompt": prompt, "max_tokens": max_tokens}
+        content = await self._generate_with_cache("content", prompt, max_tokens, cache_params)
+        if content is None:
+            return self._error_message()
+        return content or EMPTY_MESSAGE
+    
+    async def generate_novel_content_stream_async(self, prompt: str, max_tokens: int = 500) -> AsyncIterator[str]:
         """
         流式生成小说内容
         
@@ -137,99 +571,85 @@ class AIService:
         Yields:
             生成的小说内容片段
         """
-        if self.client is None:
-            yield "抱歉，AI服务暂时不可用，请检查配置。"
-            return
-            
-        try:
-            # 使用Chat API的流式模式
-            response = self.client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
-                messages=[
-                    {"role": "system", "content": "你是一个擅长创作小说的AI助手。请根据用户的要求生成高质量的小说内容。"},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=max_tokens,
-                temperature=0.7,
-                stream=True  # 启用流式响应
-            )
-            for chunk in response:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
-        except Exception as e:
-            print(f"AI流式生成错误: {e}")
-            yield "抱歉，AI流式生成内容时出现错误。"
+        cache_params = {"user_prompt": prompt, "max_tokens": max_tokens}
+        async for chunk in self._stream_with_cache("content", prompt, max_tokens, cache_params):
+            yield chunk
     
-    def generate_novel_title(self, genre: str, theme: str) -> str:
+    @staticmethod
+    def _title_pools(genre: str, theme: str) -> List[List[str]]:
         """
-        生成小说标题
+        模板标题池，与主题匹配的池排在最前面
         
         Args:
             genre: 小说类型
             theme: 小说主题
             
         Returns:
-            生成的小说标题
+            标题池列表，第一个为最匹配主题的池
         """
-        print(f"正在为{genre}类型、主题'{theme}'生成标题...")
+        weak_to_strong = [
+            "《弱者逆天》",
+            "《逆袭称尊》", 
+            "《弱者为王》",
+            "《逆天战神》",
+            "《底层逆袭》",
+            "《绝世逆袭》",
+            "《弱者称雄》",
+            "《逆天传说》",
+            "《蚁族崛起》",
+            "《废柴逆袭》"
+        ]
+        cultivation = [
+            "《逆天修神》",
+            "《仙路逆袭》",
+            "《修真狂潮》",
+            "《逆天仙尊》"
+        ]
+        rebirth = [
+            "《重生称尊》",
+            "《逆天重生》",
+            "《重生战神》"
+        ]
+        # 通用玄幻标题
+        general = [
+            f"《{genre}传奇》",
+            f"《{genre}战神》", 
+            f"《{genre}至尊》",
+            f"《{genre}霸主》"
+        ]
         
-        # 智能标题生成逻辑，根据主题生成合适的标题
+        # 智能标题生成逻辑，根据主题选择合适的标题池
         if "最弱" in theme and "最强" in theme:
-            titles_pool = [
-                "《弱者逆天》",
-                "《逆袭称尊》", 
-                "《弱者为王》",
-                "《逆天战神》",
-                "《底层逆袭》",
-                "《绝世逆袭》",
-                "《弱者称雄》",
-                "《逆天传说》",
-                "《蚁族崛起》",
-                "《废柴逆袭》"
-            ]
-            result = random.choice(titles_pool)
+            primary = weak_to_strong
         elif "修炼" in theme or "修仙" in theme:
-            titles_pool = [
-                "《逆天修神》",
-                "《仙路逆袭》",
-                "《修真狂潮》",
-                "《逆天仙尊》"
-            ]
-            result = random.choice(titles_pool)
+            primary = cultivation
         elif "重生" in theme:
-            titles_pool = [
-                "《重生称尊》",
-                "《逆天重生》",
-                "《重生战神》"
-            ]
-            result = random.choice(titles_pool)
+            primary = rebirth
         else:
-            # 通用玄幻标题
-            titles_pool = [
-                f"《{genre}传奇》",
-                f"《{genre}战神》", 
-                f"《{genre}至尊》",
-                f"《{genre}霸主》"
-            ]
-            result = random.choice(titles_pool)
-        
-        print(f"生成的标题: {result}")
-        return result
+            primary = general
+        return [primary] + [pool for pool in (weak_to_strong, cultivation, rebirth, general) if pool is not primary]
     
-    def generate_novel_outline(self, genre: str, theme: str, title: str) -> str:
+    def generate_novel_title(self, genre: str, theme: str) -> str:
         """
-        生成小说大纲
+        生成小说标题
         
         Args:
             genre: 小说类型
             theme: 小说主题
-            title: 小说标题
             
         Returns:
-            生成的小说大纲
+            生成的小说标题
         """
-        try:
-            prompt = f"""请为以下小说生成简洁的章节大纲：
+        print(f"正在为{genre}类型、主题'{theme}'生成标题...")
+        
+        result = random.choice(self._title_pools(genre, theme)[0])
+        
+        print(f"生成的标题: {result}")
+        return result
+    
+    def _build_outline_prompt(self, genre: str, theme: str, title: str) -> str:
+        """构造大纲生成提示词"""
+        return f"""请为以下小说生成简洁的章节大纲：
 
 标题：{title}
 类型：{genre}
@@ -251,10 +671,10 @@ class AIService:
 [一句话概括，30字以内]
 
 ..."""
-            return self.generate_novel_content(prompt, 400)
-        except Exception as e:
-            # 提供fallback大纲
-            fallback_outline = f"""第一章：初入{genre}世界
+    
+    def _build_fallback_outline(self, genre: str, theme: str) -> str:
+        """AI不可用时使用的备用大纲"""
+        return f"""第一章：初入{genre}世界
 主角意外发现自己的特殊能力，开始{theme}的旅程。
 
 第二章：初试身手
@@ -268,9 +688,29 @@ class AIService:
 
 第五章：绝地反击
 主角在绝境中爆发潜力，完成不可能的逆转。"""
-            return fallback_outline
     
-    def generate_novel_outline_stream(self, genre: str, theme: str, title: str) -> Iterator[str]:
+    async def generate_novel_outline_async(self, genre: str, theme: str, title: str,
+                                           raise_on_error: bool = False) -> str:
+        """
+        生成小说大纲
+        
+        Args:
+            genre: 小说类型
+            theme: 小说主题
+            title: 小说标题
+            raise_on_error: 失败时抛出GenerationError，而不是返回备用大纲
+            
+        Returns:
+            生成的小说大纲，生成失败时返回备用大纲
+        """
+        prompt = self._build_outline_prompt(genre, theme, title)
+        cache_params = {"genre": genre, "theme": theme, "title": title}
+        outline = await self._generate_with_cache("outline", prompt, None, cache_params, OUTLINE_SYSTEM_PROMPT)
+        if outline is None and raise_on_error:
+            raise GenerationError("outline")
+        return outline or self._build_fallback_outline(genre, theme)
+    
+    async def generate_novel_outline_stream_async(self, genre: str, theme: str, title: str) -> AsyncIterator[str]:
         """
         流式生成小说大纲
         
@@ -282,93 +722,83 @@ class AIService:
         Yields:
             生成的小说大纲片段
         """
-        prompt = f"""请为以下小说生成简洁的章节大纲：
-
-标题：{title}
-类型：{genre}
-主题：{theme}
-
-要求：
-1. 生成5-8章的简洁大纲
-2. 每章只需章节标题和一句话概括
-3. 情节要连贯，逻辑合理
-4. 符合{genre}类型的特点
-5. 围绕{theme}这个主题展开
-6. 每章概括控制在30字以内
-
-请用以下格式输出：
-第一章：[章节标题]
-[一句话概括，30字以内]
+        prompt = self._build_outline_prompt(genre, theme, title)
+        cache_params = {"genre": genre, "theme": theme, "title": title}
+        async for chunk in self._stream_with_cache(
+            "outline", prompt, None, cache_params,
+            system_prompt=OUTLINE_SYSTEM_PROMPT,
+            fallback=self._build_fallback_outline(genre, theme)
+        ):
+            yield chunk
+    
+    def _chapter_outline(self, outline: str, chapter_number: int) -> Optional[str]:
+        """大纲中与目标章节相关的片段，大纲格式无法识别或没有该章时返回None"""
+        return outline_window(parse_outline(outline), chapter_number, self.outline_window)
+    
+    def _chapter_length(self, word_count_target: Optional[int]) -> tuple:
+        """
+        章节的目标字数和max_tokens
 
-第二章：[章节标题]
-[一句话概括，30字以内]
+        max_tokens按模型实际的字符/token比例换算，并留出chapter_length_headroom的余量
+        让模型写完最后一句；流式生成在达到目标字数后的句末提前结束。
+        chapter路由配置了max_tokens时，以它作为上限。
 
-..."""
+        Returns:
+            (目标字数, max_tokens)
+        """
+        target = word_count_target or self.chapter_word_target
+        max_tokens = self.router.max_tokens_for_words("chapter", int(target * (1 + self.chapter_length_headroom)))
+        limit = self.router.get("chapter").max_tokens
+        return target, min(max_tokens, limit) if limit else max_tokens
+    
+    def _build_chapter_prompt(self, title: str, outline: str, chapter_number: int, custom_title: Optional[str] = None,
+                              story_context: Optional[str] = None, word_count_target: Optional[int] = None) -> str:
+        """构造章节生成提示词"""
+        word_count_target = word_count_target or self.chapter_word_target
+        chapter_title = custom_title or f"第{chapter_number}章"
         
-        if self.client is None:
-            # 使用fallback大纲，逐字符返回
-            fallback_outline = f"""第一章：初入{genre}世界
-主角意外发现自己的特殊能力，开始{theme}的旅程。
-
-第二章：初试身手
-主角遇到挑战，凭借智慧和勇气取得意想不到的胜利。
-
-第三章：奇遇获宝
-主角获得珍贵的宝物或传承，实力开始提升。
-
-第四章：强敌来袭
-主角遇到强大敌人，体现"{theme}"的核心精神。
-
-第五章：绝地反击
-主角在绝境中爆发潜力，完成不可能的逆转。"""
-            
-            # 逐字符返回
-            import time
-            for char in fallback_outline:
-                yield char
-                time.sleep(0.01)  # 模拟流式效果
-            return
-            
-        try:
-            # 使用Chat API的流式模式
-            response = self.client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
-                messages=[
-                    {"role": "system", "content": "你是一个擅长创作小说的AI助手。请根据用户的要求生成高质量的小说大纲。"},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=400,
-                temperature=0.7,
-                stream=True
-            )
-            for chunk in response:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
-        except Exception as e:
-            print(f"AI流式生成大纲错误: {e}")
-            # 使用fallback大纲，逐字符返回
-            fallback_outline = f"""第一章：初入{genre}世界
-主角意外发现自己的特殊能力，开始{theme}的旅程。
+        # 长大纲只保留本章及相邻章节，减少提示词token
+        section = self._chapter_outline(outline, chapter_number)
+        outline_text = f"章节大纲{section}" if section else f"完整大纲：\n{outline}"
+        # 前面章节实际写了什么，用摘要代替原文
+        if story_context:
+            outline_text = f"前情提要：\n{story_context}\n\n{outline_text}"
+        
+        return f"""请根据以下信息写{chapter_title}的完整内容：
 
-第二章：初试身手
-主角遇到挑战，凭借智慧和勇气取得意想不到的胜利。
+小说标题：{title}
 
-第三章：奇遇获宝
-主角获得珍贵的宝物或传承，实力开始提升。
+{outline_text}
 
-第四章：强敌来袭
-主角遇到强大敌人，体现"{theme}"的核心精神。
+要求：
+1. 写出{chapter_title}的完整内容，约{word_count_target}字
+2. 内容要生动有趣，有对话和场景描写
+3. 严格按照大纲中第{chapter_number}章的情节发展
+4. 文笔流畅，符合现代小说的写作风格
+5. 如果是第一章，要有引人入胜的开头
 
-第五章：绝地反击
-主角在绝境中爆发潜力，完成不可能的逆转。"""
-            
-            # 逐字符返回
-            import time
-            for char in fallback_outline:
-                yield char
-                time.sleep(0.01)  # 模拟流式效果
+请直接输出章节内容，不需要额外的说明："""
+    
+    def _chapter_cache_params(self, title: str, outline: str, chapter_number: int, custom_title: Optional[str] = None,
+                              word_count_target: Optional[int] = None) -> dict:
+        """章节缓存参数"""
+        # 能解析出章节时以相关片段作为键，修改其他章节的大纲不影响本章缓存
+        section = self._chapter_outline(outline, chapter_number)
+        params = {
+            "title": title,
+            "outline": section or outline[:200],  # 无法解析时使用大纲前200字符作为缓存键的一部分
+            "chapter_number": chapter_number,
+            # 前端“生成下一章”会传空字符串，与未填写视为同一个键
+            "custom_title": custom_title or None
+        }
+        # 默认字数不计入键，与预取的章节和已有缓存保持一致
+        if word_count_target and word_count_target != self.chapter_word_target:
+            params["word_count_target"] = word_count_target
+        return params
     
-    def generate_chapter_content(self, title: str, outline: str, chapter_number: int = 1, custom_title: Optional[str] = None) -> str:
+    async def generate_chapter_content_async(self, title: str, outline: str, chapter_number: int = 1, custom_title: Optional[str] = None,
+                                             story_context: Optional[str] = None, word_count_target: Optional[int] = None,
+                                             raise_on_error: bool = False) -> str:
         """
         根据大纲生成指定章节的内容
         
@@ -377,47 +807,28 @@ class AIService:
             outline: 小说大纲
             chapter_number: 章节号
             custom_title: 自定义章节标题
+            story_context: 前情提要，为空时只根据大纲生成
+            word_count_target: 目标字数，为空时使用CHAPTER_WORD_COUNT_TARGET
+            raise_on_error: 失败时抛出GenerationError，而不是返回错误提示
             
         Returns:
             生成的章节内容
         """
-        # 检查缓存
-        cache_params = {
-            "title": title,
-            "outline": outline[:200],  # 使用大纲前200字符作为缓存键的一部分
-            "chapter_number": chapter_number,
-            "custom_title": custom_title
-        }
-        cached_content = self._get_cached_content("chapter", **cache_params)
-        if cached_content:
-            return cached_content
-        
-        chapter_title = custom_title or f"第{chapter_number}章"
-        
-        prompt = f"""请根据以下信息写{chapter_title}的完整内容：
-
-小说标题：{title}
-
-完整大纲：
-{outline}
-
-要求：
-1. 写出{chapter_title}的完整内容，约1000-1500字
-2. 内容要生动有趣，有对话和场景描写
-3. 严格按照大纲中第{chapter_number}章的情节发展
-4. 文笔流畅，符合现代小说的写作风格
-5. 如果是第一章，要有引人入胜的开头
-
-请直接输出章节内容，不需要额外的说明："""
-        
-        result = self.generate_novel_content(prompt, 1200)
-        
-        # 保存到缓存
-        self._save_to_cache("chapter", result, **cache_params)
-        
-        return result
+        # 前情提要只影响内容的连贯性，不计入缓存键，预取的章节仍能命中
+        target, max_tokens = self._chapter_length(word_count_target)
+        prompt = self._build_chapter_prompt(title, outline, chapter_number, custom_title, story_context, target)
+        cache_params = self._chapter_cache_params(title, outline, chapter_number, custom_title, target)
+        content = await self._generate_with_cache("chapter", prompt, max_tokens, cache_params)
+        if content is None:
+            if raise_on_error:
+                raise GenerationError("chapter")
+            return self._error_message()
+        return content or EMPTY_MESSAGE
     
-    def generate_chapter_content_stream(self, title: str, outline: str, chapter_number: int = 1, custom_title: Optional[str] = None) -> Iterator[str]:
+    async def generate_chapter_content_stream_async(self, title: str, outline: str, chapter_number: int = 1, custom_title: Optional[str] = None,
+                                                    story_context: Optional[str] = None,
+                                                    word_count_target: Optional[int] = None,
+                                                    raise_on_error: bool = False) -> AsyncIterator[str]:
         """
         流式生成章节内容
         
@@ -426,48 +837,199 @@ class AIService:
             outline: 小说大纲
             chapter_number: 章节号
             custom_title: 自定义章节标题
+            story_context: 前情提要，为空时只根据大纲生成
+            word_count_target: 目标字数，为空时使用CHAPTER_WORD_COUNT_TARGET；达到后在句末结束
+            raise_on_error: 失败时抛出StreamGenerationError，而不是把错误提示当作章节内容返回
             
         Yields:
             生成的章节内容片段
         """
-        chapter_title = custom_title or f"第{chapter_number}章"
+        target, max_tokens = self._chapter_length(word_count_target)
+        prompt = self._build_chapter_prompt(title, outline, chapter_number, custom_title, story_context, target)
+        cache_params = self._chapter_cache_params(title, outline, chapter_number, custom_title, target)
+        async for chunk in self._stream_with_cache("chapter", prompt, max_tokens, cache_params, max_words=target,
+                                                   raise_on_error=raise_on_error):
+            yield chunk
+    
+    async def prefetch_chapter_content_async(self, title: str, outline: str, chapter_number: int) -> bool:
+        """
+        预先生成章节内容并写入缓存
+        
+        Args:
+            title: 小说标题
+            outline: 小说大纲
+            chapter_number: 章节号
+            
+        Returns:
+            是否新生成了内容（已有缓存或生成失败时返回False）
+        """
+        if cache_manager is None or not self.providers.available:
+            return False
+        
+        cache_params = self._chapter_cache_params(title, outline, chapter_number)
+        if cache_manager.contains("chapter", **cache_params):
+            return False
         
-        prompt = f"""请根据以下信息写{chapter_title}的完整内容：
+        prompt = self._build_chapter_prompt(title, outline, chapter_number)
+        _, max_tokens = self._chapter_length(None)
+        start_time = time.time()
+        try:
+            content = await self._request_completion(prompt, max_tokens, content_type="chapter")
+        except Exception as e:
+            print(f"章节预取失败: {e}")
+            return False
+        
+        if not self._save_to_cache("chapter", content, prompt=prompt,
+                                   latency=time.time() - start_time, **cache_params):
+            return False
+        cache_manager.mark_prefetched("chapter", **cache_params)
+        return True
+    
+    def is_chapter_cached(self, title: str, outline: str, chapter_number: int) -> bool:
+        """章节是否已在缓存中（不计入命中统计）"""
+        if cache_manager is None:
+            return False
+        return cache_manager.contains("chapter", **self._chapter_cache_params(title, outline, chapter_number))
 
-小说标题：{title}
+    def _build_chapter_summary_prompt(self, chapter_number: int, content: str) -> str:
+        """构造章节摘要提示词"""
+        return f"""请用不超过150字概括小说第{chapter_number}章的内容：
 
-完整大纲：
-{outline}
+{content[:SUMMARY_SOURCE_CHARS]}
 
 要求：
-1. 写出{chapter_title}的完整内容，约1000-1500字
-2. 内容要生动有趣，有对话和场景描写
-3. 严格按照大纲中第{chapter_number}章的情节发展
-4. 文笔流畅，符合现代小说的写作风格
-5. 如果是第一章，要有引人入胜的开头
+1. 写清楚发生了什么、涉及哪些人物、结尾停在什么状态
+2. 保留后续章节需要衔接的伏笔、人物关系和物品
+3. 只输出摘要，不需要额外的说明"""
+    
+    def _build_story_summary_prompt(self, story_summary: str, chapter_summaries: List[str]) -> str:
+        """构造前情提要合并提示词"""
+        previous = story_summary or "（无）"
+        new_parts = "\n".join(chapter_summaries)
+        return f"""请把已有的前情提要和新增章节的摘要合并为一份新的前情提要：
 
-请直接输出章节内容，不需要额外的说明："""
+已有的前情提要：
+{previous}
+
+新增章节摘要：
+{new_parts}
+
+要求：
+1. 不超过400字，按时间顺序叙述
+2. 越早的情节越简略，保留仍在影响后续剧情的人物、关系和伏笔
+3. 只输出前情提要，不需要额外的说明"""
+    
+    async def _summarize(self, prompt: str) -> Optional[str]:
+        """调用摘要路由，失败或服务不可用时返回None"""
+        if not self.providers.available:
+            return None
+        try:
+            summary = await self._request_completion(prompt, system_prompt=SUMMARY_SYSTEM_PROMPT, content_type="summary")
+        except Exception as e:
+            print(f"摘要生成失败: {e}")
+            return None
+        return summary.strip() or None
+    
+    async def summarize_chapter_async(self, chapter_number: int, content: str) -> Optional[str]:
+        """
+        生成章节摘要
         
-        # 使用流式生成内容方法
-        full_content = ""
-        for chunk in self.generate_novel_content_stream(prompt, 1200):
-            full_content += chunk
-            yield chunk
+        Args:
+            chapter_number: 章节号
+            content: 章节正文
+            
+        Returns:
+            章节摘要，生成失败时返回None
+        """
+        if not content or not content.strip():
+            return None
+        return await self._summarize(self._build_chapter_summary_prompt(chapter_number, content))
+    
+    async def merge_story_summary_async(self, story_summary: str, chapter_summaries: List[str]) -> Optional[str]:
+        """
+        把新增章节的摘要合并进前情提要
         
-        # 保存到缓存（可选）
-        if full_content.strip():
-            cache_params = {
-                "title": title,
-                "outline": outline[:200],
-                "chapter_number": chapter_number,
-                "custom_title": custom_title
-            }
-            self._save_to_cache("chapter_stream", full_content, **cache_params)
+        Args:
+            story_summary: 已有的前情提要
+            chapter_summaries: 按顺序排列的章节摘要，每条以“第N章：”开头
+            
+        Returns:
+            新的前情提要，生成失败时返回None
+        """
+        return await self._summarize(self._build_story_summary_prompt(story_summary, chapter_summaries))
 
-    def generate_multiple_titles(self, genre: str, theme: str, count: int = 3) -> List[str]:
+    def _build_titles_prompt(self, genre: str, theme: str, count: int) -> str:
+        """构造批量标题生成提示词"""
+        return f"""请为以下小说构思{count}个不同的书名：
+
+类型：{genre}
+主题：{theme}
+
+要求：
+1. 每个书名2-8个字，符合{genre}类型的风格
+2. 书名之间不能重复，也不要只差一两个字
+3. 只输出JSON字符串数组，不要任何解释，例如：["书名一", "书名二"]"""
+    
+    @staticmethod
+    def _parse_titles(text: str) -> List[str]:
+        """
+        从模型输出中解析标题列表
+        
+        优先按JSON数组解析，失败时按行解析并去掉序号、引号等符号。
+        返回的标题统一为《》包裹，已去重并保持原有顺序。
+        """
+        items: List[str] = []
+        start, end = text.find("["), text.rfind("]")
+        if start != -1 and end > start:
+            try:
+                parsed = json.loads(text[start:end + 1])
+                if isinstance(parsed, list):
+                    items = [str(item) for item in parsed]
+            except json.JSONDecodeError:
+                items = []
+        if not items:
+            items = text.splitlines()
+        
+        titles: List[str] = []
+        seen = set()
+        for item in items:
+            if item.rstrip().endswith((":", "：")):
+                continue  # “以下是书名：”之类的引导语
+            core = _TITLE_NOISE.sub("", item.strip())
+            core = core.strip(" \t\"'“”‘’《》「」[],，。")
+            if not 2 <= len(core) <= 15 or core in seen:
+                continue
+            seen.add(core)
+            titles.append(f"《{core}》")
+        return titles
+    
+    def _top_up_titles(self, titles: List[str], genre: str, theme: str, count: int) -> List[str]:
+        """用模板标题池补足到count个互不相同的标题"""
+        seen = {title.strip("《》") for title in titles}
+        for pool in self._title_pools(genre, theme):
+            for title in random.sample(pool, len(pool)):
+                if len(titles) >= count:
+                    return titles
+                if title.strip("《》") not in seen:
+                    seen.add(title.strip("《》"))
+                    titles.append(title)
+        # 模板池也用完时按序号补足，保证数量
+        number = 2
+        while len(titles) < count:
+            title = f"《{genre}传奇{number}》"
+            if title.strip("《》") not in seen:
+                seen.add(title.strip("《》"))
+                titles.append(title)
+            number += 1
+        return titles
+    
+    async def generate_multiple_titles_async(self, genre: str, theme: str, count: int = 3) -> List[str]:
         """
         生成多个小说标题
         
+        一次模型调用批量生成标题，解析去重后不足的部分用模板标题补足，
+        保证返回恰好count个互不相同的标题。模型不可用时全部来自模板。
+        
         Args:
             genre: 小说类型
             theme: 小说主题
@@ -476,17 +1038,44 @@ class AIService:
         Returns:
             标题列表
         """
-        titles = []
-        for _ in range(count):
-            title = self.generate_novel_title(genre, theme)
-            if title not in titles:  # 避免重复
-                titles.append(title)
-        return titles
+        cache_params = {"genre": genre, "theme": theme, "count": count}
+        cached_titles = self._get_cached_content("title", **cache_params)
+        if cached_titles:
+            return cached_titles.split("\n")
+        
+        titles: List[str] = []
+        if self.providers.available:
+            # 多要两个，抵消重复和不合格的结果
+            prompt = self._build_titles_prompt(genre, theme, count + 2)
+            start_time = time.time()
+            try:
+                text = await self._request_completion(prompt, system_prompt=TITLE_SYSTEM_PROMPT, content_type="title")
+                titles = self._parse_titles(text)[:count]
+            except Exception as e:
+                print(f"AI生成错误(title): {e}")
+            if len(titles) == count:
+                self._save_to_cache("title", "\n".join(titles), prompt=prompt,
+                                    latency=time.time() - start_time, **cache_params)
+        
+        return self._top_up_titles(titles, genre, theme, count)
     
-    def get_ai_suggestions(self, current_content: str, suggestion_type: str) -> str:
+    def _build_suggestion_prompt(self, current_content: str, suggestion_type: str) -> str:
+        """构造AI建议提示词"""
+        return f"基于以下内容，{suggestion_type}：\n\n{current_content}"
+    
+    @staticmethod
+    def _suggestion_cache_params(current_content: str, suggestion_type: str) -> dict:
+        """建议的缓存参数：当前内容可能是整章，只用其哈希"""
+        content_hash = hashlib.sha256(current_content.encode("utf-8")).hexdigest()
+        return {"content_hash": content_hash, "suggestion_type": suggestion_type}
+    
+    async def get_ai_suggestions_async(self, current_content: str, suggestion_type: str) -> str:
         """
         获取AI建议
         
+        按(当前内容的哈希, 建议类型)缓存；同时到达的相同请求只调用一次上游。
+        失败时正在等待的相同请求都返回错误提示，之后的请求重新生成。
+        
         Args:
             current_content: 当前内容
             suggestion_type: 建议类型（如：续写、修改、扩展等）
@@ -494,5 +1083,101 @@ class AIService:
         Returns:
             AI建议内容
         """
-        prompt = f"基于以下内容，{suggestion_type}：\n\n{current_content}"
-        return self.generate_novel_content(prompt, 300)
\ No newline at end of file
+        prompt = self._build_suggestion_prompt(current_content, suggestion_type)
+        cache_params = self._suggestion_cache_params(current_content, suggestion_type)
+        
+        async def generate() -> str:
+            suggestions = await self._generate_with_cache("suggestion", prompt, None, cache_params)
+            if suggestions is None:
+                # 以异常结束，合并窗口内不复用失败的结果
+                raise GenerationError("suggestion")
+            return suggestions
+        
+        try:
+            suggestions = await self.suggestion_flight.do(("complete", *cache_params.values()), generate)
+        except GenerationError:
+            return self._error_message()
+        return suggestions or EMPTY_MESSAGE
+    
+    async def get_ai_suggestions_stream_async(self, current_content: str, suggestion_type: str) -> AsyncIterator[str]:
+        """
+        流式获取AI建议
+        
+        与get_ai_suggestions_async共用缓存；同时到达的相同请求共享同一次流式生成，
+        后到的请求先收到已生成的部分。所有请求都断开时停止生成。
+        失败的生成不在合并窗口内复用：尚未输出内容时返回错误提示，已输出部分内容时抛出异常。
+        
+        Yields:
+            建议内容片段
+            
+        Raises:
+            StreamGenerationError: 已输出部分内容后生成失败
+        """
+        prompt = self._build_suggestion_prompt(current_content, suggestion_type)
+        cache_params = self._suggestion_cache_params(current_content, suggestion_type)
+        shared = self.suggestion_flight.stream(
+            ("stream", *cache_params.values()),
+            lambda: self._stream_with_cache("suggestion", prompt, None, cache_params, raise_on_error=True)
+        )
+        produced = False
+        try:
+            async for chunk in shared:
+                produced = True
+                yield chunk
+        except StreamGenerationError:
+            if produced:
+                raise
+            yield STREAM_ERROR_MESSAGE if self.providers.available else UNAVAILABLE_MESSAGE
+        finally:
+            await shared.aclose()
+    
+    # === 同步接口（供脚本和后台线程使用） ===
+    
+    def generate_novel_content(self, prompt: str, max_tokens: int = 500) -> str:
+        """生成小说内容（同步版本）"""
+        return run_sync(self.generate_novel_content_async(prompt, max_tokens))
+    
+    def generate_novel_content_stream(self, prompt: str, max_tokens: int = 500) -> Iterator[str]:
+        """流式生成小说内容（同步版本）"""
+        return iterate_sync(self.generate_novel_content_stream_async(prompt, max_tokens))
+    
+    def generate_novel_outline(self, genre: str, theme: str, title: str) -> str:
+        """生成小说大纲（同步版本）"""
+        return run_sync(self.generate_novel_outline_async(genre, theme, title))
+    
+    def generate_novel_outline_stream(self, genre: str, theme: str, title: str) -> Iterator[str]:
+        """流式生成小说大纲（同步版本）"""
+        return iterate_sync(self.generate_novel_outline_stream_async(genre, theme, title))
+    
+    def generate_chapter_content(self, title: str, outline: str, chapter_number: int = 1, custom_title: Optional[str] = None,
+                                 story_context: Optional[str] = None, word_count_target: Optional[int] = None) -> str:
+        """生成章节内容（同步版本）"""
+        return run_sync(self.generate_chapter_content_async(title, outline, chapter_number, custom_title, story_context,
+                                                            word_count_target))
+    
+    def generate_chapter_content_stream(self, title: str, outline: str, chapter_number: int = 1, custom_title: Optional[str] = None,
+                                        story_context: Optional[str] = None,
+                                        word_count_target: Optional[int] = None) -> Iterator[str]:
+        """流式生成章节内容（同步版本）"""
+        return iterate_sync(self.generate_chapter_content_stream_async(title, outline, chapter_number, custom_title, story_context,
+                                                                       word_count_target))
+    
+    def prefetch_chapter_content(self, title: str, outline: str, chapter_number: int) -> bool:
+        """预先生成章节内容并写入缓存（同步版本）"""
+        return run_sync(self.prefetch_chapter_content_async(title, outline, chapter_number))
+    
+    def summarize_chapter(self, chapter_number: int, content: str) -> Optional[str]:
+        """生成章节摘要（同步版本）"""
+        return run_sync(self.summarize_chapter_async(chapter_number, content))
+    
+    def merge_story_summary(self, story_summary: str, chapter_summaries: List[str]) -> Optional[str]:
+        """把新增章节的摘要合并进前情提要（同步版本）"""
+        return run_sync(self.merge_story_summary_async(story_summary, chapter_summaries))
+    
+    def generate_multiple_titles(self, genre: str, theme: str, count: int = 3) -> List[str]:
+        """生成多个小说标题（同步版本）"""
+        return run_sync(self.generate_multiple_titles_async(genre, theme, count))
+    
+    def get_ai_suggestions(self, current_content: str, suggestion_type: str) -> str:
+        """获取AI建议（同步版本）"""
+        return run_sync(self.get_ai_suggestions_async(current_content, suggestion_type))
@@ -0,0 +1,340 @@
+# co-novel - AI缓存服务
+import os
+import json
+import threading
+from typing import Optional, Dict, Any, Set
+from datetime import datetime, timedelta
+from pydantic import BaseModel
+
+from models.novel import AIGenerationCache
+from services.data_service import data_manager
+from utils.minhash import MinHasher, LSHIndex, shingle_hashes
+from utils.tokenizer import estimate_tokens
+
+
+class CachePolicy(BaseModel):
+    """单个内容类型的缓存策略"""
+    enabled: bool = True
+    ttl: int = 3600  # 过期时间（秒）
+    max_entries: int = 200  # 该类型最多保留的缓存条数
+    cache_stream: bool = True  # 流式接口是否读写缓存
+    # 近似命中阈值（MinHash估算的Jaccard相似度），为None时只做精确匹配。
+    # 章节提示词之间只差章节号，不要对chapter开启
+    similarity_threshold: Optional[float] = None
+
+
+# 默认缓存策略，可通过环境变量 AI_CACHE_POLICIES（JSON）覆盖
+# 例如：AI_CACHE_POLICIES={"outline": {"ttl": 600, "similarity_threshold": 0.75}}
+_DEFAULT_TTL = int(os.getenv("CACHE_TTL", "3600"))
+
+DEFAULT_CACHE_POLICIES: Dict[str, CachePolicy] = {
+    # 模板标题是随机挑选的，用户点“重新生成”就是想换一个，默认不缓存
+    "title": CachePolicy(enabled=False, ttl=300, max_entries=100),
+    "outline": CachePolicy(ttl=_DEFAULT_TTL, max_entries=200),
+    "chapter": CachePolicy(ttl=_DEFAULT_TTL * 24, max_entries=500),
+    "suggestion": CachePolicy(ttl=600, max_entries=300),
+    "content": CachePolicy(enabled=False),
+}
+
+
+def _new_stats() -> Dict[str, Any]:
+    """单个内容类型的统计计数"""
+    return {
+        "lookups": 0,
+        "hits": 0,
+        "misses": 0,
+        "near_hits": 0,
+        "prefetch_hits": 0,
+        "writes": 0,
+        "bytes_written": 0,
+        "evictions": 0,
+        "expirations": 0,
+        "saved_latency_total": 0.0,
+        "saved_latency_samples": 0,
+        "saved_tokens": 0,
+    }
+
+
+def load_cache_policies() -> Dict[str, CachePolicy]:
+    """加载缓存策略（默认值 + 环境变量覆盖）"""
+    policies = {name: policy.copy() for name, policy in DEFAULT_CACHE_POLICIES.items()}
+
+    # 全局开关
+    if os.getenv("ENABLE_CACHE", "true").lower() in ("false", "0", "no"):
+        for policy in policies.values():
+            policy.enabled = False
+
+    overrides = os.getenv("AI_CACHE_POLICIES")
+    if overrides:
+        try:
+            for content_type, values in json.loads(overrides).items():
+                base = policies.get(content_type, CachePolicy())
+                policies[content_type] = base.copy(update=values)
+        except (json.JSONDecodeError, AttributeError, TypeError) as e:
+            print(f"解析AI_CACHE_POLICIES失败，使用默认缓存策略: {e}")
+
+    return policies
+
+
+class AICacheManager:
+    """AI生成内容缓存管理器，按内容类型应用缓存策略并统计命中率"""
+
+    def __init__(self, policies: Optional[Dict[str, CachePolicy]] = None):
+        self.policies = policies if policies is not None else load_cache_policies()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        
+        # 近似匹配：签名生成器、各类型的LSH索引和提示词模板的固定shingle
+        self._hasher = MinHasher()
+        self._indexes: Dict[str, LSHIndex] = {}
+        self._skeletons: Dict[str, Set[int]] = {}
+        
+        # 由预取写入、尚未被用户请求命中的缓存键
+        self._prefetched: Set[str] = set()
+
+    def get_policy(self, content_type: str) -> CachePolicy:
+        """获取内容类型对应的缓存策略，未配置的类型不缓存"""
+        return self.policies.get(content_type) or CachePolicy(enabled=False)
+
+    def is_active(self, content_type: str, stream: bool = False) -> bool:
+        """判断该类型（及流式模式）是否启用缓存"""
+        policy = self.get_policy(content_type)
+        return policy.enabled and (policy.cache_stream or not stream)
+
+    def _type_stats(self, content_type: str) -> Dict[str, Any]:
+        """获取（必要时创建）某类型的计数，调用方需持有锁"""
+        stats = self._stats.get(content_type)
+        if stats is None:
+            stats = self._stats[content_type] = _new_stats()
+        return stats
+
+    def _count(self, content_type: str, key: str, amount=1):
+        with self._lock:
+            self._type_stats(content_type)[key] += amount
+
+    def _record_lookup(self, content_type: str, cache: Optional[AIGenerationCache],
+                       near: bool = False, prompt: Optional[str] = None):
+        """记录一次缓存查询；命中时累计节省的延迟和token"""
+        with self._lock:
+            stats = self._type_stats(content_type)
+            stats["lookups"] += 1
+            if cache is None:
+                stats["misses"] += 1
+                return
+            stats["hits"] += 1
+            if near:
+                stats["near_hits"] += 1
+            if cache.generation_latency is not None:
+                stats["saved_latency_total"] += cache.generation_latency
+                stats["saved_latency_samples"] += 1
+            stats["saved_tokens"] += estimate_tokens(cache.generated_content) + estimate_tokens(prompt or "")
+            if cache.cache_key in self._prefetched:
+                self._prefetched.discard(cache.cache_key)
+                stats["prefetch_hits"] += 1
+    
+    def register_prompt_skeleton(self, content_type: str, skeleton: str):
+        """
+        登记提示词模板的固定部分
+        
+        近似匹配时会忽略模板本身的shingle，避免大段相同的模板文字
+        让两个主题完全不同的提示词也显得“相似”。
+        
+        Args:
+            content_type: 内容类型
+            skeleton: 用空参数渲染出的提示词
+        """
+        self._skeletons[content_type] = shingle_hashes(skeleton, self._hasher.shingle_size)
+    
+    def _signature(self, content_type: str, prompt: str):
+        return self._hasher.signature(prompt, ignore=self._skeletons.get(content_type))
+    
+    def _get_index(self, content_type: str) -> LSHIndex:
+        """获取该类型的LSH索引，首次使用时从已有缓存构建"""
+        with self._lock:
+            index = self._indexes.get(content_type)
+            if index is None:
+                index = LSHIndex(self._hasher.num_perm)
+                for cache in data_manager.list_cache(content_type):
+                    if cache.prompt_signature:
+                        index.add(cache.cache_key, cache.prompt_signature)
+                self._indexes[content_type] = index
+            return index
+    
+    def _near_lookup(self, content_type: str, prompt: str, policy: CachePolicy) -> Optional[AIGenerationCache]:
+        """按提示词相似度查找近似缓存"""
+        index = self._get_index(content_type)
+        match = index.query(self._signature(content_type, prompt), policy.similarity_threshold)
+        if match is None:
+            return None
+        
+        cache_key, _ = match
+        cache = data_manager.get_cache(cache_key)
+        if cache is None or self._is_expired(cache, policy):
+            # 条目已被淘汰或过期
+            index.remove(cache_key)
+            return None
+        return cache
+
+    def _is_expired(self, cache: AIGenerationCache, policy: CachePolicy) -> bool:
+        """判断缓存是否已过期"""
+        return datetime.now() - cache.created_at > timedelta(seconds=policy.ttl)
+
+    def get(self, content_type: str, stream: bool = False, prompt: Optional[str] = None, **kwargs) -> Optional[str]:
+        """
+        查询缓存
+
+        Args:
+            content_type: 内容类型
+            stream: 是否来自流式接口
+            prompt: 渲染后的提示词，策略开启近似匹配时用于查找相似请求
+            **kwargs: 缓存参数
+
+        Returns:
+            缓存的内容，未命中或已过期返回None
+        """
+        if not self.is_active(content_type, stream):
+            return None
+
+        policy = self.get_policy(content_type)
+        cache_key = AIGenerationCache.generate_cache_key(content_type, **kwargs)
+        cache = data_manager.get_cache(cache_key)
+        if cache and self._is_expired(cache, policy):
+            data_manager.delete_cache(cache_key)
+            self._count(content_type, "expirations")
+            cache = None
+
+        near = False
+        if cache is None and prompt and policy.similarity_threshold is not None:
+            cache = self._near_lookup(content_type, prompt, policy)
+            near = cache is not None
+
+        self._record_lookup(content_type, cache, near, prompt)
+        return cache.generated_content if cache else None
+
+    def contains(self, content_type: str, **kwargs) -> bool:
+        """判断是否存在未过期的精确缓存（不计入命中统计）"""
+        if not self.is_active(content_type):
+            return False
+        cache_key = AIGenerationCache.generate_cache_key(content_type, **kwargs)
+        for cache in data_manager.list_cache(content_type):
+            if cache.cache_key == cache_key:
+                return not self._is_expired(cache, self.get_policy(content_type))
+        return False
+
+    def mark_prefetched(self, content_type: str, **kwargs):
+        """标记一条由预取写入的缓存，之后被用户请求命中时计为预取命中"""
+        with self._lock:
+            self._prefetched.add(AIGenerationCache.generate_cache_key(content_type, **kwargs))
+
+    def save(self, content_type: str, content: str, stream: bool = False, prompt: Optional[str] = None,
+             latency: Optional[float] = None, **kwargs) -> bool:
+        """
+        写入缓存，并按策略淘汰超出数量上限的旧条目
+
+        Args:
+            content_type: 内容类型
+            content: 生成的内容
+            stream: 是否来自流式接口
+            prompt: 渲染后的提示词，策略开启近似匹配时会保存其MinHash签名
+            latency: 本次生成耗时（秒），命中时计为节省的延迟
+            **kwargs: 缓存参数
+
+        Returns:
+            是否写入成功
+        """
+        if not self.is_active(content_type, stream) or not content.strip():
+            return False
+
+        policy = self.get_policy(content_type)
+        cache_key = AIGenerationCache.generate_cache_key(content_type, **kwargs)
+        # 同一个键只保留最新的一条
+        data_manager.delete_cache(cache_key)
+
+        signature = None
+        if prompt and policy.similarity_threshold is not None:
+            signature = self._signature(content_type, prompt)
+            self._get_index(content_type).add(cache_key, signature)
+
+        data_manager.save_cache(
+            cache_key=cache_key,
+            content_type=content_type,
+            content=content,
+            prompt_signature=signature,
+            generation_latency=latency,
+            **kwargs
+        )
+        evicted = data_manager.trim_cache(content_type, policy.max_entries)
+
+        with self._lock:
+            stats = self._type_stats(content_type)
+            stats["writes"] += 1
+            stats["bytes_written"] += len(content.encode("utf-8"))
+            stats["evictions"] += evicted
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """按内容类型返回缓存计数和命中率"""
+        with self._lock:
+            by_type = {}
+            for content_type, stats in self._stats.items():
+                lookups = stats["lookups"]
+                samples = stats["saved_latency_samples"]
+                by_type[content_type] = {
+                    "lookups": lookups,
+                    "hits": stats["hits"],
+                    "misses": stats["misses"],
+                    "hit_rate": round(stats["hits"] / lookups, 4) if lookups else 0.0,
+                    "near_hits": stats["near_hits"],
+                    "prefetch_hits": stats["prefetch_hits"],
+                    "writes": stats["writes"],
+                    "bytes_written": stats["bytes_written"],
+                    "evictions": stats["evictions"],
+                    "expirations": stats["expirations"],
+                    "avg_saved_latency": round(stats["saved_latency_total"] / samples, 3) if samples else 0.0,
+                    "saved_tokens": stats["saved_tokens"],
+                }
+        return by_type
+
+    def get_report(self) -> Dict[str, Any]:
+        """
+        缓存观测报告：总体与分类型的查询、命中、未命中、命中率，
+        当前占用字节数、淘汰数、平均节省延迟和估算节省的token
+        """
+        by_type = self.get_stats()
+
+        # 当前占用只在生成报告时扫描一次缓存文件，不放在请求路径上
+        stored: Dict[str, Dict[str, int]] = {}
+        for cache in data_manager.list_cache():
+            entry = stored.setdefault(cache.content_type, {"entries": 0, "bytes_stored": 0})
+            entry["entries"] += 1
+            entry["bytes_stored"] += len(cache.generated_content.encode("utf-8"))
+        for content_type, entry in stored.items():
+            by_type.setdefault(content_type, {}).update(entry)
+
+        lookups = sum(t.get("lookups", 0) for t in by_type.values())
+        hits = sum(t.get("hits", 0) for t in by_type.values())
+        with self._lock:
+            latency_total = sum(t["saved_latency_total"] for t in self._stats.values())
+            latency_samples = sum(t["saved_latency_samples"] for t in self._stats.values())
+
+        return {
+            "lookups": lookups,
+            "hits": hits,
+            "misses": lookups - hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": sum(t["entries"] for t in stored.values()),
+            "bytes_stored": sum(t["bytes_stored"] for t in stored.values()),
+            "evictions": sum(t.get("evictions", 0) for t in by_type.values()),
+            "avg_saved_latency": round(latency_total / latency_samples, 3) if latency_samples else 0.0,
+            "saved_tokens": sum(t.get("saved_tokens", 0) for t in by_type.values()),
+            "by_type": by_type,
+        }
+
+    def reset_stats(self):
+        """清空统计计数"""
+        with self._lock:
+            self._stats.clear()
+
+
+# 全局缓存管理器实例
+cache_manager = AICacheManager()
@@ -0,0 +1,237 @@
+# co-novel - 上游模型调用的录制与回放
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
+from services.fake_llm import stream_chunk
+
+# 参与请求哈希的参数；stream_options等不影响输出内容的参数不计入
+_KEY_PARAMS = ("model", "messages", "max_tokens", "temperature", "stream")
+
+
+def request_key(params: Dict[str, Any]) -> str:
+    """请求参数的哈希，作为录像中查找响应的键"""
+    canonical = json.dumps({k: params.get(k) for k in _KEY_PARAMS}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:24]
+
+
+def _usage_dict(usage: Any) -> Optional[Dict[str, int]]:
+    if usage is None or getattr(usage, "prompt_tokens", None) is None:
+        return None
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens or 0,
+        "total_tokens": getattr(usage, "total_tokens", None) or usage.prompt_tokens + (usage.completion_tokens or 0),
+    }
+
+
+class CassetteMissError(LookupError):
+    """回放时录像中没有该请求；不可重试，由调用方按生成失败处理"""
+
+
+class Cassette:
+    """
+    录像文件（JSON Lines，每行一次调用）
+
+    每条记录包含请求参数、请求哈希、流式片段序列和相邻片段之间的间隔（毫秒），
+    非流式调用记录完整内容和总耗时。同一请求录制多次时回放最后一次。
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._records: Optional[Dict[str, Dict[str, Any]]] = None
+        self._stats = {"recorded": 0, "replayed": 0, "misses": 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        """调用方需持有锁"""
+        if self._records is None:
+            self._records = {}
+            if self.path.exists():
+                with self.path.open(encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            record = json.loads(line)
+                            self._records[record["key"]] = record
+        return self._records
+
+    def get(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """查找请求对应的录像，没有时抛出CassetteMissError"""
+        key = request_key(params)
+        with self._lock:
+            record = self._load().get(key)
+        if record is None:
+            self._count("misses")
+            raise CassetteMissError(f"录像中没有该请求: {key}")
+        self._count("replayed")
+        return record
+
+    def append(self, record: Dict[str, Any]):
+        """追加一条录像，立即写入文件"""
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self._load()[record["key"]] = record
+            self._stats["recorded"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["records"] = len(self._load())
+        stats["path"] = str(self.path)
+        return stats
+
+
+class _RecordingStream:
+    """转发上游的流式响应，同时记下每个片段的内容和间隔；读完或关闭时写入录像"""
+
+    def __init__(self, response, cassette: Cassette, record: Dict[str, Any], started: float):
+        self._response = response
+        self._cassette = cassette
+        self._record = record
+        self._last = started
+        self._saved = False
+        self._generator = self._iterate()
+
+    async def _iterate(self):
+        async for chunk in self._response:
+            now = time.monotonic()
+            content = chunk.choices[0].delta.content if chunk.choices else None
+            if content:
+                self._record["chunks"].append(content)
+                self._record["delays"].append(round((now - self._last) * 1000))
+                self._last = now
+            usage = _usage_dict(getattr(chunk, "usage", None))
+            if usage is not None:
+                self._record["usage"] = usage
+            yield chunk
+        self._save()
+
+    def _save(self):
+        if not self._saved:
+            self._saved = True
+            self._cassette.append(self._record)
+
+    def __aiter__(self):
+        return self._generator
+
+    async def close(self):
+        await self._generator.aclose()
+        close = getattr(self._response, "close", None)
+        if close is not None:
+            await close()
+        # 调用方提前结束时录下已收到的部分，回放时同样在这里结束
+        self._save()
+
+
+class _ReplayStream:
+    """按录制时的间隔（除以speed）回放片段"""
+
+    def __init__(self, record: Dict[str, Any], params: Dict[str, Any], speed: float):
+        self._generator = self._iterate(record, params, speed)
+
+    @staticmethod
+    async def _iterate(record: Dict[str, Any], params: Dict[str, Any], speed: float):
+        due = time.monotonic()
+        for content, delay in zip(record["chunks"], record["delays"]):
+            if speed > 0:
+                due += delay / 1000 / speed
+                await asyncio.sleep(max(0.0, due - time.monotonic()))
+            yield stream_chunk(content)
+        yield stream_chunk(None, "stop")
+        if record.get("usage") and (params.get("stream_options") or {}).get("include_usage"):
+            yield SimpleNamespace(choices=[], usage=SimpleNamespace(**record["usage"]))
+
+    def __aiter__(self):
+        return self._generator
+
+    async def close(self):
+        await self._generator.aclose()
+
+
+class _RecordingCompletions:
+    def __init__(self, client, cassette: Cassette):
+        self._client = client
+        self._cassette = cassette
+
+    async def create(self, **params):
+        started = time.monotonic()
+        response = await self._client.chat.completions.create(**params)
+        record = {"key": request_key(params), "params": params, "stream": bool(params.get("stream"))}
+        if record["stream"]:
+            record.update(chunks=[], delays=[], usage=None)
+            return _RecordingStream(response, self._cassette, record, started)
+        record.update(content=response.choices[0].message.content,
+                      latency=round((time.monotonic() - started) * 1000),
+                      usage=_usage_dict(getattr(response, "usage", None)))
+        self._cassette.append(record)
+        return response
+
+
+class RecordingClient:
+    """包装真实客户端，把每次调用录制到录像文件，用法同AsyncOpenAI"""
+
+    def __init__(self, client, cassette: Cassette):
+        self.cassette = cassette
+        self.chat = SimpleNamespace(completions=_RecordingCompletions(client, cassette))
+
+
+class _ReplayCompletions:
+    def __init__(self, cassette: Cassette, speed: float):
+        self._cassette = cassette
+        self._speed = speed
+
+    async def create(self, **params):
+        record = self._cassette.get(params)
+        if record["stream"]:
+            return _ReplayStream(record, params, self._speed)
+        if self._speed > 0:
+            await asyncio.sleep(record["latency"] / 1000 / self._speed)
+        usage = SimpleNamespace(**record["usage"]) if record.get("usage") else None
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=record["content"]), finish_reason="stop")],
+            usage=usage,
+        )
+
+
+class ReplayClient:
+    """
+    按请求哈希回放录像的客户端，用法同AsyncOpenAI
+
+    speed为1时按录制时的节奏回放，大于1时按比例加速，为0时不等待。
+    """
+
+    def __init__(self, cassette: Cassette, speed: float = 1.0):
+        self.cassette = cassette
+        self.chat = SimpleNamespace(completions=_ReplayCompletions(cassette, speed))
+
+
+_cassettes: Dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(path: Optional[str] = None) -> Cassette:
+    """同一文件的录像对象在各服务商之间共用"""
+    path = path or os.getenv("LLM_CASSETTE_FILE", "data/llm_cassette.jsonl")
+    with _cassettes_lock:
+        cassette = _cassettes.get(path)
+        if cassette is None:
+            cassette = _cassettes[path] = Cassette(path)
+        return cassette
+
+
+def cassette_mode() -> str:
+    """LLM_CASSETTE_MODE：off（默认）、record（录制）或replay（回放）"""
+    return os.getenv("LLM_CASSETTE_MODE", "off").lower()
@@ -0,0 +1,174 @@
+# co-novel - 上游模型熔断器
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，调用被直接拒绝"""
+
+    def __init__(self, model: str, retry_in: float):
+        super().__init__(f"{model} 已熔断，{retry_in:.0f}秒后重试")
+        self.model = model
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    单个模型的熔断器
+
+    关闭状态下统计最近 window_size 次调用的结果，调用数不少于 min_calls 且
+    错误率或慢调用比例超过阈值时打开。打开期间所有调用直接拒绝，open_seconds
+    之后进入半开状态，只放行 half_open_calls 个探测请求：全部成功则关闭，
+    任意一个失败则重新打开。
+    """
+
+    def __init__(self, model: str, window_size: Optional[int] = None, min_calls: Optional[int] = None,
+                 error_rate: Optional[float] = None, slow_call_seconds: Optional[float] = None,
+                 slow_call_rate: Optional[float] = None, open_seconds: Optional[float] = None,
+                 half_open_calls: Optional[int] = None):
+        self.model = model
+        self.window_size = window_size or int(os.getenv("CIRCUIT_WINDOW_SIZE", "20"))
+        self.min_calls = min_calls or int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+        self.error_rate = error_rate if error_rate is not None else float(os.getenv("CIRCUIT_ERROR_RATE", "0.5"))
+        self.slow_call_seconds = slow_call_seconds if slow_call_seconds is not None else \
+            float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "60"))
+        self.slow_call_rate = slow_call_rate if slow_call_rate is not None else \
+            float(os.getenv("CIRCUIT_SLOW_CALL_RATE", "0.8"))
+        self.open_seconds = open_seconds if open_seconds is not None else \
+            float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+        self.half_open_calls = half_open_calls or int(os.getenv("CIRCUIT_HALF_OPEN_CALLS", "1"))
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=self.window_size)  # (失败, 慢调用)
+        self._probes = 0  # 半开状态下在途的探测请求
+        self._probe_successes = 0
+        self._stats = {"opened": 0, "rejected": 0, "successes": 0, "failures": 0}
+
+    def _transition(self, state: str):
+        """切换状态，调用方需持有锁"""
+        self._state = state
+        self._outcomes.clear()
+        self._probes = 0
+        self._probe_successes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self._stats["opened"] += 1
+            print(f"{self.model} 熔断打开，{self.open_seconds:.0f}秒内直接使用备用结果")
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+            return self._state
+
+    def before_call(self):
+        """
+        调用上游前检查熔断状态
+
+        Raises:
+            CircuitOpenError: 熔断打开，或半开状态下探测名额已满
+        """
+        with self._lock:
+            if self._state == OPEN:
+                elapsed = time.monotonic() - self._opened_at
+                if elapsed < self.open_seconds:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpenError(self.model, self.open_seconds - elapsed)
+                self._transition(HALF_OPEN)
+            if self._state == HALF_OPEN:
+                if self._probes >= self.half_open_calls:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpenError(self.model, 0)
+                self._probes += 1
+
+    def on_success(self, latency: float):
+        """记录一次成功调用（流式调用以收到首个片段为准）"""
+        with self._lock:
+            self._stats["successes"] += 1
+            slow = latency >= self.slow_call_seconds
+            if self._state == HALF_OPEN:
+                self._probes -= 1
+                if slow:
+                    self._transition(OPEN)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    self._transition(CLOSED)
+                return
+            self._record(False, slow)
+
+    def on_failure(self):
+        """记录一次上游故障（限流、5xx、超时、连接错误）"""
+        with self._lock:
+            self._stats["failures"] += 1
+            if self._state == HALF_OPEN:
+                self._transition(OPEN)
+                return
+            self._record(True, False)
+
+    def on_ignored(self):
+        """调用结束但不反映上游健康状况（如参数错误、被取消），只归还探测名额"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def _record(self, failed: bool, slow: bool):
+        """关闭状态下记录结果并判断是否需要打开，调用方需持有锁"""
+        if self._state != CLOSED:
+            return
+        self._outcomes.append((failed, slow))
+        total = len(self._outcomes)
+        if total < self.min_calls:
+            return
+        failures = sum(1 for f, _ in self._outcomes if f)
+        slow_calls = sum(1 for _, s in self._outcomes if s)
+        if failures / total >= self.error_rate or slow_calls / total >= self.slow_call_rate:
+            self._transition(OPEN)
+
+    def get_stats(self) -> Dict[str, Any]:
+        state = self.state
+        with self._lock:
+            total = len(self._outcomes)
+            stats = dict(self._stats)
+            stats.update({
+                "state": state,
+                "window_calls": total,
+                "window_error_rate": round(sum(1 for f, _ in self._outcomes if f) / total, 4) if total else 0.0,
+                "window_slow_rate": round(sum(1 for _, s in self._outcomes if s) / total, 4) if total else 0.0,
+            })
+        return stats
+
+
+class CircuitBreakerRegistry:
+    """按名称（服务商/模型）维护熔断器，各自的状态互不影响"""
+
+    def __init__(self, **breaker_options):
+        self._breaker_options = breaker_options
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                breaker = self._breakers[model] = CircuitBreaker(model, **self._breaker_options)
+            return breaker
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.model: breaker.get_stats() for breaker in breakers}
+
+
+# 全局熔断器，所有AIService共用
+circuit_breakers = CircuitBreakerRegistry()
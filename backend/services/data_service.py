@@ -3,33 +3,48 @@ from typing import Optional, List, Dict, Any
 from datetime import datetime, timedelta
 import json
 import os
+import threading
+from functools import wraps
 from pathlib import Path
 
 from models.novel import (
-    NovelProject, Chapter, CreationSession, AIGenerationCache,
-    NovelGenre, NovelStatus, ChapterStatus, CreationStep
+    NovelProject, Chapter, CreationSession, AIGenerationCache, GenerationJob,
+    NovelGenre, NovelStatus, ChapterStatus, CreationStep, JobStatus
 )
 
 
+def synchronized(method):
+    """串行化对数据文件的读改写，避免并发请求互相覆盖"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class DataManager:
     """数据管理器 - 使用文件存储模拟数据库操作"""
     
     def __init__(self, data_dir: str = "./data"):
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(exist_ok=True)
+        # 事件循环、同步桥接线程和预取线程可能同时读写同一文件
+        self._lock = threading.RLock()
         
         # 各类数据的存储文件
         self.novels_file = self.data_dir / "novels.json"
         self.chapters_file = self.data_dir / "chapters.json"
         self.sessions_file = self.data_dir / "sessions.json"
         self.cache_file = self.data_dir / "ai_cache.json"
+        self.jobs_file = self.data_dir / "jobs.json"
         
         # 初始化数据文件
         self._init_data_files()
     
     def _init_data_files(self):
         """初始化数据文件"""
-        for file_path in [self.novels_file, self.chapters_file, self.sessions_file, self.cache_file]:
+        for file_path in [self.novels_file, self.chapters_file, self.sessions_file, self.cache_file,
+                          self.jobs_file]:
             if not file_path.exists():
                 file_path.write_text("[]", encoding="utf-8")
     
@@ -49,13 +64,17 @@ class DataManager:
                 return obj.isoformat()
             raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
         
-        file_path.write_text(
+        # 先写临时文件再替换，并发读取时不会读到写了一半的文件
+        tmp_path = file_path.with_name(f"{file_path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(
             json.dumps(data, ensure_ascii=False, indent=2, default=json_serializer), 
             encoding="utf-8"
         )
+        os.replace(tmp_path, file_path)
     
     # === 小说项目管理 ===
     
+    @synchronized
     def create_novel(self, genre: NovelGenre, theme: str) -> NovelProject:
         """创建新小说项目"""
         novel = NovelProject(genre=genre, theme=theme)
@@ -74,6 +93,7 @@ class DataManager:
                 return NovelProject(**novel_data)
         return None
     
+    @synchronized
     def update_novel(self, novel: NovelProject) -> bool:
         """更新小说项目"""
         novels = self._load_data(self.novels_file)
@@ -92,6 +112,7 @@ class DataManager:
         novels.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
         return [NovelProject(**novel_data) for novel_data in novels[:limit]]
     
+    @synchronized
     def delete_novel(self, novel_id: str) -> bool:
         """删除小说项目"""
         novels = self._load_data(self.novels_file)
@@ -107,6 +128,7 @@ class DataManager:
     
     # === 章节管理 ===
     
+    @synchronized
     def create_chapter(self, novel_id: str, chapter_number: int, title: Optional[str] = None) -> Chapter:
         """创建新章节"""
         chapter = Chapter(
@@ -137,6 +159,7 @@ class DataManager:
         novel_chapters.sort(key=lambda x: x.chapter_number)
         return novel_chapters
     
+    @synchronized
     def update_chapter(self, chapter: Chapter) -> bool:
         """更新章节"""
         chapters = self._load_data(self.chapters_file)
@@ -148,6 +171,7 @@ class DataManager:
                 return True
         return False
     
+    @synchronized
     def delete_chapters_by_novel(self, novel_id: str) -> int:
         """删除小说的所有章节"""
         chapters = self._load_data(self.chapters_file)
@@ -161,6 +185,7 @@ class DataManager:
     
     # === 创作会话管理 ===
     
+    @synchronized
     def create_session(self, novel_id: str) -> CreationSession:
         """创建创作会话"""
         session = CreationSession(novel_id=novel_id)
@@ -188,6 +213,7 @@ class DataManager:
                 return CreationSession(**session_data)
         return None
     
+    @synchronized
     def update_session(self, session: CreationSession) -> bool:
         """更新创作会话"""
         sessions = self._load_data(self.sessions_file)
@@ -198,6 +224,7 @@ class DataManager:
                 return True
         return False
     
+    @synchronized
     def deactivate_session(self, session_id: str) -> bool:
         """停用创作会话"""
         sessions = self._load_data(self.sessions_file)
@@ -211,6 +238,7 @@ class DataManager:
     
     # === AI缓存管理 ===
     
+    @synchronized
     def get_cache(self, cache_key: str) -> Optional[AIGenerationCache]:
         """获取缓存内容"""
         caches = self._load_data(self.cache_file)
@@ -222,6 +250,15 @@ class DataManager:
                 return cache
         return None
     
+    def list_cache(self, content_type: Optional[str] = None) -> List[AIGenerationCache]:
+        """列出缓存条目"""
+        caches = self._load_data(self.cache_file)
+        return [
+            AIGenerationCache(**c) for c in caches
+            if content_type is None or c.get("content_type") == content_type
+        ]
+    
+    @synchronized
     def save_cache(self, cache_key: str, content_type: str, content: str, **metadata) -> AIGenerationCache:
         """保存缓存内容"""
         cache = AIGenerationCache(
@@ -237,6 +274,7 @@ class DataManager:
         
         return cache
     
+    @synchronized
     def update_cache(self, cache: AIGenerationCache) -> bool:
         """更新缓存"""
         caches = self._load_data(self.cache_file)
@@ -247,6 +285,32 @@ class DataManager:
                 return True
         return False
     
+    @synchronized
+    def delete_cache(self, cache_key: str) -> bool:
+        """删除指定缓存"""
+        caches = self._load_data(self.cache_file)
+        remaining = [c for c in caches if c["cache_key"] != cache_key]
+
+        if len(remaining) < len(caches):
+            self._save_data(self.cache_file, remaining)
+            return True
+        return False
+
+    @synchronized
+    def trim_cache(self, content_type: str, max_entries: int) -> int:
+        """淘汰指定类型中最久未命中的缓存，使其数量不超过上限"""
+        caches = self._load_data(self.cache_file)
+        typed = [c for c in caches if c.get("content_type") == content_type]
+        if len(typed) <= max_entries:
+            return 0
+
+        typed.sort(key=lambda c: c.get("last_hit", ""))
+        evicted_ids = {c["id"] for c in typed[:len(typed) - max_entries]}
+        caches = [c for c in caches if c["id"] not in evicted_ids]
+        self._save_data(self.cache_file, caches)
+        return len(evicted_ids)
+
+    @synchronized
     def cleanup_old_cache(self, days: int = 30) -> int:
         """清理过期缓存"""
         caches = self._load_data(self.cache_file)
@@ -264,6 +328,48 @@ class DataManager:
         
         return deleted_count
     
+    # === 后台任务管理 ===
+    
+    @synchronized
+    def save_job(self, job: GenerationJob) -> GenerationJob:
+        """保存后台任务，不存在时新增"""
+        jobs = self._load_data(self.jobs_file)
+        for i, job_data in enumerate(jobs):
+            if job_data["id"] == job.id:
+                jobs[i] = job.dict()
+                break
+        else:
+            jobs.append(job.dict())
+        self._save_data(self.jobs_file, jobs)
+        return job
+    
+    def get_job(self, job_id: str) -> Optional[GenerationJob]:
+        """获取后台任务"""
+        for job_data in self._load_data(self.jobs_file):
+            if job_data["id"] == job_id:
+                return GenerationJob(**job_data)
+        return None
+    
+    def list_jobs(self, statuses: Optional[List[JobStatus]] = None) -> List[GenerationJob]:
+        """按创建时间列出后台任务，可按状态过滤"""
+        jobs = [GenerationJob(**j) for j in self._load_data(self.jobs_file)]
+        if statuses is not None:
+            jobs = [j for j in jobs if j.status in statuses]
+        jobs.sort(key=lambda j: j.created_at)
+        return jobs
+    
+    @synchronized
+    def cleanup_old_jobs(self, days: int = 7) -> int:
+        """清理结束超过指定天数的后台任务"""
+        jobs = self._load_data(self.jobs_file)
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+        remaining = [j for j in jobs if not j.get("finished_at") or j["finished_at"] > cutoff]
+        
+        deleted_count = len(jobs) - len(remaining)
+        if deleted_count > 0:
+            self._save_data(self.jobs_file, remaining)
+        return deleted_count
+    
     # === 统计信息 ===
     
     def get_statistics(self) -> Dict[str, Any]:
@@ -285,9 +391,10 @@ class DataManager:
         # 活跃会话数
         active_sessions = sum(1 for s in sessions if s.get("is_active", True))
         
-        # 缓存命中率（简化计算）
-        cache_hits = sum(c.get("hit_count", 1) for c in caches)
-        cache_efficiency = cache_hits / len(caches) if caches else 0
+        # 每条缓存被复用的平均次数（hit_count从1开始计，写入本身不算复用）。
+        # 真实命中率需要统计未命中，由AI缓存服务的内存计数提供
+        cache_reuses = sum(c.get("hit_count", 1) - 1 for c in caches)
+        avg_reuse = cache_reuses / len(caches) if caches else 0
         
         return {
             "total_novels": len(novels),
@@ -295,7 +402,7 @@ class DataManager:
             "total_words": total_words,
             "active_sessions": active_sessions,
             "cache_entries": len(caches),
-            "cache_efficiency": round(cache_efficiency, 2),
+            "cache_avg_reuse": round(avg_reuse, 2),
             "genre_distribution": genre_stats,
             "last_updated": datetime.now().isoformat()
         }
@@ -0,0 +1,266 @@
+# co-novel - 离线压测用的假模型服务
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import itertools
+import threading
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List, Optional
+from pydantic import BaseModel
+
+from utils.tokenizer import estimate_tokens
+
+# 默认的固定输出：一段中文小说正文，按需循环截取
+DEFAULT_CONTENT = (
+    "夜色渐深，山门外的石阶上落满了枯叶。林远背着长剑，独自站在风里，望着远处若隐若现的灯火。"
+    "三年前，他便是从这里被逐出师门；三年后，他带着一身伤痕和一个秘密回来了。"
+    "“师兄，你真的要进去吗？”身后传来少女的声音，带着几分犹豫。"
+    "林远没有回头，只是轻轻握紧了剑柄：“有些事情，总要有人去做。”"
+    "话音未落，山门内忽然亮起一道刺眼的光芒，钟声连响九下，惊起满山飞鸟。"
+    "守山弟子纷纷涌出，为首的中年人目光如电，冷冷地盯着他：“逆徒，你竟还敢回来！”"
+    "林远抬起头，眼中没有畏惧，只有压抑已久的怒火。他缓缓拔剑，剑身上的符文一道道亮起。"
+    "这一夜，注定无人入眠。"
+)
+
+class FakeLLMConfig(BaseModel):
+    """假模型的行为参数，一个“token”对应固定输出中的一个字符"""
+    ttft: float = 0.2  # 首个片段（或非流式完整响应）之前的延迟，秒
+    tokens_per_second: float = 50.0  # 输出速度，0为不限速
+    chunk_tokens: int = 2  # 每个流式片段的token数
+    error_rate: float = 0.0  # 调用失败（返回error_status）的比例
+    error_status: int = 500
+    max_reply_tokens: Optional[int] = None  # 回复长度上限，为None时按请求的max_tokens
+    content: str = DEFAULT_CONTENT
+    seed: int = 0  # 相同的种子和调用顺序得到相同的输出和失败序列
+
+    @classmethod
+    def from_env(cls) -> "FakeLLMConfig":
+        values: Dict[str, Any] = {
+            "ttft": float(os.getenv("FAKE_LLM_TTFT", "0.2")),
+            "tokens_per_second": float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "50")),
+            "chunk_tokens": int(os.getenv("FAKE_LLM_CHUNK_TOKENS", "2")),
+            "error_rate": float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            "error_status": int(os.getenv("FAKE_LLM_ERROR_STATUS", "500")),
+            "seed": int(os.getenv("FAKE_LLM_SEED", "0")),
+        }
+        if os.getenv("FAKE_LLM_CONTENT"):
+            values["content"] = os.getenv("FAKE_LLM_CONTENT")
+        return cls(**values)
+
+
+class FakeLLMError(Exception):
+    """假模型按error_rate返回的上游错误，与SDK的APIStatusError一样带status_code和response"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"Fake LLM error: HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code, headers={})
+
+
+class FakeLLM:
+    """
+    确定性的OpenAI兼容假模型
+
+    输出内容由请求参数和种子决定：同一请求总是从固定输出的同一位置开始截取，
+    长度为min(max_tokens, max_reply_tokens)个字符；是否失败由种子和调用序号决定。
+    延迟用asyncio.sleep模拟，不阻塞事件循环，可用于在无网络的机器上压测。
+    """
+
+    def __init__(self, config: Optional[FakeLLMConfig] = None):
+        self.config = config or FakeLLMConfig.from_env()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "stream_calls": 0, "errors": 0, "completion_tokens": 0}
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def should_fail(self) -> bool:
+        """按调用顺序决定本次调用是否失败"""
+        index = next(self._counter)
+        if self.config.error_rate <= 0:
+            return False
+        return random.Random(f"{self.config.seed}:{index}").random() < self.config.error_rate
+
+    def reply_for(self, params: Dict[str, Any]) -> str:
+        """请求对应的回复内容"""
+        key = json.dumps([params.get("model"), params.get("messages"), self.config.seed],
+                         ensure_ascii=False, sort_keys=True)
+        content = self.config.content
+        start = int(hashlib.sha256(key.encode("utf-8")).hexdigest(), 16) % len(content)
+        length = params.get("max_tokens") or 256
+        if self.config.max_reply_tokens is not None:
+            length = min(length, self.config.max_reply_tokens)
+        repeated = content * (length // len(content) + 2)
+        return repeated[start:start + length]
+
+    def usage_for(self, params: Dict[str, Any], reply: str) -> SimpleNamespace:
+        prompt_tokens = sum(estimate_tokens(m.get("content")) for m in params.get("messages") or [])
+        return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(reply),
+                               total_tokens=prompt_tokens + len(reply))
+
+    def chunks_for(self, reply: str) -> List[str]:
+        size = max(1, self.config.chunk_tokens)
+        return [reply[i:i + size] for i in range(0, len(reply), size)]
+
+    async def complete(self, params: Dict[str, Any]) -> str:
+        """非流式：等待首字延迟和全部输出的时间后返回完整内容，失败时抛出FakeLLMError"""
+        self._count("calls")
+        if self.should_fail():
+            await asyncio.sleep(self.config.ttft)
+            self._count("errors")
+            raise FakeLLMError(self.config.error_status)
+        reply = self.reply_for(params)
+        duration = self.config.ttft
+        if self.config.tokens_per_second > 0:
+            duration += len(reply) / self.config.tokens_per_second
+        await asyncio.sleep(duration)
+        self._count("completion_tokens", len(reply))
+        return reply
+
+    async def open_stream(self, params: Dict[str, Any]) -> List[str]:
+        """流式：建立连接，失败时抛出FakeLLMError，成功时返回要输出的片段"""
+        self._count("calls")
+        self._count("stream_calls")
+        if self.should_fail():
+            await asyncio.sleep(self.config.ttft)
+            self._count("errors")
+            raise FakeLLMError(self.config.error_status)
+        return self.chunks_for(self.reply_for(params))
+
+    async def iter_chunks(self, chunks: List[str]) -> AsyncIterator[str]:
+        """按首字延迟和输出速度逐个给出片段，按绝对时间排期，sleep的误差不会累积"""
+        started = time.monotonic()
+        interval = self.config.chunk_tokens / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0.0
+        for i, chunk in enumerate(chunks):
+            delay = started + self.config.ttft + i * interval - time.monotonic()
+            await asyncio.sleep(max(0.0, delay))
+            self._count("completion_tokens", len(chunk))
+            yield chunk
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["config"] = self.config.dict(exclude={"content"})
+        return stats
+
+
+def stream_chunk(content: Optional[str], finish_reason: Optional[str] = None) -> SimpleNamespace:
+    """与SDK的ChatCompletionChunk结构相同的流式片段"""
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content),
+                                                    finish_reason=finish_reason)], usage=None)
+
+
+class _FakeStream:
+    """与AsyncStream相同用法的流式响应：异步迭代得到片段，close()结束"""
+
+    def __init__(self, llm: FakeLLM, params: Dict[str, Any], chunks: List[str]):
+        self._generator = self._iterate(llm, params, chunks)
+
+    @staticmethod
+    async def _iterate(llm: FakeLLM, params: Dict[str, Any], chunks: List[str]):
+        async for content in llm.iter_chunks(chunks):
+            yield stream_chunk(content)
+        yield stream_chunk(None, "stop")
+        if (params.get("stream_options") or {}).get("include_usage"):
+            yield SimpleNamespace(choices=[], usage=llm.usage_for(params, "".join(chunks)))
+
+    def __aiter__(self):
+        return self._generator
+
+    async def close(self):
+        await self._generator.aclose()
+
+
+class _FakeCompletions:
+    def __init__(self, llm: FakeLLM):
+        self._llm = llm
+
+    async def create(self, **params):
+        if params.get("stream"):
+            chunks = await self._llm.open_stream(params)
+            return _FakeStream(self._llm, params, chunks)
+        reply = await self._llm.complete(params)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=reply), finish_reason="stop")],
+            usage=self._llm.usage_for(params, reply),
+        )
+
+
+class FakeLLMClient:
+    """
+    进程内的假客户端，用法同AsyncOpenAI：client.chat.completions.create(...)
+
+    服务商的base_url设置为fake://时使用，例如OPENAI_BASE_URL=fake://。
+    """
+
+    def __init__(self, config: Optional[FakeLLMConfig] = None):
+        self.llm = FakeLLM(config)
+        self.chat = SimpleNamespace(completions=_FakeCompletions(self.llm))
+
+
+def create_fake_llm_app(config: Optional[FakeLLMConfig] = None):
+    """
+    OpenAI兼容的假模型HTTP服务（ASGI），供OPENAI_BASE_URL指向它做端到端压测
+
+    启动：uvicorn services.fake_llm:app --port 9000
+    然后：OPENAI_BASE_URL=http://127.0.0.1:9000/v1 OPENAI_API_KEY=fake
+    """
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+
+    llm = FakeLLM(config)
+    fake_app = FastAPI(title="co-novel fake LLM")
+    fake_app.state.llm = llm
+
+    def envelope(params: Dict[str, Any], completion_id: str, **fields) -> Dict[str, Any]:
+        return {"id": completion_id, "created": int(time.time()), "model": params.get("model", "fake"), **fields}
+
+    @fake_app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        params = await request.json()
+        completion_id = f"chatcmpl-fake-{hashlib.md5(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]}"
+        try:
+            if not params.get("stream"):
+                reply = await llm.complete(params)
+                usage = llm.usage_for(params, reply)
+                return envelope(params, completion_id, object="chat.completion", choices=[{
+                    "index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop",
+                }], usage=vars(usage))
+            chunks = await llm.open_stream(params)
+        except FakeLLMError as e:
+            return JSONResponse(status_code=e.status_code, content={
+                "error": {"message": str(e), "type": "fake_error", "code": e.status_code},
+            })
+
+        def event(**fields) -> str:
+            data = envelope(params, completion_id, object="chat.completion.chunk", **fields)
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        async def stream():
+            async for content in llm.iter_chunks(chunks):
+                yield event(choices=[{"index": 0, "delta": {"content": content}, "finish_reason": None}])
+            yield event(choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (params.get("stream_options") or {}).get("include_usage"):
+                yield event(choices=[], usage=vars(llm.usage_for(params, "".join(chunks))))
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @fake_app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "fake", "object": "model", "owned_by": "co-novel"}]}
+
+    @fake_app.get("/stats")
+    async def stats():
+        return llm.get_stats()
+
+    return fake_app
+
+
+# uvicorn services.fake_llm:app 使用的实例，参数来自FAKE_LLM_*环境变量
+app = create_fake_llm_app()
@@ -0,0 +1,249 @@
+# co-novel - 后台生成任务队列
+import os
+import asyncio
+import itertools
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Type
+
+from pydantic import BaseModel
+
+from models.novel import (
+    GenerationJob, JobStatus,
+    NovelDraftRequest, OutlineGenerationRequest, ChapterGenerationRequest
+)
+from services.data_service import DataManager, data_manager
+from services.novel_service import novel_service
+
+logger = logging.getLogger(__name__)
+
+# 任务处理函数：(参数, 进度回调) -> 可JSON序列化的结果，失败时抛出异常
+JobHandler = Callable[[Any, Callable[[Dict[str, Any]], None]], Awaitable[Any]]
+
+
+async def run_novel_draft(request: NovelDraftRequest, progress) -> Dict[str, Any]:
+    """
+    整本初稿：各章生成完即保存，结果只包含各章的ID和字数
+
+    部分章节失败时任务仍算完成，失败的章节在结果的failed_chapters中列出错误；
+    所有章节都失败时任务失败。
+    """
+    chapters = []
+    result: Dict[str, Any] = {}
+    async for event in novel_service.generate_novel_draft_stream_async(request):
+        kind = event["event"]
+        if kind == "start":
+            progress({"novel_id": event["novel_id"], "chapter_count": event["chapter_count"],
+                      "completed": 0, "failed": 0})
+        elif kind in ("done", "error"):
+            chapters.append({k: v for k, v in event.items() if k != "event"})
+            progress({"completed": sum(1 for c in chapters if "chapter_id" in c),
+                      "failed": sum(1 for c in chapters if "message" in c)})
+        elif kind == "end":
+            result = {k: v for k, v in event.items() if k != "event"}
+    chapters.sort(key=lambda c: c["chapter_number"])
+    failed = [c for c in chapters if "message" in c]
+    if chapters and len(failed) == len(chapters):
+        raise RuntimeError(f"所有{len(failed)}个章节都生成失败: {failed[0]['message']}")
+    result["chapters"] = [c for c in chapters if "chapter_id" in c]
+    result["failed_chapters"] = failed
+    return result
+
+
+async def run_outline(request: OutlineGenerationRequest, progress) -> Dict[str, Any]:
+    """大纲生成，失败时任务失败而不是以备用大纲作为结果"""
+    response = await novel_service.generate_outline_async(request, raise_on_error=True)
+    if not response.success:
+        raise RuntimeError(response.message)
+    return response.data
+
+
+async def run_chapter(request: ChapterGenerationRequest, progress) -> Dict[str, Any]:
+    """单章生成，失败时任务失败而不是以错误提示作为结果"""
+    response = await novel_service.generate_chapter_async(request, raise_on_error=True)
+    if not response.success:
+        raise RuntimeError(response.message)
+    return response.data
+
+
+class JobQueue:
+    """
+    后台生成任务队列
+
+    整本初稿、大纲扩写等长时间的生成不占用HTTP请求：提交后立即返回任务ID，
+    由max_concurrency个asyncio工作协程按优先级执行（越大越先，同优先级先进先出），
+    状态、进度和结果通过DataManager持久化，客户端轮询状态并获取结果。
+    服务重启后，排队中的任务重新排队，运行中被中断的任务从头重新执行；
+    被中断达到max_attempts次的任务标记为失败。
+    """
+
+    def __init__(self, manager: Optional[DataManager] = None, max_concurrency: Optional[int] = None,
+                 max_attempts: Optional[int] = None):
+        self.data_manager = manager or data_manager
+        self.max_concurrency = max_concurrency or int(os.getenv("JOB_CONCURRENCY", "2"))
+        self.max_attempts = max_attempts or int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+        self.retention_days = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+        self._handlers: Dict[str, tuple] = {}
+        self._jobs: Dict[str, GenerationJob] = {}  # 本进程中排队和运行中的任务
+        self._running: Dict[str, asyncio.Task] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping = False
+        self._order = itertools.count()
+        self._stats = {"submitted": 0, "succeeded": 0, "failed": 0, "cancelled": 0, "recovered": 0}
+
+        self.register("novel_draft", run_novel_draft, NovelDraftRequest)
+        self.register("outline", run_outline, OutlineGenerationRequest)
+        self.register("chapter", run_chapter, ChapterGenerationRequest)
+
+    def register(self, job_type: str, handler: JobHandler, params_model: Optional[Type[BaseModel]] = None):
+        """注册任务类型；有params_model时提交时校验参数，处理函数收到模型实例，否则收到字典"""
+        self._handlers[job_type] = (handler, params_model)
+
+    def _parse_params(self, job_type: str, params: Dict[str, Any]):
+        handler, params_model = self._handlers[job_type]
+        return params_model(**params) if params_model is not None else params
+
+    async def start(self):
+        """启动工作协程并恢复持久化的未完成任务；同一事件循环中重复调用无效"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        # 首次启动，或事件循环已更换（旧循环中的工作协程已不存在）
+        self._loop = loop
+        self._stopping = False
+        self._queue = asyncio.PriorityQueue()
+        self._jobs.clear()
+        self._running.clear()
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.max_concurrency)]
+        await self._recover()
+
+    async def stop(self):
+        """停止工作协程；运行中的任务保持运行中状态，下次启动时重新执行"""
+        self._stopping = True
+        tasks = self._workers + list(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._loop = None
+
+    async def _recover(self):
+        jobs = await asyncio.to_thread(self.data_manager.list_jobs, [JobStatus.QUEUED, JobStatus.RUNNING])
+        for job in jobs:
+            if job.status == JobStatus.RUNNING:
+                if job.attempts >= self.max_attempts:
+                    job.error = f"任务被服务重启中断{job.attempts}次"
+                    await self._finish(job, JobStatus.FAILED)
+                    continue
+                job.status = JobStatus.QUEUED
+                job.progress = {}
+                await self._save(job)
+                self._stats["recovered"] += 1
+            self._enqueue(job)
+        if jobs:
+            logger.info(f"Recovered {len(jobs)} unfinished jobs")
+        await asyncio.to_thread(self.data_manager.cleanup_old_jobs, self.retention_days)
+
+    def _enqueue(self, job: GenerationJob):
+        self._jobs[job.id] = job
+        self._queue.put_nowait((-job.priority, next(self._order), job.id))
+
+    async def _save(self, job: GenerationJob):
+        # 复制一份再交给线程写入，写入期间任务对象可能继续被修改
+        await asyncio.to_thread(self.data_manager.save_job, job.copy(deep=True))
+
+    async def _finish(self, job: GenerationJob, status: JobStatus):
+        job.status = status
+        job.finished_at = datetime.now()
+        self._jobs.pop(job.id, None)
+        self._stats[{JobStatus.SUCCEEDED: "succeeded", JobStatus.FAILED: "failed",
+                     JobStatus.CANCELLED: "cancelled"}[status]] += 1
+        await self._save(job)
+
+    async def submit(self, job_type: str, params: Dict[str, Any], priority: int = 0) -> GenerationJob:
+        """
+        提交任务，立即返回
+
+        Raises:
+            ValueError: 未知的任务类型或参数不合法
+        """
+        if job_type not in self._handlers:
+            raise ValueError(f"未知的任务类型: {job_type}")
+        request = self._parse_params(job_type, params)
+        if isinstance(request, BaseModel):
+            params = request.dict()
+        await self.start()
+        job = GenerationJob(job_type=job_type, params=params, priority=priority)
+        await self._save(job)
+        self._enqueue(job)
+        self._stats["submitted"] += 1
+        return job
+
+    async def _work(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None or job.status != JobStatus.QUEUED:
+                continue  # 排队期间已被取消
+            task = asyncio.ensure_future(self._run(job))
+            self._running[job_id] = task
+            try:
+                # 不直接await任务，任务被取消时不影响工作协程
+                await asyncio.wait({task})
+            finally:
+                self._running.pop(job_id, None)
+
+    async def _run(self, job: GenerationJob):
+        job.status = JobStatus.RUNNING
+        job.started_at = datetime.now()
+        job.attempts += 1
+        await self._save(job)
+        handler, _ = self._handlers[job.job_type]
+        try:
+            job.result = await handler(self._parse_params(job.job_type, job.params), job.progress.update)
+            status = JobStatus.SUCCEEDED
+        except asyncio.CancelledError:
+            if self._stopping:
+                raise
+            status = JobStatus.CANCELLED
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.job_type}) failed: {str(e)}")
+            job.error = str(e)
+            status = JobStatus.FAILED
+        await self._finish(job, status)
+
+    async def get(self, job_id: str) -> Optional[GenerationJob]:
+        """获取任务，进行中的任务返回内存中的最新进度"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        return await asyncio.to_thread(self.data_manager.get_job, job_id)
+
+    async def cancel(self, job_id: str) -> Optional[GenerationJob]:
+        """取消排队中或运行中的任务，已结束的任务原样返回，不存在时返回None"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return await self.get(job_id)
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+            await asyncio.wait({task})
+        if not job.finished:
+            # 排队中，或刚被取出还未开始执行
+            await self._finish(job, JobStatus.CANCELLED)
+        return job
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "queued": sum(1 for j in self._jobs.values() if j.status == JobStatus.QUEUED),
+            "running": len(self._running),
+            "max_concurrency": self.max_concurrency,
+            "job_types": sorted(self._handlers),
+        }
+
+
+# 全局任务队列实例
+job_queue = JobQueue()
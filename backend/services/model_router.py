@@ -0,0 +1,209 @@
+# co-novel - 按内容类型的模型路由
+import os
+import json
+import math
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+from pydantic import BaseModel, Field
+
+from utils.tokenizer import estimate_tokens, count_words
+
+# 学习字符/token比例前需要累计的上游真实输出token数
+MIN_RATIO_SAMPLE_TOKENS = 500
+
+
+class ModelRoute(BaseModel):
+    """单个内容类型使用的模型与生成参数"""
+    model: str
+    max_tokens: Optional[int] = None  # 调用方未指定max_tokens时使用
+    temperature: float = 0.7
+    # 模型的上下文长度，提示词与max_tokens之和超出时截断提示词
+    context_window: int = Field(default_factory=lambda: int(os.getenv("LLM_CONTEXT_WINDOW", "32768")))
+    # 单次请求提示词的token预算，为None时只受上下文长度限制
+    max_prompt_tokens: Optional[int] = None
+    # 每1000 token的价格，用于按路由估算成本；0表示不统计
+    prompt_price: float = 0.0
+    completion_price: float = 0.0
+
+
+def _default_routes() -> Dict[str, ModelRoute]:
+    """默认路由：所有类型都用 OPENAI_MODEL，生成长度沿用原来的设置"""
+    model = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+    return {
+        "title": ModelRoute(model=model, max_tokens=200, temperature=0.9),
+        "outline": ModelRoute(model=model, max_tokens=400),
+        "chapter": ModelRoute(model=model, max_tokens=1200),
+        "suggestion": ModelRoute(model=model, max_tokens=300),
+        "summary": ModelRoute(model=model, max_tokens=300, temperature=0.3),
+        "content": ModelRoute(model=model, max_tokens=int(os.getenv("DEFAULT_MAX_TOKENS", "1500"))),
+    }
+
+
+def load_model_routes() -> Dict[str, ModelRoute]:
+    """
+    加载模型路由（默认值 + 环境变量覆盖）
+
+    例如：AI_MODEL_ROUTES={"title": {"model": "gpt-4o-mini", "max_tokens": 100}}
+    """
+    routes = _default_routes()
+
+    overrides = os.getenv("AI_MODEL_ROUTES")
+    if overrides:
+        try:
+            for content_type, values in json.loads(overrides).items():
+                base = routes.get(content_type) or routes["content"]
+                routes[content_type] = base.copy(update=values)
+        except (json.JSONDecodeError, AttributeError, TypeError) as e:
+            print(f"解析AI_MODEL_ROUTES失败，使用默认模型路由: {e}")
+
+    return routes
+
+
+def _new_metrics() -> Dict[str, Any]:
+    """单条路由的用量计数"""
+    return {
+        "calls": 0,
+        "failures": 0,
+        "latency_total": 0.0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cost": 0.0,
+        "estimated_calls": 0,  # 上游未返回usage、用本地估算计数的调用
+        "truncated_prompts": 0,
+        "truncated_tokens": 0,
+        "cancelled_calls": 0,  # 客户端断开等原因提前关闭的流式调用
+        "cancelled_tokens": 0,  # 提前关闭而没有生成（也不计费）的max_tokens余量
+    }
+
+
+class ModelRouter:
+    """
+    模型路由器
+
+    标题、建议等短小的结构化任务不需要最贵最慢的模型，按内容类型
+    选择模型、max_tokens和temperature，并按路由分别统计延迟、token和成本，
+    便于比较不同模型的效果。
+    """
+
+    def __init__(self, routes: Optional[Dict[str, ModelRoute]] = None):
+        self.routes = routes if routes is not None else load_model_routes()
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Dict[str, Any]] = {}
+        self._latencies: Dict[str, Deque[float]] = {}
+        # 按模型累计的输出字数与上游返回的输出token数，用于换算目标字数和max_tokens
+        self._ratio_samples: Dict[str, list] = {}
+        self.default_chars_per_token = float(os.getenv("LLM_CHARS_PER_TOKEN", "1.0"))
+
+    def get(self, content_type: str) -> ModelRoute:
+        """获取内容类型对应的路由，未配置的类型使用content的路由"""
+        return self.routes.get(content_type) or self.routes["content"]
+
+    def record(self, content_type: str, latency: float, prompt: str = "", completion: str = "",
+               usage: Any = None, failed: bool = False, cancelled_tokens: Optional[int] = None):
+        """
+        记录一次调用的用量
+
+        Args:
+            content_type: 内容类型
+            latency: 调用耗时（秒）
+            prompt: 提示词（上游未返回usage时用于估算）
+            completion: 生成的内容（同上）
+            usage: 上游返回的usage，包含prompt_tokens和completion_tokens
+            failed: 调用是否失败
+            cancelled_tokens: 流式调用被提前关闭时，max_tokens中没有用到的部分；
+                已输出的部分照常计入completion_tokens
+        """
+        route = self.get(content_type)
+        estimated = usage is None or getattr(usage, "prompt_tokens", None) is None
+        if not estimated:
+            prompt_tokens = usage.prompt_tokens
+            completion_tokens = usage.completion_tokens or 0
+        else:
+            prompt_tokens = estimate_tokens(prompt)
+            completion_tokens = estimate_tokens(completion)
+
+        with self._lock:
+            metrics = self._metrics_for(content_type)
+            metrics["calls"] += 1
+            if failed:
+                metrics["failures"] += 1
+                return
+            metrics["estimated_calls"] += int(estimated)
+            if cancelled_tokens is not None:
+                metrics["cancelled_calls"] += 1
+                metrics["cancelled_tokens"] += max(0, cancelled_tokens)
+            metrics["latency_total"] += latency
+            metrics["prompt_tokens"] += prompt_tokens
+            metrics["completion_tokens"] += completion_tokens
+            metrics["cost"] += (prompt_tokens * route.prompt_price + completion_tokens * route.completion_price) / 1000
+            self._latencies[content_type].append(latency)
+            if not estimated and completion and completion_tokens:
+                samples = self._ratio_samples.setdefault(route.model, [0, 0])
+                samples[0] += count_words(completion)
+                samples[1] += completion_tokens
+
+    def _metrics_for(self, content_type: str) -> Dict[str, Any]:
+        """取出路由的计数，调用方需持有锁"""
+        metrics = self._metrics.get(content_type)
+        if metrics is None:
+            metrics = self._metrics[content_type] = _new_metrics()
+            self._latencies[content_type] = deque(maxlen=200)
+        return metrics
+
+    def record_truncation(self, content_type: str, removed_tokens: int):
+        """记录一次超出预算而被截断的提示词"""
+        with self._lock:
+            metrics = self._metrics_for(content_type)
+            metrics["truncated_prompts"] += 1
+            metrics["truncated_tokens"] += removed_tokens
+
+    def chars_per_token(self, model: str) -> float:
+        """
+        模型每个输出token平均对应的字数
+
+        根据上游返回的真实输出token数学习，样本不足时使用LLM_CHARS_PER_TOKEN。
+        """
+        with self._lock:
+            chars, tokens = self._ratio_samples.get(model, (0, 0))
+        if tokens < MIN_RATIO_SAMPLE_TOKENS:
+            return self.default_chars_per_token
+        # 限制在合理范围内，避免个别异常输出把max_tokens带偏
+        return min(4.0, max(0.25, chars / tokens))
+
+    def max_tokens_for_words(self, content_type: str, words: int) -> int:
+        """生成约words字所需的max_tokens"""
+        return math.ceil(words / self.chars_per_token(self.get(content_type).model))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """各路由的配置和用量：调用数、失败数、平均/p95延迟、token数和估算成本"""
+        with self._lock:
+            by_route = {}
+            for content_type, metrics in self._metrics.items():
+                succeeded = metrics["calls"] - metrics["failures"]
+                latencies = sorted(self._latencies[content_type])
+                by_route[content_type] = {
+                    "model": self.get(content_type).model,
+                    "calls": metrics["calls"],
+                    "failures": metrics["failures"],
+                    "avg_latency": round(metrics["latency_total"] / succeeded, 3) if succeeded else 0.0,
+                    "p95_latency": round(latencies[int((len(latencies) - 1) * 0.95)], 3) if latencies else 0.0,
+                    "prompt_tokens": metrics["prompt_tokens"],
+                    "completion_tokens": metrics["completion_tokens"],
+                    "cost": round(metrics["cost"], 6),
+                    "estimated_calls": metrics["estimated_calls"],
+                    "truncated_prompts": metrics["truncated_prompts"],
+                    "truncated_tokens": metrics["truncated_tokens"],
+                    "cancelled_calls": metrics["cancelled_calls"],
+                    "cancelled_tokens": metrics["cancelled_tokens"],
+                }
+            ratios = {model: round(chars / tokens, 3) for model, (chars, tokens) in self._ratio_samples.items()}
+        return {
+            "routes": {name: route.dict() for name, route in self.routes.items()},
+            "usage": by_route,
+            "chars_per_token": ratios,
+        }
+
+
+# 全局模型路由，所有AIService共用，用量统计也合并在一起
+model_router = ModelRouter()
@@ -1,15 +1,23 @@
 # co-novel - 业务服务层
-from typing import Optional, List, Dict, Any
+import asyncio
+import os
+import time
+from typing import Optional, List, Dict, Any, AsyncIterator, Iterator
 from datetime import datetime
 
 from models.novel import (
     NovelProject, Chapter, CreationSession, 
     NovelGenre, NovelStatus, ChapterStatus, CreationStep,
     TitleGenerationRequest, OutlineGenerationRequest, ChapterGenerationRequest,
-    APIResponse
+    NovelDraftRequest, APIResponse
 )
 from services.data_service import data_manager
-from services.ai_service import AIService
+from services.ai_service import (AIService, GenerationError, StreamGenerationError,
+                                 STREAM_ERROR_MESSAGE, UNAVAILABLE_MESSAGE)
+from services.prefetch_service import ChapterPrefetcher
+from services.summary_service import StorySummarizer
+from utils.outline_parser import parse_outline, count_outline_chapters
+from utils.async_bridge import run_sync, iterate_sync
 
 
 class NovelBusinessService:
@@ -17,6 +25,12 @@ class NovelBusinessService:
     
     def __init__(self):
         self.ai_service = AIService()
+        # 章节预取（默认关闭，通过 ENABLE_CHAPTER_PREFETCH 开启）
+        self.prefetcher = ChapterPrefetcher(self.ai_service)
+        # 章节保存后异步生成摘要，维护每本小说的前情提要
+        self.summarizer = StorySummarizer(self.ai_service)
+        # 整本初稿同时生成的章节数（总并发另受上游调度器限制）
+        self.draft_parallelism = int(os.getenv("NOVEL_DRAFT_PARALLELISM", "3"))
     
     def create_novel_project(self, genre: NovelGenre, theme: str) -> APIResponse:
         """创建新的小说项目"""
@@ -42,11 +56,11 @@ class NovelBusinessService:
                 error_code="CREATE_PROJECT_FAILED"
             )
     
-    def generate_titles(self, request: TitleGenerationRequest) -> APIResponse:
+    async def generate_titles_async(self, request: TitleGenerationRequest) -> APIResponse:
         """生成小说标题"""
         try:
-            # 生成多个标题选项
-            titles = self.ai_service.generate_multiple_titles(
+            # 一次调用批量生成多个标题选项
+            titles = await self.ai_service.generate_multiple_titles_async(
                 request.genre.value, 
                 request.theme, 
                 request.count
@@ -64,13 +78,14 @@ class NovelBusinessService:
                 error_code="TITLE_GENERATION_FAILED"
             )
     
-    def generate_outline(self, request: OutlineGenerationRequest) -> APIResponse:
-        """生成小说大纲"""
+    async def generate_outline_async(self, request: OutlineGenerationRequest, raise_on_error: bool = False) -> APIResponse:
+        """生成小说大纲；raise_on_error为True时生成失败返回success=False，而不是备用大纲"""
         try:
-            outline = self.ai_service.generate_novel_outline(
+            outline = await self.ai_service.generate_novel_outline_async(
                 request.genre.value,
                 request.theme,
-                request.title
+                request.title,
+                raise_on_error=raise_on_error
             )
             
             return APIResponse(
@@ -85,15 +100,45 @@ class NovelBusinessService:
                 error_code="OUTLINE_GENERATION_FAILED"
             )
     
-    def generate_chapter(self, request: ChapterGenerationRequest) -> APIResponse:
-        """生成章节内容"""
+    def _find_novel(self, novel_id: Optional[str], title: str) -> Optional[NovelProject]:
+        """按ID查找小说，未提供ID时按标题查找最近更新的一本"""
+        if novel_id:
+            return data_manager.get_novel(novel_id)
+        for novel in data_manager.list_novels(limit=100):
+            if novel.title == title:
+                return novel
+        return None
+    
+    def _story_context(self, request: ChapterGenerationRequest) -> Optional[str]:
+        """已保存小说的前情提要，新小说或第一章返回None"""
+        if request.chapter_number <= 1:
+            return None
+        novel = self._find_novel(request.novel_id, request.title)
+        if novel is None:
+            return None
+        return self.summarizer.context_for(novel, request.chapter_number)
+    
+    async def generate_chapter_async(self, request: ChapterGenerationRequest, raise_on_error: bool = False) -> APIResponse:
+        """生成章节内容；raise_on_error为True时生成失败返回success=False，而不是把错误提示当作内容"""
         try:
-            content = self.ai_service.generate_chapter_content(
-                request.title,
-                request.outline,
-                request.chapter_number,
-                request.custom_title
-            )
+            story_context = await asyncio.to_thread(self._story_context, request)
+            try:
+                content = await self.ai_service.generate_chapter_content_async(
+                    request.title,
+                    request.outline,
+                    request.chapter_number,
+                    request.custom_title,
+                    story_context,
+                    request.word_count_target,
+                    raise_on_error=True
+                )
+            except GenerationError:
+                if raise_on_error:
+                    raise
+                # 生成失败时返回错误提示，不预取下一章
+                content = self.ai_service._error_message()
+            else:
+                self.prefetcher.schedule(request.title, request.outline, request.chapter_number)
             
             return APIResponse(
                 success=True,
@@ -111,6 +156,164 @@ class NovelBusinessService:
                 error_code="CHAPTER_GENERATION_FAILED"
             )
     
+    async def generate_chapter_stream_async(self, request: ChapterGenerationRequest) -> AsyncIterator[str]:
+        """流式生成章节内容，完整输出后预取下一章；生成失败时输出错误提示，不预取"""
+        story_context = await asyncio.to_thread(self._story_context, request)
+        produced = False
+        try:
+            async for chunk in self.ai_service.generate_chapter_content_stream_async(
+                request.title,
+                request.outline,
+                request.chapter_number,
+                request.custom_title,
+                story_context,
+                request.word_count_target,
+                raise_on_error=True
+            ):
+                produced = True
+                yield chunk
+        except StreamGenerationError:
+            if produced:
+                raise
+            yield STREAM_ERROR_MESSAGE if self.ai_service.providers.available else UNAVAILABLE_MESSAGE
+            return
+        self.prefetcher.schedule(request.title, request.outline, request.chapter_number)
+    
+    @staticmethod
+    def draft_chapter_count(request: NovelDraftRequest) -> int:
+        """
+        初稿要生成的章节数：优先使用请求中的chapter_count，否则按大纲中的章节数
+
+        Raises:
+            ValueError: 未指定章节数且大纲中没有章节
+        """
+        chapter_count = request.chapter_count or min(count_outline_chapters(request.outline), 20)
+        if chapter_count < 1:
+            raise ValueError("大纲中没有找到章节，请指定chapter_count")
+        return chapter_count
+    
+    def _create_draft_novel(self, request: NovelDraftRequest) -> NovelProject:
+        """为初稿创建小说项目"""
+        novel = data_manager.create_novel(request.genre, request.theme)
+        novel.title = request.title
+        novel.outline = request.outline
+        novel.outline_chapters = parse_outline(request.outline)
+        novel.status = NovelStatus.IN_PROGRESS
+        data_manager.update_novel(novel)
+        return novel
+    
+    async def generate_novel_draft_stream_async(self, request: NovelDraftRequest) -> AsyncIterator[Dict[str, Any]]:
+        """
+        并行生成整本小说初稿
+        
+        最多parallelism个章节同时流式生成，各章节的片段交错输出，每个事件都带有
+        chapter_number。每章生成完后立即保存，事件依次为：
+        - {"event": "start", "novel_id", "chapter_count", "parallelism"}
+        - {"event": "chunk", "chapter_number", "content"}
+        - {"event": "done", "chapter_number", "chapter_id", "word_count"}
+        - {"event": "error", "chapter_number", "message"}
+        - {"event": "end", "novel_id", "completed", "failed", "elapsed"}
+        生成失败的章节（包括已输出部分片段后失败的）只发送error事件，不保存、不更新前情摘要。
+        调用方提前停止迭代时，未完成的章节会被取消。
+        """
+        chapter_count = self.draft_chapter_count(request)
+        parallelism = request.parallelism or self.draft_parallelism
+        started = time.monotonic()
+        novel = await asyncio.to_thread(self._create_draft_novel, request)
+        yield {"event": "start", "novel_id": novel.id, "chapter_count": chapter_count, "parallelism": parallelism}
+        
+        events: asyncio.Queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(parallelism)
+        # save_chapter会重新统计小说的章节数和字数，串行保存避免互相覆盖
+        save_lock = asyncio.Lock()
+        
+        async def write_chapter(chapter_number: int):
+            async with semaphore:
+                try:
+                    parts = []
+                    async for chunk in self.ai_service.generate_chapter_content_stream_async(
+                        request.title, request.outline, chapter_number, raise_on_error=True
+                    ):
+                        parts.append(chunk)
+                        events.put_nowait({"event": "chunk", "chapter_number": chapter_number, "content": chunk})
+                    async with save_lock:
+                        saved = await asyncio.to_thread(self.save_chapter, novel.id, chapter_number, "".join(parts))
+                    if not saved.success:
+                        raise RuntimeError(saved.message)
+                    events.put_nowait({
+                        "event": "done",
+                        "chapter_number": chapter_number,
+                        "chapter_id": saved.data["id"],
+                        "word_count": saved.data["word_count"],
+                    })
+                except Exception as e:
+                    events.put_nowait({"event": "error", "chapter_number": chapter_number, "message": str(e)})
+        
+        tasks = [asyncio.create_task(write_chapter(n)) for n in range(1, chapter_count + 1)]
+        completed = failed = 0
+        try:
+            while completed + failed < chapter_count:
+                event = await events.get()
+                if event["event"] == "done":
+                    completed += 1
+                elif event["event"] == "error":
+                    failed += 1
+                yield event
+            yield {
+                "event": "end",
+                "novel_id": novel.id,
+                "completed": completed,
+                "failed": failed,
+                "elapsed": round(time.monotonic() - started, 3),
+            }
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def generate_titles(self, request: TitleGenerationRequest) -> APIResponse:
+        """生成小说标题（同步版本）"""
+        return run_sync(self.generate_titles_async(request))
+    
+    def generate_outline(self, request: OutlineGenerationRequest) -> APIResponse:
+        """生成小说大纲（同步版本）"""
+        return run_sync(self.generate_outline_async(request))
+    
+    def generate_chapter(self, request: ChapterGenerationRequest) -> APIResponse:
+        """生成章节内容（同步版本）"""
+        return run_sync(self.generate_chapter_async(request))
+    
+    def generate_chapter_stream(self, request: ChapterGenerationRequest) -> Iterator[str]:
+        """流式生成章节内容（同步版本）"""
+        return iterate_sync(self.generate_chapter_stream_async(request))
+    
+    def generate_novel_draft_stream(self, request: NovelDraftRequest) -> Iterator[Dict[str, Any]]:
+        """并行生成整本小说初稿（同步版本）"""
+        return iterate_sync(self.generate_novel_draft_stream_async(request))
+    
+    def get_cache_stats(self) -> APIResponse:
+        """获取AI缓存观测数据"""
+        try:
+            return APIResponse(
+                success=True,
+                message="获取缓存统计成功",
+                data=self.ai_service.get_cache_report()
+            )
+        except Exception as e:
+            return APIResponse(
+                success=False,
+                message=f"获取缓存统计失败: {str(e)}",
+                error_code="GET_CACHE_STATS_FAILED"
+            )
+    
+    def get_prefetch_stats(self) -> APIResponse:
+        """获取章节预取统计"""
+        return APIResponse(
+            success=True,
+            message="获取预取统计成功",
+            data=self.prefetcher.get_stats()
+        )
+    
     def save_novel_content(self, novel_id: str, title: str, outline: str) -> APIResponse:
         """保存小说基础内容"""
         try:
@@ -125,6 +328,7 @@ class NovelBusinessService:
             # 更新小说信息
             novel.title = title
             novel.outline = outline
+            novel.outline_chapters = parse_outline(outline)
             novel.status = NovelStatus.IN_PROGRESS
             
             # 如果是第一次设置标题，加入到生成标题列表
@@ -196,6 +400,7 @@ class NovelBusinessService:
                 novel.chapter_count = len(data_manager.get_chapters_by_novel(novel_id))
                 novel.total_word_count = sum(ch.word_count for ch in data_manager.get_chapters_by_novel(novel_id))
                 data_manager.update_novel(novel)
+                self.summarizer.schedule(novel_id, chapter.id)
                 
                 return APIResponse(
                     success=True,
@@ -312,6 +517,11 @@ class NovelBusinessService:
         """获取系统统计信息"""
         try:
             stats = data_manager.get_statistics()
+            cache_report = self.ai_service.get_cache_report()
+            stats["cache_efficiency"] = cache_report.get("hit_rate", 0.0)
+            stats["cache_hit_rates"] = cache_report.get("by_type", {})
+            stats["prefetch"] = self.prefetcher.get_stats()
+            stats["story_summary"] = self.summarizer.get_stats()
             return APIResponse(
                 success=True,
                 message="获取统计信息成功",
@@ -350,6 +560,7 @@ class NovelBusinessService:
                 existing_novel = data_manager.create_novel(genre_enum, theme or '默认主题')
                 existing_novel.title = title
                 existing_novel.outline = outline
+                existing_novel.outline_chapters = parse_outline(outline)
                 data_manager.update_novel(existing_novel)
             
             # 保存章节
@@ -372,6 +583,9 @@ class NovelBusinessService:
                 existing_novel.total_word_count = sum(ch.word_count for ch in chapters)
                 data_manager.update_novel(existing_novel)
                 
+                self.prefetcher.schedule(title, outline or existing_novel.outline, chapter_number)
+                self.summarizer.schedule(existing_novel.id, chapter.id)
+                
                 return {
                     "success": True,
                     "message": "章节保存成功",
@@ -0,0 +1,146 @@
+# co-novel - 章节预取服务
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any
+
+from utils.outline_parser import parse_outline
+
+
+class ChapterPrefetcher:
+    """
+    章节预取器
+
+    用户通常按顺序写作，第N章生成或保存后，在后台以较低优先级预先生成
+    第N+1章并写入AI缓存，之后用户请求第N+1章时可直接命中缓存。
+    预取受并发数和每小时token预算限制，超出时直接放弃而不排队。
+    """
+
+    def __init__(self, ai_service, enabled: Optional[bool] = None,
+                 max_concurrency: Optional[int] = None, token_budget: Optional[int] = None,
+                 budget_window: int = 3600):
+        self.ai_service = ai_service
+        self.enabled = enabled if enabled is not None else \
+            os.getenv("ENABLE_CHAPTER_PREFETCH", "false").lower() in ("true", "1", "yes")
+        self.max_concurrency = max_concurrency or int(os.getenv("PREFETCH_CONCURRENCY", "1"))
+        self.token_budget = token_budget if token_budget is not None else \
+            int(os.getenv("PREFETCH_TOKEN_BUDGET", "20000"))
+        self.budget_window = budget_window
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._inflight = set()
+        self._spent = deque()  # (时间戳, token数)
+        self._stats = {
+            "scheduled": 0,
+            "completed": 0,
+            "failed": 0,
+            "skipped_cached": 0,
+            "skipped_busy": 0,
+            "skipped_budget": 0,
+            "skipped_no_next_chapter": 0,
+            "tokens_spent": 0,
+        }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency,
+                thread_name_prefix="chapter-prefetch"
+            )
+        return self._executor
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _reserve_tokens(self, tokens: int) -> bool:
+        """在预算窗口内预留token，超出预算返回False"""
+        now = time.time()
+        with self._lock:
+            while self._spent and now - self._spent[0][0] > self.budget_window:
+                self._spent.popleft()
+            used = sum(t for _, t in self._spent)
+            if used + tokens > self.token_budget:
+                return False
+            self._spent.append((now, tokens))
+            return True
+
+    @staticmethod
+    def outline_has_chapter(outline: str, chapter_number: int) -> bool:
+        """大纲中是否规划了指定章节"""
+        return any(ch.number == chapter_number for ch in parse_outline(outline))
+
+    def schedule(self, title: str, outline: Optional[str], chapter_number: int) -> bool:
+        """
+        第chapter_number章完成后，安排预取下一章
+
+        Args:
+            title: 小说标题
+            outline: 小说大纲
+            chapter_number: 刚完成的章节号
+
+        Returns:
+            是否提交了预取任务
+        """
+        if not self.enabled or not title or not outline:
+            return False
+
+        next_number = chapter_number + 1
+        if not self.outline_has_chapter(outline, next_number):
+            self._count("skipped_no_next_chapter")
+            return False
+
+        task_key = (title, outline[:200], next_number)
+        with self._lock:
+            if task_key in self._inflight or len(self._inflight) >= self.max_concurrency:
+                self._stats["skipped_busy"] += 1
+                return False
+
+        if self.ai_service.is_chapter_cached(title, outline, next_number):
+            self._count("skipped_cached")
+            return False
+
+        chapter_tokens = self._chapter_tokens()
+        if not self._reserve_tokens(chapter_tokens):
+            self._count("skipped_budget")
+            return False
+
+        with self._lock:
+            self._inflight.add(task_key)
+            self._stats["scheduled"] += 1
+        self._get_executor().submit(self._run, task_key, title, outline, next_number, chapter_tokens)
+        return True
+
+    def _chapter_tokens(self) -> int:
+        """预取一章按实际请求的max_tokens（默认目标字数加余量换算）计入预算"""
+        _, max_tokens = self.ai_service._chapter_length(None)
+        return max_tokens
+
+    def _run(self, task_key, title: str, outline: str, chapter_number: int, tokens: int):
+        """后台执行预取"""
+        try:
+            if self.ai_service.prefetch_chapter_content(title, outline, chapter_number):
+                self._count("completed")
+                self._count("tokens_spent", tokens)
+            else:
+                self._count("failed")
+        except Exception as e:
+            print(f"章节预取异常: {e}")
+            self._count("failed")
+        finally:
+            with self._lock:
+                self._inflight.discard(task_key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """预取统计，hit_rate为预取内容被用户实际使用的比例"""
+        hits = self.ai_service.get_cache_stats().get("chapter", {}).get("prefetch_hits", 0)
+        with self._lock:
+            stats = dict(self._stats)
+            stats["inflight"] = len(self._inflight)
+        stats["enabled"] = self.enabled
+        stats["hits"] = hits
+        stats["hit_rate"] = round(hits / stats["completed"], 4) if stats["completed"] else 0.0
+        return stats
@@ -0,0 +1,245 @@
+# co-novel - 多服务商连接池与负载均衡
+import os
+import asyncio
+import json
+import random
+import threading
+import weakref
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+
+from services.rate_limiter import LLMScheduler
+from services.cassette import RecordingClient, ReplayClient, cassette_mode, get_cassette
+
+
+class LoopLocalClient:
+    """
+    按事件循环划分的AsyncOpenAI客户端
+
+    AsyncOpenAI的连接池绑定在首次使用它的事件循环上。服务器的事件循环和
+    同步接口使用的后台循环各自拿到一个客户端，对调用方来说仍然是
+    `client.chat.completions.create(...)`。
+    """
+
+    def __init__(self, **client_kwargs):
+        self._client_kwargs = client_kwargs
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+        # 提前构造一次，配置有误（如缺少API Key）时在启动阶段就报错
+        AsyncOpenAI(**client_kwargs)
+
+    @property
+    def chat(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = AsyncOpenAI(**self._client_kwargs)
+        return client.chat
+
+
+class ProviderConfig(BaseModel):
+    """单个OpenAI兼容服务商的配置"""
+    name: str
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    api_key_env: Optional[str] = None  # 从该环境变量读取API Key，避免把密钥写进配置
+    weight: float = 1.0  # 加权路由时的权重
+    models: Optional[List[str]] = None  # 支持的模型，为None时不限制
+    rpm: int = 0  # 该服务商（Key）每分钟请求数限制，0为不限制
+    tpm: int = 0  # 该服务商（Key）每分钟token数限制，0为不限制
+    max_concurrency: int = 1000  # 该服务商的最大并发，总并发另受全局调度器限制
+
+
+def load_provider_configs() -> List[ProviderConfig]:
+    """
+    读取服务商配置
+
+    优先使用 LLM_PROVIDERS（JSON数组），其次 LLM_PROVIDERS_FILE 指向的JSON文件，
+    都未配置时使用 OPENAI_API_KEY / OPENAI_BASE_URL 作为唯一的服务商。
+    """
+    raw = os.getenv("LLM_PROVIDERS")
+    source = "LLM_PROVIDERS"
+    if not raw and os.getenv("LLM_PROVIDERS_FILE"):
+        source = os.getenv("LLM_PROVIDERS_FILE")
+        try:
+            raw = Path(source).read_text(encoding="utf-8")
+        except OSError as e:
+            print(f"读取服务商配置文件失败: {e}")
+            raw = None
+
+    if raw:
+        try:
+            return [ProviderConfig(**item) for item in json.loads(raw)]
+        except Exception as e:
+            print(f"解析服务商配置({source})失败，使用默认服务商: {e}")
+
+    return [ProviderConfig(
+        name="default",
+        base_url=os.getenv("OPENAI_BASE_URL"),
+        api_key=os.getenv("OPENAI_API_KEY"),
+    )]
+
+
+class Provider:
+    """
+    一个服务商及其健康状况
+
+    用指数加权移动平均（EWMA）跟踪首字延迟（流式）、完整响应延迟（非流式）
+    和错误率，供路由时选择更快、更健康的服务商。
+    """
+
+    def __init__(self, config: ProviderConfig, client=None, ewma_alpha: float = 0.2):
+        self.config = config
+        self.name = config.name
+        self.client = client if client is not None else self._build_client(config)
+        self.scheduler = LLMScheduler(
+            max_concurrency=config.max_concurrency, rpm=config.rpm, tpm=config.tpm,
+            max_queue=int(os.getenv("LLM_QUEUE_SIZE", "100")),
+        )
+        self.alpha = ewma_alpha
+
+        self._lock = threading.Lock()
+        self.ewma_ttft: Optional[float] = None
+        self.ewma_latency: Optional[float] = None
+        self.ewma_error = 0.0
+        self._stats = {"calls": 0, "failures": 0}
+
+    @staticmethod
+    def _build_client(config: ProviderConfig):
+        """按配置创建客户端：真实服务商、进程内假模型（fake://），或录制/回放录像"""
+        mode = cassette_mode()
+        if mode == "replay":
+            # 回放不访问上游，也不需要API Key
+            return ReplayClient(get_cassette(), float(os.getenv("LLM_CASSETTE_SPEED", "1")))
+
+        if (config.base_url or "").startswith("fake://"):
+            # 离线压测：使用进程内的假模型，参数来自FAKE_LLM_*环境变量
+            from services.fake_llm import FakeLLMClient
+            client = FakeLLMClient()
+        else:
+            client = LoopLocalClient(
+                api_key=config.api_key or (os.getenv(config.api_key_env) if config.api_key_env else None),
+                base_url=config.base_url,
+                max_retries=0  # 重试由ResilientCaller统一处理
+            )
+        if mode == "record":
+            client = RecordingClient(client, get_cassette())
+        return client
+
+    def supports(self, model: str) -> bool:
+        return self.config.models is None or model in self.config.models
+
+    def _ewma(self, current: Optional[float], value: float) -> float:
+        return value if current is None else self.alpha * value + (1 - self.alpha) * current
+
+    def record_success(self, latency: float, stream: bool):
+        """记录成功调用，流式调用的latency为首字延迟"""
+        with self._lock:
+            self._stats["calls"] += 1
+            if stream:
+                self.ewma_ttft = self._ewma(self.ewma_ttft, latency)
+            else:
+                self.ewma_latency = self._ewma(self.ewma_latency, latency)
+            self.ewma_error = self._ewma(self.ewma_error, 0.0)
+
+    def record_failure(self):
+        """记录一次上游故障"""
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["failures"] += 1
+            self.ewma_error = self._ewma(self.ewma_error, 1.0)
+
+    def expected_latency(self, stream: bool) -> float:
+        """路由用的预期延迟；还没有样本时按0计，让新服务商先被探测"""
+        with self._lock:
+            value = self.ewma_ttft if stream else self.ewma_latency
+        return value or 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "weight": self.config.weight,
+                "ewma_ttft": round(self.ewma_ttft, 3) if self.ewma_ttft is not None else None,
+                "ewma_latency": round(self.ewma_latency, 3) if self.ewma_latency is not None else None,
+                "ewma_error": round(self.ewma_error, 4),
+            })
+        scheduler = self.scheduler.get_stats()
+        stats["inflight"] = scheduler["inflight"]
+        stats["queue_depth"] = scheduler["queue_depth"]
+        return stats
+
+
+class ProviderPool:
+    """
+    服务商池
+
+    每次调用按路由策略给出候选服务商的顺序，调用方依次尝试，上游故障时切换到下一个：
+    - weighted：按权重随机选择，权重随错误率降低
+    - least_latency：选择预期延迟最低的服务商
+    当前有额度（不需要排队）的服务商总是排在前面，错误率过高的服务商排在最后，
+    因此多个Key的限额可以叠加使用。
+    """
+
+    UNHEALTHY_ERROR_RATE = 0.5
+
+    def __init__(self, providers: List[Provider], strategy: Optional[str] = None):
+        self.providers = providers
+        self.strategy = strategy or os.getenv("LLM_ROUTING", "weighted")
+
+    @classmethod
+    def from_env(cls) -> "ProviderPool":
+        providers = []
+        for config in load_provider_configs():
+            try:
+                providers.append(Provider(config))
+            except Exception as e:
+                print(f"Warning: 服务商 {config.name} 初始化失败，已跳过: {e}")
+        return cls(providers)
+
+    @property
+    def available(self) -> bool:
+        return bool(self.providers)
+
+    def candidates(self, model: str, stream: bool = False, tokens: int = 0) -> List[Provider]:
+        """按路由策略排序的候选服务商"""
+        eligible = [p for p in self.providers if p.supports(model)]
+        if len(eligible) <= 1:
+            return eligible
+
+        if self.strategy == "least_latency":
+            ordered = sorted(eligible, key=lambda p: p.expected_latency(stream))
+        else:
+            ordered = self._weighted_order(eligible)
+
+        # 稳定排序：先按是否健康、是否有额度分组，组内保持路由顺序
+        return sorted(ordered, key=lambda p: (
+            p.ewma_error >= self.UNHEALTHY_ERROR_RATE,
+            not p.scheduler.would_admit(tokens),
+        ))
+
+    @staticmethod
+    def _weighted_order(providers: List[Provider]) -> List[Provider]:
+        """按权重不放回抽样得到顺序"""
+        remaining = list(providers)
+        ordered = []
+        while remaining:
+            weights = [max(p.config.weight * (1 - p.ewma_error), 1e-6) for p in remaining]
+            chosen = random.choices(remaining, weights=weights)[0]
+            remaining.remove(chosen)
+            ordered.append(chosen)
+        return ordered
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {
+            "strategy": self.strategy,
+            "providers": {p.name: p.get_stats() for p in self.providers},
+        }
+        if cassette_mode() != "off":
+            stats["cassette"] = {"mode": cassette_mode(), **get_cassette().get_stats()}
+        return stats
+
+
+# 全局服务商池，所有AIService共用
+provider_pool = ProviderPool.from_env()
@@ -0,0 +1,224 @@
+# co-novel - 上游模型调用的并发与速率限制
+import os
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Deque
+
+
+class SchedulerRejectedError(Exception):
+    """调度器拒绝了请求（等待队列已满或排队超时）"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class TokenBucket:
+    """令牌桶：容量为每分钟额度，按秒匀速补充；容量为0表示不限制"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: int, now: float) -> float:
+        """取走amount个令牌还需等待的秒数，0表示可以立即取走"""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        # 单次请求超过桶容量时按满桶计，否则永远等不到
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: int):
+        if self.capacity > 0:
+            self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    """排队中的请求；可以从任意线程唤醒，所在事件循环负责等待"""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+    def reset(self):
+        if self.future.done():
+            self.future = self.loop.create_future()
+
+    def wake(self):
+        def _set():
+            if not self.future.done():
+                self.future.set_result(None)
+        self.loop.call_soon_threadsafe(_set)
+
+
+class LLMScheduler:
+    """
+    上游模型调用调度器
+
+    所有对 chat.completions.create 的调用都先在这里取得许可：
+    同时在途的请求数不超过 max_concurrency，每分钟请求数和token数
+    分别受 RPM、TPM 令牌桶限制（token数按 max_tokens 加提示词估算）。
+    拿不到许可的请求按先来先到排队，队列满或等待超时时直接拒绝，
+    避免突发流量一起撞上服务商的限额后全部失败。
+
+    状态由线程锁保护，服务器事件循环和同步桥接的后台循环共用同一个调度器。
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, rpm: Optional[int] = None,
+                 tpm: Optional[int] = None, max_queue: Optional[int] = None,
+                 queue_timeout: Optional[float] = None):
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("LLM_QUEUE_SIZE", "100"))
+        self.queue_timeout = queue_timeout if queue_timeout is not None else \
+            float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+        self._rpm = TokenBucket(rpm if rpm is not None else int(os.getenv("LLM_RPM", "0")))
+        self._tpm = TokenBucket(tpm if tpm is not None else int(os.getenv("LLM_TPM", "0")))
+
+        self._lock = threading.Lock()
+        self._queue: Deque[_Waiter] = deque()
+        self._inflight = 0
+        self._wait_times: Deque[float] = deque(maxlen=500)
+        self._stats = {
+            "acquired": 0,
+            "rejected_queue_full": 0,
+            "rejected_timeout": 0,
+            "max_queue_depth": 0,
+            "tokens_reserved": 0,
+        }
+
+    def _try_take(self, tokens: int) -> Optional[float]:
+        """
+        队首请求尝试取得许可，调用方需持有锁
+
+        Returns:
+            0表示已取得；正数为令牌桶还需等待的秒数；None表示并发已满，需等待释放
+        """
+        if self._inflight >= self.max_concurrency:
+            return None
+        now = time.monotonic()
+        delay = max(self._rpm.wait_time(1, now), self._tpm.wait_time(tokens, now))
+        if delay > 0:
+            return delay
+        self._rpm.take(1)
+        self._tpm.take(tokens)
+        self._inflight += 1
+        return 0.0
+
+    def _granted(self, tokens: int, waited: float):
+        """记录一次成功取得许可，调用方需持有锁"""
+        self._stats["acquired"] += 1
+        self._stats["tokens_reserved"] += tokens
+        self._wait_times.append(waited)
+
+    def _wake_head(self):
+        """唤醒队首请求，调用方需持有锁"""
+        if self._queue:
+            self._queue[0].wake()
+
+    def would_admit(self, tokens: int = 0) -> bool:
+        """当前是否可以不排队直接取得许可（只检查，不占用）"""
+        with self._lock:
+            if self._queue or self._inflight >= self.max_concurrency:
+                return False
+            now = time.monotonic()
+            return self._rpm.wait_time(1, now) == 0 and self._tpm.wait_time(tokens, now) == 0
+
+    async def acquire(self, tokens: int = 0):
+        """
+        等待取得一个调用许可
+
+        Args:
+            tokens: 本次调用预计消耗的token数
+
+        Raises:
+            SchedulerRejectedError: 等待队列已满或排队超时
+        """
+        waiter = _Waiter()
+        enqueued_at = time.monotonic()
+        deadline = enqueued_at + self.queue_timeout
+
+        with self._lock:
+            # 没有人排队时直接尝试，不占用等待队列
+            if not self._queue and self._try_take(tokens) == 0:
+                self._granted(tokens, 0.0)
+                return
+            if len(self._queue) >= self.max_queue:
+                self._stats["rejected_queue_full"] += 1
+                raise SchedulerRejectedError("queue_full", "LLM请求排队已满")
+            self._queue.append(waiter)
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], len(self._queue))
+
+        try:
+            while True:
+                with self._lock:
+                    waiter.reset()
+                    delay = self._try_take(tokens) if self._queue[0] is waiter else None
+                    if delay == 0:
+                        self._queue.popleft()
+                        self._granted(tokens, time.monotonic() - enqueued_at)
+                        self._wake_head()
+                        return
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        self._stats["rejected_timeout"] += 1
+                    raise SchedulerRejectedError("timeout", "LLM请求排队超时")
+                timeout = remaining if delay is None else min(delay, remaining)
+                await asyncio.wait({waiter.future}, timeout=timeout)
+        except BaseException:
+            with self._lock:
+                if waiter in self._queue:
+                    was_head = self._queue[0] is waiter
+                    self._queue.remove(waiter)
+                    if was_head:
+                        self._wake_head()
+            raise
+
+    def release(self):
+        """归还许可"""
+        with self._lock:
+            self._inflight -= 1
+            self._wake_head()
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0):
+        """在许可内执行一次调用，流式调用应在整个读取过程中持有许可"""
+        await self.acquire(tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """队列深度、在途请求数和排队等待时间"""
+        with self._lock:
+            waits = sorted(self._wait_times)
+            stats = dict(self._stats)
+            stats.update({
+                "queue_depth": len(self._queue),
+                "inflight": self._inflight,
+                "max_concurrency": self.max_concurrency,
+                "rpm_limit": self._rpm.capacity,
+                "tpm_limit": self._tpm.capacity,
+            })
+        stats["avg_wait"] = round(sum(waits) / len(waits), 4) if waits else 0.0
+        stats["p95_wait"] = round(waits[int((len(waits) - 1) * 0.95)], 4) if waits else 0.0
+        stats["max_wait"] = round(waits[-1], 4) if waits else 0.0
+        return stats
+
+
+# 全局调度器实例，所有AIService共用
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,243 @@
+# co-novel - 上游模型调用的重试、截止时间与对冲请求
+import os
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set, TypeVar
+from pydantic import BaseModel
+
+from services.rate_limiter import SchedulerRejectedError
+
+T = TypeVar("T")
+
+# 可以重试的HTTP状态码：请求超时、冲突、限流和服务端错误
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class RetryPolicy(BaseModel):
+    """上游调用的重试策略"""
+    max_attempts: int = 3  # 含首次调用
+    base_delay: float = 0.5  # 退避基数（秒），第n次重试最多等待 base_delay * 2^n
+    max_delay: float = 8.0  # 单次退避上限（秒）
+    deadline: float = 60.0  # 单个请求（含排队、重试）的总时间预算（秒）
+    hedge_types: Set[str] = {"title"}  # 开启对冲请求的内容类型，只用于短的非流式调用
+    hedge_percentile: float = 0.95  # 超过该分位延迟仍未返回时发出对冲请求
+    hedge_min_samples: int = 20  # 延迟样本不足时不对冲
+
+    def backoff(self, retry: int) -> float:
+        """第retry次重试前的等待时间（full jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry)))
+
+
+def load_retry_policy() -> RetryPolicy:
+    """从环境变量读取重试策略"""
+    hedge_types = os.getenv("LLM_HEDGE_TYPES", "title")
+    return RetryPolicy(
+        max_attempts=max(1, int(os.getenv("RETRY_ATTEMPTS", "3"))),
+        base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5")),
+        max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "8")),
+        deadline=float(os.getenv("GENERATION_TIMEOUT", "60")),
+        hedge_types={t.strip() for t in hedge_types.split(",") if t.strip()},
+    )
+
+
+def classify_error(error: BaseException) -> Optional[str]:
+    """
+    判断上游错误是否值得重试
+
+    Returns:
+        错误类别（rate_limit/server/timeout/connection），不可重试时返回None
+    """
+    if isinstance(error, SchedulerRejectedError):
+        # 本地排队已满或超时，重试只会加剧拥塞
+        return None
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return "timeout"
+
+    name = type(error).__name__
+    if name == "APITimeoutError":
+        return "timeout"
+    if name == "APIConnectionError":
+        return "connection"
+
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status == 429:
+        return "rate_limit"
+    if status in RETRYABLE_STATUS:
+        return "server" if status >= 500 else "timeout"
+    return None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """读取服务商返回的 Retry-After（秒）"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LatencyTracker:
+    """按内容类型记录最近的调用延迟，用于计算对冲阈值"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, key: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """最近样本的q分位延迟，样本不足时返回None"""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[int((len(samples) - 1) * q)]
+
+
+class ResilientCaller:
+    """
+    带重试、截止时间和对冲的上游调用器
+
+    只有限流（429）、服务端错误（5xx）、超时和连接错误会重试，重试间隔按指数退避
+    加随机抖动；所有尝试共享一个截止时间，剩余时间不够下一次退避时直接放弃。
+    对 hedge_types 中的短调用，若超过近期p95延迟仍未返回，再发出一个相同请求，
+    先返回者胜出，另一个被取消。
+    """
+
+    def __init__(self, policy: Optional[RetryPolicy] = None):
+        self.policy = policy or load_retry_policy()
+        self.latency = LatencyTracker()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {
+            "calls": 0,
+            "retries": 0,
+            "retries_by_reason": {},
+            "failures": 0,
+            "deadline_exceeded": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+        }
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _count_retry(self, reason: str):
+        with self._lock:
+            self._stats["retries"] += 1
+            by_reason = self._stats["retries_by_reason"]
+            by_reason[reason] = by_reason.get(reason, 0) + 1
+
+    async def _timed(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        """执行一次尝试并记录成功调用的延迟"""
+        start = time.monotonic()
+        result = await func()
+        self.latency.record(key, time.monotonic() - start)
+        return result
+
+    async def _hedged(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        """超过分位延迟仍未返回时发出第二个请求，先成功者胜出"""
+        delay = self.latency.percentile(key, self.policy.hedge_percentile, self.policy.hedge_min_samples)
+        primary = asyncio.ensure_future(self._timed(key, func))
+        tasks = [primary]
+        try:
+            if delay is None:
+                return await primary
+
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            self._count("hedges")
+            hedge = asyncio.ensure_future(self._timed(key, func))
+            tasks.append(hedge)
+            pending = {primary, hedge}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # 包括被call()的截止时间取消时：asyncio.wait不会取消它等待的任务，这里统一取消，
+            # 避免请求继续占用调度许可并在之后记录延迟样本
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def call(self, key: str, func: Callable[[], Awaitable[T]], hedge: bool = False) -> T:
+        """
+        执行上游调用，可重试的错误按策略重试
+
+        Args:
+            key: 内容类型，用于延迟统计和对冲配置
+            func: 每次尝试时调用的协程工厂
+            hedge: 是否允许对冲（还需key在hedge_types中）
+
+        Returns:
+            func的返回值
+
+        Raises:
+            最后一次尝试的异常；超过截止时间时抛出asyncio.TimeoutError
+        """
+        self._count("calls")
+        deadline = time.monotonic() + self.policy.deadline
+        use_hedge = hedge and key in self.policy.hedge_types
+
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                attempt_coro = self._hedged(key, func) if use_hedge else self._timed(key, func)
+                return await asyncio.wait_for(attempt_coro, remaining)
+            except Exception as e:
+                reason = classify_error(e)
+                attempt += 1
+                if reason is None or attempt >= self.policy.max_attempts:
+                    self._fail(e)
+                    raise
+
+                wait = max(self.policy.backoff(attempt - 1), retry_after(e) or 0)
+                if time.monotonic() + wait >= deadline:
+                    self._fail(asyncio.TimeoutError())
+                    raise
+                self._count_retry(reason)
+                print(f"上游调用失败({key}, {reason})，{wait:.2f}秒后第{attempt}次重试: {e}")
+                await asyncio.sleep(wait)
+
+    def _fail(self, error: BaseException):
+        self._count("failures")
+        if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+            self._count("deadline_exceeded")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """重试、对冲和截止时间统计，以及各类型的近期p95延迟"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["retries_by_reason"] = dict(self._stats["retries_by_reason"])
+        with self.latency._lock:
+            keys = list(self.latency._samples)
+        stats["p95_latency"] = {
+            key: round(self.latency.percentile(key, 0.95), 3) for key in keys
+        }
+        return stats
+
+
+# 全局重试器，所有AIService共用，重试统计和对冲用的延迟样本也合并在一起
+resilient_caller = ResilientCaller()
@@ -0,0 +1,142 @@
+# co-novel - 滚动前情提要服务
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
+
+from models.novel import Chapter, NovelProject
+from services.data_service import data_manager
+
+
+class StorySummarizer:
+    """
+    滚动前情提要
+
+    章节保存后在后台生成该章摘要（约150字）并写回章节。每本小说维护两级摘要：
+    最近recent_chapters章保留各自的摘要，更早的章节合并进一份压缩的前情提要
+    （NovelProject.story_summary，约400字）。生成后续章节时带上这两部分，
+    提示词长度不随章节数增长。
+
+    摘要任务在单个后台线程中按提交顺序执行，同一本小说的前情提要不会被并发改写。
+    """
+
+    def __init__(self, ai_service, enabled: Optional[bool] = None, recent_chapters: Optional[int] = None):
+        self.ai_service = ai_service
+        self.enabled = enabled if enabled is not None else \
+            os.getenv("ENABLE_STORY_SUMMARY", "true").lower() in ("true", "1", "yes")
+        self.recent_chapters = recent_chapters or int(os.getenv("STORY_SUMMARY_RECENT_CHAPTERS", "3"))
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {
+            "scheduled": 0,
+            "chapter_summaries": 0,
+            "story_merges": 0,
+            "failed": 0,
+        }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="story-summary")
+        return self._executor
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def schedule(self, novel_id: str, chapter_id: str):
+        """
+        章节保存后安排生成摘要
+
+        Returns:
+            提交的后台任务，未开启或AI服务不可用时返回None
+        """
+        if not self.enabled or not self.ai_service.providers.available:
+            return None
+        with self._lock:
+            self._pending += 1
+            self._stats["scheduled"] += 1
+        return self._get_executor().submit(self._run, novel_id, chapter_id)
+
+    def _run(self, novel_id: str, chapter_id: str):
+        """后台执行：生成章节摘要，再滚动合并前情提要"""
+        try:
+            chapter = data_manager.get_chapter(chapter_id)
+            if chapter is None or not chapter.content:
+                return
+            summary = self.ai_service.summarize_chapter(chapter.chapter_number, chapter.content)
+            if summary is None:
+                self._count("failed")
+                return
+            # 生成摘要期间章节可能被修改，重新读取后只更新摘要
+            chapter = data_manager.get_chapter(chapter_id) or chapter
+            chapter.summary = summary
+            data_manager.update_chapter(chapter)
+            self._count("chapter_summaries")
+            self._roll_up(novel_id, chapter.chapter_number)
+        except Exception as e:
+            print(f"前情提要更新异常: {e}")
+            self._count("failed")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    @staticmethod
+    def _format(chapter: Chapter) -> str:
+        return f"第{chapter.chapter_number}章：{chapter.summary}"
+
+    def _roll_up(self, novel_id: str, chapter_number: int):
+        """超出recent_chapters的章节摘要合并进前情提要"""
+        novel = data_manager.get_novel(novel_id)
+        if novel is None:
+            return
+
+        # 已合并过的章节被重新保存时，前情提要需要从头重建
+        story_summary, summary_through = novel.story_summary, novel.summary_through
+        if chapter_number <= summary_through:
+            story_summary, summary_through = "", 0
+
+        pending = [ch for ch in data_manager.get_chapters_by_novel(novel_id)
+                   if ch.summary and ch.chapter_number > summary_through]
+        to_merge = pending[:max(0, len(pending) - self.recent_chapters)]
+        if to_merge:
+            merged = self.ai_service.merge_story_summary(story_summary, [self._format(ch) for ch in to_merge])
+            if merged is None:
+                self._count("failed")
+                return
+            story_summary, summary_through = merged, to_merge[-1].chapter_number
+            self._count("story_merges")
+
+        if (story_summary, summary_through) != (novel.story_summary, novel.summary_through):
+            # 合并期间小说的其他字段可能已被更新，重新读取后只改前情提要
+            novel = data_manager.get_novel(novel_id) or novel
+            novel.story_summary = story_summary
+            novel.summary_through = summary_through
+            data_manager.update_novel(novel)
+
+    def context_for(self, novel: NovelProject, chapter_number: int) -> Optional[str]:
+        """
+        第chapter_number章的前情提要：压缩的早期剧情 + 最近几章的摘要
+
+        重新生成已合并进前情提要的早期章节时，前情提要包含该章之后的剧情，
+        此时只使用前面几章各自的摘要。
+        """
+        parts: List[str] = []
+        use_story = novel.story_summary and novel.summary_through < chapter_number
+        if use_story:
+            parts.append(novel.story_summary)
+
+        earlier = [ch for ch in data_manager.get_chapters_by_novel(novel.id)
+                   if ch.summary and ch.chapter_number < chapter_number
+                   and (not use_story or ch.chapter_number > novel.summary_through)]
+        parts.extend(self._format(ch) for ch in earlier[-self.recent_chapters:])
+        return "\n".join(parts) or None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = self._pending
+        stats["enabled"] = self.enabled
+        stats["recent_chapters"] = self.recent_chapters
+        return stats
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# co-novel - AI缓存测试脚本
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+class StubCompletions:
+    """记录调用次数的假模型接口（与AsyncOpenAI相同的异步调用方式）"""
+
+    def __init__(self, reply: str = "模型生成的内容"):
+        self.reply = reply
+        self.calls = 0
+        self.last_params = {}
+
+    async def create(self, **params):
+        self.calls += 1
+        self.last_params = params
+        if params.get("stream"):
+            return self._stream()
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.reply))])
+
+    async def _stream(self):
+        for ch in self.reply:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=ch))])
+
+
+def make_service(policies):
+    """创建使用独立缓存策略、独立数据目录和假模型的AI服务"""
+    import tempfile
+    from services import ai_service, cache_service
+    from services.data_service import DataManager
+
+    cache_service.data_manager = DataManager(tempfile.mkdtemp(prefix="co-novel-cache-"))
+    ai_service.cache_manager = cache_service.AICacheManager(policies)
+    service = ai_service.AIService()
+    # 这里只测试缓存，相同的建议请求不合并
+    service.suggestion_flight.window = 0
+    completions = StubCompletions()
+    service.providers = make_pool(completions)
+    return service, completions
+
+
+def make_pool(*completions_list, **pool_options):
+    """用假模型接口构造服务商池，依次命名为stub0、stub1……"""
+    from services.provider_pool import Provider, ProviderConfig, ProviderPool
+
+    return ProviderPool([
+        Provider(ProviderConfig(name=f"stub{i}"), client=SimpleNamespace(chat=SimpleNamespace(completions=c)))
+        for i, c in enumerate(completions_list)
+    ], **pool_options)
+
+
+def test_outline_and_suggestion_cached():
+    """测试大纲、建议以及流式大纲走缓存"""
+    print("🧪 测试大纲和建议缓存...")
+
+    try:
+        from services.cache_service import CachePolicy
+        import uuid
+
+        service, completions = make_service({
+            "outline": CachePolicy(ttl=60),
+            "suggestion": CachePolicy(ttl=60),
+        })
+        theme = f"缓存测试-{uuid.uuid4()}"
+
+        first = service.generate_novel_outline("玄幻", theme, "《测试》")
+        second = service.generate_novel_outline("玄幻", theme, "《测试》")
+        assert first == second == completions.reply
+        assert completions.calls == 1
+
+        # 流式接口与非流式接口共用同一份缓存
+        streamed = "".join(service.generate_novel_outline_stream("玄幻", theme, "《测试》"))
+        assert streamed == completions.reply
+        assert completions.calls == 1
+
+        service.get_ai_suggestions(theme, "续写")
+        service.get_ai_suggestions(theme, "续写")
+        assert completions.calls == 2
+
+        stats = service.get_cache_stats()
+        assert stats["outline"]["hits"] == 2
+        assert stats["outline"]["misses"] == 1
+        assert stats["suggestion"]["hit_rate"] == 0.5
+
+        print("✅ 大纲和建议缓存测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 大纲和建议缓存测试失败: {e}")
+        return False
+
+
+def test_policy_controls():
+    """测试禁用缓存、流式不缓存和过期策略"""
+    print("🧪 测试缓存策略...")
+
+    try:
+        from services.cache_service import CachePolicy
+        import uuid
+
+        service, completions = make_service({
+            "outline": CachePolicy(enabled=False),
+            "chapter": CachePolicy(cache_stream=False),
+            "suggestion": CachePolicy(ttl=-1),
+        })
+        theme = f"策略测试-{uuid.uuid4()}"
+
+        service.generate_novel_outline("玄幻", theme, "《测试》")
+        service.generate_novel_outline("玄幻", theme, "《测试》")
+        assert completions.calls == 2
+
+        "".join(service.generate_chapter_content_stream(theme, "大纲", 1))
+        "".join(service.generate_chapter_content_stream(theme, "大纲", 1))
+        assert completions.calls == 4
+
+        # ttl为负数时写入后立即过期
+        service.get_ai_suggestions(theme, "续写")
+        service.get_ai_suggestions(theme, "续写")
+        assert completions.calls == 6
+
+        print("✅ 缓存策略测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 缓存策略测试失败: {e}")
+        return False
+
+
+def test_failures_not_cached():
+    """测试生成失败的结果不会写入缓存"""
+    print("🧪 测试失败结果不缓存...")
+
+    try:
+        from services.cache_service import CachePolicy
+        import uuid
+
+        service, completions = make_service({"outline": CachePolicy(ttl=60)})
+        theme = f"失败测试-{uuid.uuid4()}"
+
+        async def broken_create(**params):
+            completions.calls += 1
+            raise RuntimeError("upstream down")
+
+        completions.create = broken_create
+        outline = service.generate_novel_outline("玄幻", theme, "《测试》")
+        assert "第一章" in outline  # 返回备用大纲
+        service.generate_novel_outline("玄幻", theme, "《测试》")
+        assert completions.calls == 2
+
+        print("✅ 失败结果不缓存测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 失败结果不缓存测试失败: {e}")
+        return False
+
+
+def test_stream_failure_after_partial():
+    """测试流式生成中途失败时不拼接备用内容、不写入缓存，SSE以错误事件结束"""
+    print("🧪 测试流式生成中途失败...")
+
+    try:
+        import asyncio
+        import json
+        import uuid
+        from routers.ai import create_stream_generator
+        from services.ai_service import StreamGenerationError
+        from services.cache_service import CachePolicy
+
+        service, completions = make_service({"outline": CachePolicy(ttl=60)})
+        theme = f"中途失败-{uuid.uuid4()}"
+
+        async def broken_stream():
+            for ch in "第一章：":
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=ch))])
+            raise RuntimeError("connection reset")
+
+        async def broken_create(**params):
+            completions.calls += 1
+            return broken_stream()
+
+        completions.create = broken_create
+
+        async def collect():
+            chunks = []
+            try:
+                async for chunk in service.generate_novel_outline_stream_async("玄幻", theme, "《测试》"):
+                    chunks.append(chunk)
+            except StreamGenerationError as e:
+                return "".join(chunks), e
+            return "".join(chunks), None
+
+        partial, error = asyncio.run(collect())
+        # 只有已输出的部分，没有接上备用大纲
+        assert partial == "第一章：" and error is not None and error.produced == 4
+        asyncio.run(collect())
+        assert completions.calls == 2  # 失败的部分内容没有写入缓存
+
+        async def sse():
+            stream = service.generate_novel_outline_stream_async("玄幻", theme, "《测试》")
+            return [event async for event in create_stream_generator(stream, "outline")()]
+
+        events = [json.loads(event[len("data: "):]) for event in asyncio.run(sse())]
+        content = "".join(e["choices"][0]["delta"].get("content") or "" for e in events if e.get("choices"))
+        assert content == "第一章：" and events[-1]["object"] == "error"
+        assert not any(e.get("choices") and e["choices"][0]["finish_reason"] == "stop" for e in events)
+
+        print("✅ 流式生成中途失败测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 流式生成中途失败测试失败: {e}")
+        return False
+
+
+def test_near_duplicate_lookup():
+    """测试近似命中：主题只差一两个字时复用缓存"""
+    print("🧪 测试近似缓存...")
+
+    try:
+        from services.cache_service import CachePolicy
+        from utils.minhash import MinHasher, estimate_similarity
+        import uuid
+
+        # 签名相似度估算
+        hasher = MinHasher()
+        a = hasher.signature("以最弱战最强的逆袭之路")
+        assert estimate_similarity(a, a) == 1.0
+
+        service, completions = make_service({
+            "outline": CachePolicy(ttl=60, similarity_threshold=0.7),
+            "suggestion": CachePolicy(ttl=60),
+        })
+        title = f"《近似{uuid.uuid4().hex[:6]}》"
+
+        service.generate_novel_outline("玄幻", "以最弱战最强的逆袭之路", title)
+        service.generate_novel_outline("玄幻", "以最弱战最强的逆袭之旅", title)
+        assert completions.calls == 1
+        assert service.get_cache_stats()["outline"]["near_hits"] == 1
+
+        # 主题完全不同时不能命中
+        service.generate_novel_outline("玄幻", "重生归来向宗门复仇", title)
+        assert completions.calls == 2
+
+        # 未开启近似匹配的类型只做精确匹配
+        service.get_ai_suggestions(f"{title}主角拔出了剑", "续写")
+        service.get_ai_suggestions(f"{title}主角拔出了刀", "续写")
+        assert completions.calls == 4
+
+        print("✅ 近似缓存测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 近似缓存测试失败: {e}")
+        return False
+
+
+def test_chapter_prefetch():
+    """测试第N章完成后预取第N+1章，并统计预取命中率"""
+    print("🧪 测试章节预取...")
+
+    try:
+        from models.novel import ChapterGenerationRequest
+        from services.cache_service import CachePolicy
+        from services.prefetch_service import ChapterPrefetcher
+        import uuid
+
+        service, completions = make_service({"chapter": CachePolicy(ttl=60)})
+        service.chapter_word_target = 1000
+        prefetcher = ChapterPrefetcher(service, enabled=True, max_concurrency=1, token_budget=5000)
+        title = f"《预取{uuid.uuid4().hex[:6]}》"
+        outline = "第一章：开端\n主角登场\n\n第二章：转折\n遭遇强敌"
+
+        assert prefetcher.schedule(title, outline, 1)
+        prefetcher._get_executor().shutdown(wait=True)
+        assert completions.calls == 1
+
+        # 前端生成下一章时custom_title传空字符串、不指定目标字数，也应命中预取的内容
+        request = ChapterGenerationRequest(title=title, outline=outline, chapter_number=2, custom_title="")
+        content = service.generate_chapter_content(title, outline, 2, "", None, request.word_count_target)
+        assert content == completions.reply
+        assert completions.calls == 1
+
+        # 大纲中没有第三章，不再预取
+        assert not prefetcher.schedule(title, outline, 2)
+
+        stats = prefetcher.get_stats()
+        assert stats["completed"] == 1
+        # 预算按预取请求实际使用的max_tokens计算
+        _, requested = service._chapter_length(None)
+        assert completions.last_params["max_tokens"] == requested == stats["tokens_spent"]
+        assert stats["hit_rate"] == 1.0
+        assert stats["skipped_no_next_chapter"] == 1
+
+        # 超出token预算时放弃预取
+        poor = ChapterPrefetcher(service, enabled=True, token_budget=100)
+        assert not poor.schedule(f"{title}续", outline, 1)
+        assert poor.get_stats()["skipped_budget"] == 1
+
+        print("✅ 章节预取测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 章节预取测试失败: {e}")
+        return False
+
+
+def test_cache_report():
+    """测试缓存观测报告中的命中率、淘汰和节省量"""
+    print("🧪 测试缓存观测报告...")
+
+    try:
+        from services.cache_service import CachePolicy, estimate_tokens
+        import uuid
+
+        service, completions = make_service({"suggestion": CachePolicy(ttl=60, max_entries=1)})
+        content = f"报告测试-{uuid.uuid4()}"
+
+        service.get_ai_suggestions(content, "续写")
+        service.get_ai_suggestions(content, "续写")
+        service.get_ai_suggestions(content, "扩写")  # 超出max_entries，淘汰上一条
+
+        report = service.get_cache_report()
+        stats = report["by_type"]["suggestion"]
+        assert stats["lookups"] == 3
+        assert stats["hits"] == 1 and stats["misses"] == 2
+        assert stats["writes"] == 2
+        assert stats["evictions"] == 1
+        assert stats["entries"] == 1
+        assert stats["bytes_stored"] == len(completions.reply.encode("utf-8"))
+        assert stats["saved_tokens"] >= estimate_tokens(completions.reply)
+        assert stats["avg_saved_latency"] >= 0
+        assert 0 < report["hit_rate"] < 1
+
+        # 中文按字计，英文约4个字符一个token
+        assert estimate_tokens("你好世界") == 4
+        assert estimate_tokens("abcdefgh") == 2
+
+        print("✅ 缓存观测报告测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 缓存观测报告测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始缓存测试...\n")
+
+    tests = [
+        test_outline_and_suggestion_cached,
+        test_policy_controls,
+        test_failures_not_cached,
+        test_stream_failure_after_partial,
+        test_near_duplicate_lookup,
+        test_chapter_prefetch,
+        test_cache_report,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
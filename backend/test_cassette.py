@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# co-novel - 上游调用录制与回放测试脚本
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def make_cassette_service(client):
+    """创建只使用给定客户端的AI服务"""
+    from services.provider_pool import Provider, ProviderConfig, ProviderPool
+    from test_cache import make_service
+
+    service, _ = make_service({})
+    service.providers = ProviderPool([Provider(ProviderConfig(name="cassette"), client=client)])
+    return service
+
+
+async def timed_stream(service, prompt: str, max_tokens: int, limit=None):
+    """流式生成，返回(片段列表, 总耗时)；limit为读取的片段数上限"""
+    started = time.monotonic()
+    chunks = []
+    stream = service._request_completion_stream(prompt, max_tokens)
+    async for chunk in stream:
+        chunks.append(chunk)
+        if limit is not None and len(chunks) >= limit:
+            break
+    await stream.aclose()
+    return chunks, time.monotonic() - started
+
+
+def test_record():
+    """测试录制流式和非流式调用：请求参数、片段序列和片段间隔"""
+    print("🧪 测试录制上游调用...")
+
+    try:
+        from services.cassette import Cassette, RecordingClient, request_key
+        from services.fake_llm import FakeLLMClient, FakeLLMConfig
+
+        path = os.path.join(tempfile.mkdtemp(prefix="co-novel-cassette-"), "llm.jsonl")
+        fake = FakeLLMClient(FakeLLMConfig(ttft=0.05, tokens_per_second=200, chunk_tokens=4))
+        service = make_cassette_service(RecordingClient(fake, Cassette(path)))
+
+        chunks, _ = asyncio.run(timed_stream(service, "录制的开头", 40))
+        content = asyncio.run(service._request_completion("录制的完整内容", 30))
+        asyncio.run(timed_stream(service, "只读一部分", 40, limit=3))
+
+        records = list(Cassette(path)._load().values())
+        stream_record, full_record, partial_record = records
+        assert stream_record["chunks"] == chunks and len(stream_record["delays"]) == 10
+        assert stream_record["key"] == request_key(stream_record["params"])
+        # 首个片段约50ms（首字延迟），之后每个约4/200=20ms
+        assert 40 <= stream_record["delays"][0] <= 150
+        assert all(10 <= d <= 80 for d in stream_record["delays"][1:])
+        assert stream_record["usage"]["completion_tokens"] == 40
+        assert full_record["content"] == content and full_record["latency"] >= 50
+        # 提前结束的流只录下已读取的部分
+        assert len(partial_record["chunks"]) == 3
+
+        print(f"录像文件 {os.path.getsize(path)} 字节，3条记录")
+        print("✅ 录制上游调用测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 录制上游调用测试失败: {e}")
+        return False
+
+
+def test_replay():
+    """测试按请求哈希回放：内容一致，按原速或加速回放，录像中没有的请求直接失败"""
+    print("🧪 测试回放录像...")
+
+    try:
+        from services.cassette import Cassette, RecordingClient, ReplayClient
+        from services.fake_llm import FakeLLMClient, FakeLLMConfig
+
+        path = os.path.join(tempfile.mkdtemp(prefix="co-novel-cassette-"), "llm.jsonl")
+        fake = FakeLLMClient(FakeLLMConfig(ttft=0.05, tokens_per_second=200, chunk_tokens=4))
+        recorder = make_cassette_service(RecordingClient(fake, Cassette(path)))
+        recorded, recorded_time = asyncio.run(timed_stream(recorder, "回放的开头", 40))
+        content = asyncio.run(recorder._request_completion("回放的完整内容", 30))
+
+        original = make_cassette_service(ReplayClient(Cassette(path), speed=1))
+        replayed, replay_time = asyncio.run(timed_stream(original, "回放的开头", 40))
+        assert replayed == recorded
+        assert abs(replay_time - recorded_time) < 0.1
+        assert asyncio.run(original._request_completion("回放的完整内容", 30)) == content
+
+        fast = make_cassette_service(ReplayClient(Cassette(path), speed=10))
+        replayed, fast_time = asyncio.run(timed_stream(fast, "回放的开头", 40))
+        assert replayed == recorded and fast_time < recorded_time / 3
+        print(f"录制 {recorded_time * 1000:.0f}ms，原速回放 {replay_time * 1000:.0f}ms，10倍速 {fast_time * 1000:.0f}ms")
+
+        # 录像中没有的请求不重试，按生成失败处理
+        cassette = Cassette(path)
+        missing = make_cassette_service(ReplayClient(cassette, speed=0))
+        assert missing.generate_novel_content("没有录过的请求", 30) == missing._error_message()
+        assert cassette.get_stats()["misses"] == 1
+
+        print("✅ 回放录像测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 回放录像测试失败: {e}")
+        return False
+
+
+def test_mode_from_env():
+    """测试按LLM_CASSETTE_MODE为服务商创建录制或回放客户端"""
+    print("🧪 测试录像模式配置...")
+
+    try:
+        from services.cassette import RecordingClient, ReplayClient
+        from services.provider_pool import Provider, ProviderConfig
+
+        os.environ["LLM_CASSETTE_FILE"] = os.path.join(tempfile.mkdtemp(prefix="co-novel-cassette-"), "llm.jsonl")
+        try:
+            os.environ["LLM_CASSETTE_MODE"] = "record"
+            assert isinstance(Provider(ProviderConfig(name="a", base_url="fake://")).client, RecordingClient)
+            # 回放不需要API Key
+            os.environ["LLM_CASSETTE_MODE"] = "replay"
+            assert isinstance(Provider(ProviderConfig(name="b")).client, ReplayClient)
+        finally:
+            os.environ.pop("LLM_CASSETTE_MODE", None)
+            os.environ.pop("LLM_CASSETTE_FILE", None)
+
+        print("✅ 录像模式配置测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 录像模式配置测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始录制回放测试...\n")
+
+    tests = [
+        test_record,
+        test_replay,
+        test_mode_from_env,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# co-novel - 客户端断开时取消上游生成的测试脚本
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def use_fake_llm(*services, **config):
+    """让给定的AI服务都使用同一个慢速假模型和独立的路由统计"""
+    from services.model_router import ModelRouter
+    from test_fake_llm import make_fake_service
+    from utils.sse import CoalesceConfig, coalesce_settings, stream_registry
+
+    # 这里测试断开即取消，不等待续传的宽限期；逐片段发送，按事件数断开时位置确定
+    stream_registry.resume_grace = 0
+    coalesce_settings.default = CoalesceConfig(window=0)
+
+    fake_service, llm = make_fake_service(**config)
+    router = ModelRouter()
+    for service in services:
+        service.providers = fake_service.providers
+        service.router = router
+    return llm, router
+
+
+async def disconnect_early(app, path: str, body: dict, after: int):
+    """收到after段响应后断开，返回(耗时, 收到的段数)"""
+    from test_fake_llm import asgi_request
+
+    arrivals = []
+    started = time.monotonic()
+    await asgi_request(app, "POST", path, body, on_chunk=lambda t, data: arrivals.append(t),
+                       disconnect_after=after)
+    elapsed = time.monotonic() - started
+    await asyncio.sleep(0.05)  # 等待被取消的生成器完成清理
+    return elapsed, len(arrivals)
+
+
+def test_content_stream_disconnect():
+    """测试客户端断开后立即关闭上游，不再读取后续输出，并记录取消的用量"""
+    print("🧪 测试断开后取消上游生成...")
+
+    try:
+        from main import app
+        from routers import ai as ai_router
+
+        # 400个token、每个片段2个token、每秒200个token：完整输出约需2秒
+        llm, router = use_fake_llm(ai_router.ai_service, ttft=0.02, tokens_per_second=200, chunk_tokens=2)
+
+        elapsed, received = asyncio.run(disconnect_early(
+            app, "/api/ai/generate-content-stream", {"prompt": "断开测试", "max_tokens": 400}, after=5))
+        generated = llm.get_stats()["completion_tokens"]
+        assert elapsed < 0.5 and received <= 6
+        assert generated <= 20, generated
+
+        usage = router.get_stats()["usage"]["content"]
+        assert usage["cancelled_calls"] == 1
+        assert usage["cancelled_tokens"] >= 380 and usage["completion_tokens"] == generated
+        print(f"断开后{elapsed * 1000:.0f}ms返回，上游只生成了{generated}/400个token")
+
+        print("✅ 断开后取消上游生成测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 断开后取消上游生成测试失败: {e}")
+        return False
+
+
+def test_chapter_stream_disconnect():
+    """测试章节流式接口断开后同样取消上游，部分内容不写入缓存"""
+    print("🧪 测试章节流式断开...")
+
+    try:
+        from main import app
+        from services.novel_service import novel_service
+        from services import ai_service as ai_module
+
+        llm, router = use_fake_llm(novel_service.ai_service, ttft=0.02, tokens_per_second=200, chunk_tokens=2)
+        novel_service.prefetcher.enabled = False
+        request = {"title": "《断开测试》", "outline": "第一章：开端\n主角出场", "chapter_number": 1,
+                   "word_count_target": 500}
+
+        elapsed, _ = asyncio.run(disconnect_early(app, "/api/ai/generate-chapter-stream", request, after=4))
+        assert elapsed < 0.5 and llm.get_stats()["completion_tokens"] <= 20
+        assert router.get_stats()["usage"]["chapter"]["cancelled_calls"] == 1
+
+        cache_params = novel_service.ai_service._chapter_cache_params(
+            request["title"], request["outline"], 1, None, request["word_count_target"])
+        assert ai_module.cache_manager is None or not ai_module.cache_manager.contains("chapter", **cache_params)
+
+        print("✅ 章节流式断开测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 章节流式断开测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始客户端断开测试...\n")
+
+    tests = [
+        test_content_stream_disconnect,
+        test_chapter_stream_disconnect,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# co-novel - 离线假模型测试脚本
+
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+async def asgi_request(app, method: str, path: str, body=None, on_chunk=None, disconnect_after=None, headers=None):
+    """
+    直接调用ASGI应用，不需要启动服务器或安装HTTP客户端
+
+    Args:
+        on_chunk: 每收到一段响应体时调用，参数为(距请求开始的秒数, 字节)
+        disconnect_after: 收到这么多段响应体后模拟客户端断开，为None时不断开
+        headers: 额外的请求头，例如{"Last-Event-ID": "..."}
+
+    Returns:
+        (状态码, 响应体字节)
+    """
+    payload = json.dumps(body).encode("utf-8") if body is not None else b""
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query.encode(), "root_path": "", "server": ("testserver", 80), "client": ("127.0.0.1", 12345),
+        "headers": [(b"host", b"testserver"), (b"content-type", b"application/json"),
+                    (b"content-length", str(len(payload)).encode())]
+                   + [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+    }
+    received = False
+    status = None
+    chunks = []
+    started = time.monotonic()
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            chunks.append(message["body"])
+            if on_chunk is not None:
+                on_chunk(time.monotonic() - started, message["body"])
+            if disconnect_after is not None and len(chunks) >= disconnect_after:
+                disconnected.set()
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+
+def parse_sse(body: bytes):
+    """把SSE响应体解析为[(事件id, data的JSON)]，没有id行的事件id为None"""
+    events = []
+    for block in body.decode("utf-8").split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n") if ": " in line)
+        if "data" in fields:
+            events.append((fields.get("id"), json.loads(fields["data"])))
+    return events
+
+
+def make_fake_service(**config):
+    """创建通过fake://服务商调用进程内假模型的AI服务"""
+    from services.fake_llm import FakeLLMConfig
+    from services.provider_pool import Provider, ProviderConfig, ProviderPool
+    from test_cache import make_service
+
+    service, _ = make_service({})
+    provider = Provider(ProviderConfig(name="fake", base_url="fake://"))
+    provider.client.llm.config = FakeLLMConfig(**config)
+    service.providers = ProviderPool([provider])
+    return service, provider.client.llm
+
+
+def test_in_process_client():
+    """测试进程内假模型：输出确定、长度受max_tokens约束，流式首字延迟和输出速度符合配置"""
+    print("🧪 测试进程内假模型...")
+
+    try:
+        from utils.tokenizer import TokenUsage, current_usage
+
+        service, llm = make_fake_service(ttft=0.1, tokens_per_second=400, chunk_tokens=4)
+
+        first = asyncio.run(service._request_completion("写一段开头", 60))
+        second = asyncio.run(service._request_completion("写一段开头", 60))
+        other = asyncio.run(service._request_completion("写另一段开头", 60))
+        assert first == second and len(first) == 60 and first != other
+
+        async def stream():
+            usage = TokenUsage()
+            current_usage.set(usage)
+            started = time.monotonic()
+            arrivals = []
+            async for chunk in service._request_completion_stream("流式开头", 80):
+                arrivals.append((time.monotonic() - started, chunk))
+            return arrivals, usage
+
+        arrivals, usage = asyncio.run(stream())
+        assert len(arrivals) == 20 and all(len(chunk) == 4 for _, chunk in arrivals)
+        ttft, total = arrivals[0][0], arrivals[-1][0]
+        # 首字0.1秒，之后每个片段4/400=0.01秒
+        assert 0.09 <= ttft < 0.3 and total >= 0.1 + 19 * 0.01 - 0.01
+        assert not usage.estimated and usage.completion_tokens == 80
+        print(f"首字延迟 {ttft * 1000:.0f}ms，80 token用时 {total * 1000:.0f}ms")
+
+        stats = llm.get_stats()
+        assert stats["calls"] == 4 and stats["stream_calls"] == 1 and stats["errors"] == 0
+
+        print("✅ 进程内假模型测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 进程内假模型测试失败: {e}")
+        return False
+
+
+def test_error_rate():
+    """测试失败序列由种子决定，失败按可重试的上游错误处理"""
+    print("🧪 测试假模型错误率...")
+
+    try:
+        from services.fake_llm import FakeLLM, FakeLLMConfig, FakeLLMError
+        from services.resilience import classify_error
+
+        config = FakeLLMConfig(error_rate=0.3, seed=7)
+        llm_a, llm_b = FakeLLM(config), FakeLLM(config)
+        a = [llm_a.should_fail() for _ in range(200)]
+        b = [llm_b.should_fail() for _ in range(200)]
+        assert a == b and 40 <= sum(a) <= 80
+        assert classify_error(FakeLLMError(500)) == "server"
+        assert classify_error(FakeLLMError(429)) == "rate_limit"
+
+        service, llm = make_fake_service(ttft=0, tokens_per_second=0, error_rate=1.0)
+        service.resilience.policy.base_delay = 0
+        assert service.generate_novel_content("总是失败", 20) == service._error_message()
+        assert llm.get_stats()["errors"] == service.resilience.policy.max_attempts
+
+        print("✅ 假模型错误率测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 假模型错误率测试失败: {e}")
+        return False
+
+
+def test_asgi_app():
+    """测试OpenAI兼容的HTTP假模型：非流式JSON、流式SSE（含usage）和错误状态码"""
+    print("🧪 测试假模型HTTP服务...")
+
+    try:
+        from services.fake_llm import FakeLLMConfig, create_fake_llm_app
+
+        app = create_fake_llm_app(FakeLLMConfig(ttft=0, tokens_per_second=0, chunk_tokens=5))
+        params = {"model": "fake", "messages": [{"role": "user", "content": "你好"}], "max_tokens": 30}
+
+        status, body = asyncio.run(asgi_request(app, "POST", "/v1/chat/completions", params))
+        reply = json.loads(body)
+        assert status == 200 and len(reply["choices"][0]["message"]["content"]) == 30
+        assert reply["usage"]["completion_tokens"] == 30
+
+        stream_params = dict(params, stream=True, stream_options={"include_usage": True})
+        status, body = asyncio.run(asgi_request(app, "POST", "/v1/chat/completions", stream_params))
+        events = [line[len("data: "):] for line in body.decode("utf-8").split("\n\n") if line]
+        assert status == 200 and events[-1] == "[DONE]"
+        chunks = [json.loads(e) for e in events[:-1]]
+        content = "".join(c["choices"][0]["delta"].get("content", "") for c in chunks if c["choices"])
+        assert content == reply["choices"][0]["message"]["content"]
+        assert chunks[-1]["usage"]["completion_tokens"] == 30
+
+        failing = create_fake_llm_app(FakeLLMConfig(ttft=0, error_rate=1.0, error_status=429))
+        status, body = asyncio.run(asgi_request(failing, "POST", "/v1/chat/completions", stream_params))
+        assert status == 429 and "error" in json.loads(body)
+
+        print("✅ 假模型HTTP服务测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 假模型HTTP服务测试失败: {e}")
+        return False
+
+
+def test_router_end_to_end():
+    """测试在无网络环境下通过假模型端到端调用流式接口"""
+    print("🧪 测试流式接口端到端...")
+
+    try:
+        from main import app
+        from routers import ai as ai_router
+
+        service, _ = make_fake_service(ttft=0.05, tokens_per_second=1000, chunk_tokens=2)
+        ai_router.ai_service.providers = service.providers
+
+        arrivals = []
+        status, body = asyncio.run(asgi_request(
+            app, "POST", "/api/ai/generate-content-stream", {"prompt": "端到端测试的开头", "max_tokens": 100},
+            on_chunk=lambda t, data: arrivals.append(t)))
+        events = [data for _, data in parse_sse(body)]
+        content = "".join(e["choices"][0]["delta"].get("content") or "" for e in events if e.get("choices"))
+        assert status == 200 and len(content) == 100
+        assert events[-1]["usage"]["completion_tokens"] == 100
+        print(f"{len(events)}个事件，首个事件 {arrivals[0] * 1000:.0f}ms，"
+              f"最后一个 {arrivals[-1] * 1000:.0f}ms，共{len(body)}字节")
+
+        print("✅ 流式接口端到端测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 流式接口端到端测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始假模型测试...\n")
+
+    tests = [
+        test_in_process_client,
+        test_error_rate,
+        test_asgi_app,
+        test_router_end_to_end,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
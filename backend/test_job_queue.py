@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# co-novel - 后台生成任务队列测试脚本
+
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def make_queue(max_concurrency: int = 1, manager=None, **kwargs):
+    """使用临时数据目录的任务队列，注册一个按params["seconds"]休眠的测试任务"""
+    from services.data_service import DataManager
+    from services.job_service import JobQueue
+
+    manager = manager or DataManager(tempfile.mkdtemp(prefix="co-novel-jobs-"))
+    queue = JobQueue(manager, max_concurrency=max_concurrency, **kwargs)
+    log = {"order": [], "active": 0, "peak": 0, "cancelled": []}
+
+    async def sleep_job(params, progress):
+        log["order"].append(params["name"])
+        log["active"] += 1
+        log["peak"] = max(log["peak"], log["active"])
+        try:
+            await asyncio.sleep(params.get("seconds", 0.05))
+            progress({"slept": params.get("seconds", 0.05)})
+            if params.get("fail"):
+                raise RuntimeError("任务失败")
+            return {"name": params["name"]}
+        except asyncio.CancelledError:
+            log["cancelled"].append(params["name"])
+            raise
+        finally:
+            log["active"] -= 1
+
+    queue.register("sleep", sleep_job)
+    return queue, log
+
+
+def use_temp_data():
+    """让全局任务队列和业务服务写入临时数据目录，返回用于恢复的原数据管理器"""
+    from services import novel_service as novel_module
+    from services.data_service import DataManager
+    from services.job_service import job_queue
+
+    original = (job_queue.data_manager, novel_module.data_manager)
+    job_queue.data_manager = novel_module.data_manager = DataManager(tempfile.mkdtemp(prefix="co-novel-jobs-"))
+    return original
+
+
+def restore_data(original):
+    from services import novel_service as novel_module
+    from services.job_service import job_queue
+
+    job_queue.data_manager, novel_module.data_manager = original
+
+
+async def wait_for(queue, job_id: str, timeout: float = 5.0):
+    """轮询直到任务结束"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = await queue.get(job_id)
+        if job.finished:
+            return job
+        await asyncio.sleep(0.01)
+    raise TimeoutError(f"任务 {job_id} 未在{timeout}秒内结束")
+
+
+def test_priority_and_concurrency():
+    """测试按优先级执行（同优先级先进先出）、并发上限和结果持久化"""
+    print("🧪 测试任务优先级和并发上限...")
+
+    try:
+        from models.novel import JobStatus
+
+        async def run_ordered():
+            queue, log = make_queue(max_concurrency=1)
+            # 第一个任务立即开始，其余任务排队时按优先级排序
+            jobs = [await queue.submit("sleep", {"name": name}, priority)
+                    for name, priority in [("a", 0), ("b", 0), ("c", 5), ("d", -1), ("e", 5)]]
+            finished = [await wait_for(queue, job.id) for job in jobs]
+            return queue, log, finished
+
+        queue, log, finished = asyncio.run(run_ordered())
+        assert log["order"] == ["a", "c", "e", "b", "d"], log["order"]
+        assert all(job.status == JobStatus.SUCCEEDED for job in finished)
+        stored = queue.data_manager.get_job(finished[2].id)
+        assert stored.result == {"name": "c"} and stored.progress == {"slept": 0.05} and stored.attempts == 1
+
+        async def run_parallel():
+            queue, log = make_queue(max_concurrency=2)
+            jobs = [await queue.submit("sleep", {"name": str(i), "seconds": 0.05}) for i in range(6)]
+            started = time.monotonic()
+            for job in jobs:
+                await wait_for(queue, job.id)
+            return log, time.monotonic() - started
+
+        log, elapsed = asyncio.run(run_parallel())
+        # 6个任务、每个50ms、同时最多2个：约150ms
+        assert log["peak"] == 2 and 0.12 <= elapsed < 0.4, (log["peak"], elapsed)
+        print(f"执行顺序 a c e b d；并发上限2时6个任务耗时{elapsed * 1000:.0f}ms")
+
+        print("✅ 任务优先级和并发上限测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 任务优先级和并发上限测试失败: {e}")
+        return False
+
+
+def test_cancel_and_failure():
+    """测试取消排队中和运行中的任务，以及处理函数失败时记录错误"""
+    print("🧪 测试任务取消和失败...")
+
+    try:
+        from models.novel import JobStatus
+
+        async def run():
+            queue, log = make_queue(max_concurrency=1)
+            running = await queue.submit("sleep", {"name": "running", "seconds": 5})
+            queued = await queue.submit("sleep", {"name": "queued"})
+            failing = await queue.submit("sleep", {"name": "failing", "fail": True})
+            await asyncio.sleep(0.02)
+
+            cancelled_queued = await queue.cancel(queued.id)
+            cancelled_running = await queue.cancel(running.id)
+            failed = await wait_for(queue, failing.id)
+            return queue, log, cancelled_queued, cancelled_running, failed
+
+        queue, log, cancelled_queued, cancelled_running, failed = asyncio.run(run())
+        assert cancelled_queued.status == JobStatus.CANCELLED and cancelled_running.status == JobStatus.CANCELLED
+        assert log["cancelled"] == ["running"] and "queued" not in log["order"]
+        assert failed.status == JobStatus.FAILED and failed.error == "任务失败"
+        assert queue.data_manager.get_job(cancelled_running.id).status == JobStatus.CANCELLED
+        stats = queue.get_stats()
+        assert stats["cancelled"] == 2 and stats["failed"] == 1 and stats["queued"] == 0
+
+        # 参数校验和未知的任务类型在提交时报错
+        for job_type, params in [("unknown", {}), ("chapter", {"title": "缺少大纲"})]:
+            try:
+                asyncio.run(queue.submit(job_type, params))
+                raise AssertionError(f"{job_type} 应当被拒绝")
+            except ValueError:
+                pass
+
+        print("✅ 任务取消和失败测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 任务取消和失败测试失败: {e}")
+        return False
+
+
+def test_restart_recovery():
+    """测试服务重启后排队中的任务继续执行、运行中的任务重新执行，反复中断的任务标记失败"""
+    print("🧪 测试重启后恢复任务...")
+
+    try:
+        from models.novel import GenerationJob, JobStatus
+
+        async def before_restart():
+            queue, _ = make_queue(max_concurrency=1)
+            running = await queue.submit("sleep", {"name": "interrupted", "seconds": 0.3})
+            queued = await queue.submit("sleep", {"name": "waiting"}, priority=1)
+            await asyncio.sleep(0.02)
+            await queue.stop()
+            return queue.data_manager, running, queued
+
+        manager, running, queued = asyncio.run(before_restart())
+        assert manager.get_job(running.id).status == JobStatus.RUNNING
+        assert manager.get_job(queued.id).status == JobStatus.QUEUED
+        # 进程崩溃时留下的、已被中断3次的任务
+        crashed = manager.save_job(GenerationJob(job_type="sleep", params={"name": "crashed"},
+                                                 status=JobStatus.RUNNING, attempts=3))
+
+        async def after_restart():
+            queue, log = make_queue(max_concurrency=1, manager=manager)
+            await queue.start()
+            results = [await wait_for(queue, job.id) for job in (running, queued)]
+            return queue, log, results
+
+        queue, log, (resumed, waited) = asyncio.run(after_restart())
+        assert log["order"] == ["waiting", "interrupted"], log["order"]
+        assert resumed.status == JobStatus.SUCCEEDED and resumed.attempts == 2
+        assert waited.status == JobStatus.SUCCEEDED and waited.attempts == 1
+        assert manager.get_job(crashed.id).status == JobStatus.FAILED
+        assert queue.get_stats()["recovered"] == 1
+
+        print("✅ 重启后恢复任务测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 重启后恢复任务测试失败: {e}")
+        return False
+
+
+def test_job_endpoints():
+    """测试通过接口提交整本初稿任务、轮询状态并获取结果"""
+    print("🧪 测试任务接口...")
+
+    original = use_temp_data()
+    try:
+        from main import app
+        from services.novel_service import novel_service
+        from test_disconnect import use_fake_llm
+        from test_fake_llm import asgi_request
+
+        llm, _ = use_fake_llm(novel_service.ai_service, ttft=0.01, tokens_per_second=0, chunk_tokens=20)
+        novel_service.prefetcher.enabled = False
+        novel_service.summarizer.enabled = False
+        params = {"title": "《后台任务》", "outline": "第一章：开端\n主角出场\n第二章：风波\n矛盾出现",
+                  "chapter_count": 2}
+
+        async def run():
+            status, body = await asgi_request(app, "POST", "/api/ai/jobs",
+                                              {"job_type": "novel_draft", "params": params, "priority": 3})
+            assert status == 200, body
+            job_id = json.loads(body)["job_id"]
+            early, _ = await asgi_request(app, "GET", f"/api/ai/jobs/{job_id}/result")
+            for _ in range(200):
+                _, body = await asgi_request(app, "GET", f"/api/ai/jobs/{job_id}")
+                job = json.loads(body)
+                if job["status"] not in ("排队中", "运行中"):
+                    break
+                await asyncio.sleep(0.02)
+            _, result = await asgi_request(app, "GET", f"/api/ai/jobs/{job_id}/result")
+            bad, _ = await asgi_request(app, "POST", "/api/ai/jobs", {"job_type": "unknown", "params": {}})
+            missing, _ = await asgi_request(app, "GET", "/api/ai/jobs/unknown")
+            return early, job, json.loads(result), bad, missing
+
+        early, job, result, bad, missing = asyncio.run(run())
+        assert early in (200, 409)
+        assert job["status"] == "已完成" and job["progress"]["completed"] == 2 and "result" not in job
+        chapters = result["result"]["chapters"]
+        assert result["result"]["completed"] == 2 and [c["chapter_number"] for c in chapters] == [1, 2]
+        assert all(c["word_count"] > 0 for c in chapters)
+        assert bad == 400 and missing == 404
+        assert llm.get_stats()["stream_calls"] == 2
+
+        print("✅ 任务接口测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 任务接口测试失败: {e}")
+        return False
+    finally:
+        restore_data(original)
+
+
+def test_draft_job_failures():
+    """测试整本初稿任务：部分章节失败时在结果中列出，所有章节失败时任务失败"""
+    print("🧪 测试初稿任务中失败的章节...")
+
+    original = use_temp_data()
+    try:
+        from models.novel import JobStatus, NovelDraftRequest
+        from services.job_service import JobQueue, job_queue, run_novel_draft
+        from services.novel_service import novel_service
+        from services.resilience import ResilientCaller, RetryPolicy
+        from test_disconnect import use_fake_llm
+
+        def scripted(*failed):
+            async def events(request):
+                yield {"event": "start", "novel_id": "n1", "chapter_count": 3}
+                for n in (1, 2, 3):
+                    if n in failed:
+                        yield {"event": "error", "chapter_number": n, "message": "上游出错"}
+                    else:
+                        yield {"event": "done", "chapter_number": n, "chapter_id": f"c{n}", "word_count": 10}
+                yield {"event": "end", "novel_id": "n1", "completed": 3 - len(failed), "failed": len(failed)}
+            return events
+
+        request = NovelDraftRequest(title="《失败》", outline="第一章：开端", chapter_count=3)
+        novel_service.generate_novel_draft_stream_async = scripted(2)
+        try:
+            result = asyncio.run(run_novel_draft(request, lambda update: None))
+            novel_service.generate_novel_draft_stream_async = scripted(1, 2, 3)
+            asyncio.run(run_novel_draft(request, lambda update: None))
+            raise AssertionError("所有章节失败时应当抛出异常")
+        except RuntimeError as e:
+            assert "所有3个章节都生成失败" in str(e)
+        finally:
+            del novel_service.generate_novel_draft_stream_async
+        assert [c["chapter_number"] for c in result["chapters"]] == [1, 3]
+        assert result["failed_chapters"] == [{"chapter_number": 2, "message": "上游出错"}]
+        assert result["completed"] == 2 and result["failed"] == 1
+
+        # 上游一直出错时，任务失败，不保存错误提示作为章节
+        use_fake_llm(novel_service.ai_service, ttft=0, tokens_per_second=0, error_rate=1.0)
+        novel_service.prefetcher.enabled = False
+        novel_service.summarizer.enabled = False
+        novel_service.ai_service.resilience = ResilientCaller(RetryPolicy(max_attempts=1))
+
+        async def run():
+            queue = JobQueue(job_queue.data_manager, max_concurrency=1)
+            job = await queue.submit("novel_draft", {"title": "《失败》", "outline": "第一章：开端",
+                                                     "chapter_count": 2})
+            return await wait_for(queue, job.id)
+
+        job = asyncio.run(run())
+        assert job.status == JobStatus.FAILED and "所有2个章节都生成失败" in job.error, job.error
+        assert job.progress["failed"] == 2 and job_queue.data_manager.list_novels()[0].chapter_count == 0
+
+        print("✅ 初稿任务中失败的章节测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 初稿任务中失败的章节测试失败: {e}")
+        return False
+    finally:
+        restore_data(original)
+
+
+def test_outline_chapter_job_failures():
+    """测试大纲和单章任务：上游出错时任务失败，不以备用大纲或错误提示作为结果"""
+    print("🧪 测试大纲和单章任务失败...")
+
+    original = use_temp_data()
+    try:
+        from models.novel import JobStatus
+        from services.ai_service import ERROR_MESSAGE
+        from services.job_service import JobQueue, job_queue
+        from services.novel_service import novel_service
+        from services.resilience import ResilientCaller, RetryPolicy
+        from test_disconnect import use_fake_llm
+
+        llm, _ = use_fake_llm(novel_service.ai_service, ttft=0, tokens_per_second=0, error_rate=1.0)
+        novel_service.prefetcher.enabled = False
+        novel_service.summarizer.enabled = False
+        novel_service.ai_service.resilience = ResilientCaller(RetryPolicy(max_attempts=1))
+        outline_params = {"genre": "玄幻", "theme": "成长", "title": "《任务失败》"}
+        chapter_params = {"title": "《任务失败》", "outline": "第一章：开端\n主角出场", "chapter_number": 1}
+
+        async def run():
+            queue = JobQueue(job_queue.data_manager, max_concurrency=1)
+            jobs = {}
+            for error_rate in (1.0, 0.0):
+                llm.config.error_rate = error_rate
+                outline = await queue.submit("outline", outline_params)
+                chapter = await queue.submit("chapter", chapter_params)
+                jobs[error_rate] = (await wait_for(queue, outline.id), await wait_for(queue, chapter.id))
+            return jobs
+
+        jobs = asyncio.run(run())
+        failed_outline, failed_chapter = jobs[1.0]
+        assert failed_outline.status == JobStatus.FAILED and failed_outline.error, failed_outline.status
+        assert failed_chapter.status == JobStatus.FAILED and failed_chapter.error, failed_chapter.status
+
+        # 上游恢复后，任务返回真实生成的内容
+        outline, chapter = jobs[0.0]
+        fallback = novel_service.ai_service._build_fallback_outline("玄幻", "成长")
+        assert outline.status == JobStatus.SUCCEEDED and outline.result["outline"] not in ("", fallback)
+        assert chapter.status == JobStatus.SUCCEEDED and chapter.result["content"] not in ("", ERROR_MESSAGE)
+
+        print("✅ 大纲和单章任务失败测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 大纲和单章任务失败测试失败: {e}")
+        return False
+    finally:
+        restore_data(original)
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始后台任务队列测试...\n")
+
+    tests = [
+        test_priority_and_concurrency,
+        test_cancel_and_failure,
+        test_restart_recovery,
+        test_job_endpoints,
+        test_draft_job_failures,
+        test_outline_chapter_job_failures,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# co-novel - 模型路由测试脚本
+
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def test_load_routes():
+    """测试默认路由和环境变量覆盖"""
+    print("🧪 测试模型路由配置...")
+
+    try:
+        import os
+        from unittest import mock
+        from services.model_router import load_model_routes
+
+        with mock.patch.dict(os.environ, {"OPENAI_MODEL": "base-model", "AI_MODEL_ROUTES": ""}):
+            routes = load_model_routes()
+        assert {"title", "outline", "chapter", "suggestion", "summary", "content"} <= set(routes)
+        assert all(route.model == "base-model" for route in routes.values())
+        assert routes["outline"].max_tokens == 400 and routes["chapter"].max_tokens == 1200
+
+        overrides = '{"title": {"model": "small", "max_tokens": 80}, "summary": {"temperature": 0.1}}'
+        with mock.patch.dict(os.environ, {"OPENAI_MODEL": "base-model", "AI_MODEL_ROUTES": overrides}):
+            routes = load_model_routes()
+        assert routes["title"].model == "small" and routes["title"].max_tokens == 80
+        assert routes["title"].temperature == 0.9  # 未覆盖的字段保留默认值
+        assert routes["summary"].model == "base-model" and routes["summary"].temperature == 0.1
+
+        print("✅ 模型路由配置测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 模型路由配置测试失败: {e}")
+        return False
+
+
+def test_service_routing_and_usage():
+    """测试AIService按内容类型选择模型参数，并按路由统计用量和成本"""
+    print("🧪 测试按路由调用与用量统计...")
+
+    try:
+        from types import SimpleNamespace
+        from services.model_router import ModelRouter, ModelRoute
+        from test_cache import make_service
+
+        service, completions = make_service({})
+        service.router = ModelRouter({
+            "outline": ModelRoute(model="cheap", max_tokens=123, temperature=0.2),
+            "suggestion": ModelRoute(model="cheap", max_tokens=50, completion_price=2.0),
+            "content": ModelRoute(model="big", max_tokens=1500),
+        })
+
+        service.generate_novel_outline("玄幻", "路由测试", "《测试》")
+        assert completions.last_params["model"] == "cheap"
+        assert completions.last_params["max_tokens"] == 123
+        assert completions.last_params["temperature"] == 0.2
+
+        # 调用方显式指定的max_tokens优先
+        service.generate_novel_content("写一段开头", 77)
+        assert completions.last_params["model"] == "big"
+        assert completions.last_params["max_tokens"] == 77
+
+        # 未配置的类型沿用content路由
+        "".join(service.generate_chapter_content_stream("《测试》", "第一章：开端", 1))
+        assert completions.last_params["model"] == "big" and completions.last_params["stream"]
+
+        # 上游返回usage时按真实用量计费
+        original_create = completions.create
+
+        async def with_usage(**params):
+            response = await original_create(**params)
+            response.usage = SimpleNamespace(prompt_tokens=40, completion_tokens=500)
+            return response
+
+        completions.create = with_usage
+        service.get_ai_suggestions("主角拔出了剑", "续写")
+
+        usage = service.get_route_stats()["usage"]
+        assert set(usage) == {"outline", "content", "chapter", "suggestion"}
+        assert usage["outline"]["model"] == "cheap"
+        assert usage["suggestion"]["completion_tokens"] == 500
+        assert usage["suggestion"]["cost"] == 1.0
+        assert usage["chapter"]["completion_tokens"] > 0  # 流式调用按输出估算
+        assert all(u["calls"] == 1 and u["failures"] == 0 for u in usage.values())
+
+        print("✅ 按路由调用与用量统计测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 按路由调用与用量统计测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始模型路由测试...\n")
+
+    tests = [
+        test_load_routes,
+        test_service_routing_and_usage,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# co-novel - 整本初稿并行生成测试脚本
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+OUTLINE = "\n".join(f"第{n}章：测试章节{n}\n主角经历第{n}次考验" for n in range(1, 7))
+
+
+def make_business_service(delay: float = 0.02):
+    """创建使用假模型和独立数据目录的业务服务，假模型流式输出时记录同时在途的请求数"""
+    import tempfile
+    from services import novel_service as novel_module
+    from services.data_service import DataManager
+    from test_cache import make_service
+
+    novel_module.data_manager = DataManager(tempfile.mkdtemp(prefix="co-novel-draft-"))
+    ai, completions = make_service({})
+    completions.reply = "第一段。第二段。"
+    completions.active = completions.peak = 0
+
+    async def slow_stream():
+        completions.active += 1
+        completions.peak = max(completions.peak, completions.active)
+        try:
+            for part in ("第一段。", "第二段。"):
+                await asyncio.sleep(delay)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))])
+        finally:
+            completions.active -= 1
+
+    completions._stream = slow_stream
+    service = novel_module.NovelBusinessService()
+    service.ai_service = ai
+    return service, completions, novel_module.data_manager
+
+
+def test_draft_parallel_and_persisted():
+    """测试按并发上限并行生成，事件带章节号，每章都保存"""
+    print("🧪 测试整本初稿并行生成...")
+
+    try:
+        from models.novel import NovelDraftRequest
+
+        service, completions, data = make_business_service()
+        request = NovelDraftRequest(title="《并行测试》", outline=OUTLINE, parallelism=3)
+
+        started = time.monotonic()
+        events = list(service.generate_novel_draft_stream(request))
+        elapsed = time.monotonic() - started
+
+        assert events[0]["event"] == "start" and events[0]["chapter_count"] == 6
+        assert events[-1]["event"] == "end" and events[-1]["completed"] == 6
+        assert completions.calls == 6 and completions.peak == 3
+
+        # 同一章的片段按顺序到达，不同章节交错
+        chunks = [e for e in events if e["event"] == "chunk"]
+        for n in range(1, 7):
+            assert "".join(e["content"] for e in chunks if e["chapter_number"] == n) == completions.reply
+        assert [e["chapter_number"] for e in chunks[:3]] != [1, 1, 2]
+
+        chapters = data.get_chapters_by_novel(events[0]["novel_id"])
+        assert [ch.chapter_number for ch in chapters] == list(range(1, 7))
+        assert all(ch.content == completions.reply for ch in chapters)
+        novel = data.get_novel(events[0]["novel_id"])
+        assert novel.chapter_count == 6 and novel.title == "《并行测试》"
+
+        # 串行生成的耗时约为并行的3倍
+        serial, _, _ = make_business_service()
+        started = time.monotonic()
+        list(serial.generate_novel_draft_stream(NovelDraftRequest(title="《并行测试》", outline=OUTLINE, parallelism=1)))
+        assert time.monotonic() - started > elapsed * 2
+        print(f"并行耗时 {elapsed:.2f}s，串行耗时 {time.monotonic() - started:.2f}s")
+
+        print("✅ 整本初稿并行生成测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 整本初稿并行生成测试失败: {e}")
+        return False
+
+
+def test_draft_cancel_and_validation():
+    """测试提前停止时取消未完成的章节，没有章节的大纲直接报错"""
+    print("🧪 测试初稿取消与校验...")
+
+    try:
+        from models.novel import NovelDraftRequest
+
+        service, completions, _ = make_business_service(delay=0.05)
+
+        async def consume_first_chunk():
+            events = service.generate_novel_draft_stream_async(
+                NovelDraftRequest(title="《取消测试》", outline=OUTLINE, parallelism=2)
+            )
+            async for event in events:
+                if event["event"] == "chunk":
+                    break
+            await events.aclose()
+            await asyncio.sleep(0.1)
+
+        asyncio.run(consume_first_chunk())
+        assert completions.calls == 2 and completions.active == 0
+        assert service.ai_service.get_scheduler_stats()["inflight"] == 0
+
+        try:
+            service.draft_chapter_count(NovelDraftRequest(title="《空》", outline="没有章节标题的大纲"))
+            assert False, "应当抛出异常"
+        except ValueError:
+            pass
+        assert service.draft_chapter_count(NovelDraftRequest(title="《空》", outline="无", chapter_count=4)) == 4
+
+        print("✅ 初稿取消与校验测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 初稿取消与校验测试失败: {e}")
+        return False
+
+
+def test_draft_failed_chapters():
+    """测试生成失败的章节只发送error事件，不把错误提示保存为章节内容"""
+    print("🧪 测试初稿中失败的章节...")
+
+    try:
+        from models.novel import NovelDraftRequest
+
+        service, completions, data = make_business_service()
+        scheduled = []
+        service.summarizer.schedule = lambda novel_id, chapter_id: scheduled.append(chapter_id)
+
+        async def failing_stream():
+            # 第2次调用（串行时即第2章）输出一个片段后断开
+            failing = completions.calls == 2
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="第一段。"))])
+            if failing:
+                raise RuntimeError("connection reset")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="第二段。"))])
+
+        completions._stream = failing_stream
+        request = NovelDraftRequest(title="《失败测试》", outline=OUTLINE, chapter_count=3, parallelism=1)
+        events = list(service.generate_novel_draft_stream(request))
+        errors = [e for e in events if e["event"] == "error"]
+        assert [e["chapter_number"] for e in errors] == [2]
+        assert events[-1]["completed"] == 2 and events[-1]["failed"] == 1
+        chapters = data.get_chapters_by_novel(events[0]["novel_id"])
+        assert [ch.chapter_number for ch in chapters] == [1, 3]
+        assert all(ch.content == completions.reply for ch in chapters) and len(scheduled) == 2
+
+        # 上游完全不可用时所有章节失败，不保存错误提示
+        async def broken_create(**params):
+            completions.calls += 1
+            raise RuntimeError("upstream down")
+
+        completions.create = broken_create
+        events = list(service.generate_novel_draft_stream(request))
+        assert events[-1]["completed"] == 0 and events[-1]["failed"] == 3
+        assert data.get_chapters_by_novel(events[0]["novel_id"]) == [] and len(scheduled) == 2
+
+        print("✅ 初稿中失败的章节测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 初稿中失败的章节测试失败: {e}")
+        return False
+
+
+def test_chapter_prefetch_only_on_success():
+    """测试单章生成失败时返回错误提示但不预取下一章，成功后才预取"""
+    print("🧪 测试单章失败时不预取...")
+
+    try:
+        from models.novel import ChapterGenerationRequest
+        from services.ai_service import ERROR_MESSAGE, STREAM_ERROR_MESSAGE
+
+        service, completions, data = make_business_service(delay=0)
+        scheduled = []
+        service.prefetcher.schedule = lambda title, outline, number: scheduled.append(number)
+        request = ChapterGenerationRequest(title="《预取测试》", outline=OUTLINE, chapter_number=1)
+
+        async def stream_text():
+            return "".join([chunk async for chunk in service.generate_chapter_stream_async(request)])
+
+        create = completions.create
+
+        async def broken_create(**params):
+            completions.calls += 1
+            raise RuntimeError("upstream down")
+
+        completions.create = broken_create
+        response = asyncio.run(service.generate_chapter_async(request))
+        assert response.success and response.data["content"] == ERROR_MESSAGE
+        assert asyncio.run(stream_text()) == STREAM_ERROR_MESSAGE
+        assert scheduled == []
+
+        completions.create = create
+        response = asyncio.run(service.generate_chapter_async(request))
+        assert response.data["content"] == completions.reply
+        assert asyncio.run(stream_text()) == completions.reply
+        assert scheduled == [1, 1]
+
+        print("✅ 单章失败时不预取测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 单章失败时不预取测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始整本初稿生成测试...\n")
+
+    tests = [
+        test_draft_parallel_and_persisted,
+        test_draft_cancel_and_validation,
+        test_draft_failed_chapters,
+        test_chapter_prefetch_only_on_success,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# co-novel - 大纲解析与章节提示词裁剪测试脚本
+
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+NUMERALS = "一二三四五六七八九十"
+
+
+def chinese(n: int) -> str:
+    """1-20的中文数字"""
+    if n <= 10:
+        return NUMERALS[n - 1]
+    return "十" + NUMERALS[n - 11] if n < 20 else "二十"
+
+
+def make_outline(chapters: int = 20) -> str:
+    """按大纲提示词要求的格式构造大纲，每章概括约30字"""
+    return "\n\n".join(
+        f"第{chinese(n)}章：风云再起之{n}\n主角在第{n}次试炼中遭遇强敌围攻，绝境中领悟新的剑意，击退来犯之敌。"
+        for n in range(1, chapters + 1)
+    )
+
+
+def test_parse_outline():
+    """测试解析中文/阿拉伯数字章节号、多行概括和常见的Markdown写法"""
+    print("🧪 测试大纲解析...")
+
+    try:
+        from utils.outline_parser import chinese_number, parse_outline
+
+        assert chinese_number("十二") == 12 and chinese_number("二十") == 20
+        assert chinese_number("一百零五") == 105 and chinese_number("7") == 7
+
+        chapters = parse_outline(make_outline())
+        assert [ch.number for ch in chapters] == list(range(1, 21))
+        assert chapters[11].title == "风云再起之12"
+        assert chapters[11].summary.startswith("主角在第12次试炼中")
+
+        outline = "好的，以下是大纲：\n\n**第1章：初入江湖**\n少年下山，\n遇到师兄。\n\n## 第二章 [风起云涌]\n门派内斗。"
+        chapters = parse_outline(outline)
+        assert [(ch.number, ch.title, ch.summary) for ch in chapters] == [
+            (1, "初入江湖", "少年下山，遇到师兄。"),
+            (2, "风起云涌", "门派内斗。"),
+        ]
+        assert parse_outline("没有章节格式的大纲") == []
+
+        print("✅ 大纲解析测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 大纲解析测试失败: {e}")
+        return False
+
+
+def test_chapter_prompt_window():
+    """测试章节提示词只带本章及相邻章节，并统计20章大纲的提示词token减少量"""
+    print("🧪 测试章节提示词裁剪...")
+
+    try:
+        from services.ai_service import AIService
+        from utils.tokenizer import estimate_tokens
+
+        service = AIService()
+        outline = make_outline(20)
+
+        prompt = service._build_chapter_prompt("《测试》", outline, 10)
+        assert "【本章】第10章：风云再起之10" in prompt
+        assert "第9章：" in prompt and "第11章：" in prompt
+        assert "第8章：" not in prompt and "第12章：" not in prompt
+
+        # 无法解析或大纲中没有该章时退回完整大纲
+        assert "完整大纲" in service._build_chapter_prompt("《测试》", "自由格式的大纲", 1)
+        assert "完整大纲" in service._build_chapter_prompt("《测试》", outline, 21)
+
+        # 修改其他章节的大纲不影响本章的缓存键
+        edited = outline.replace("主角在第15次", "主角在第十五次")
+        assert service._chapter_cache_params("《测试》", outline, 3) == \
+            service._chapter_cache_params("《测试》", edited, 3)
+        assert service._chapter_cache_params("《测试》", outline, 15) != \
+            service._chapter_cache_params("《测试》", edited, 15)
+
+        service.outline_window = 10 ** 6  # 窗口覆盖全书时相当于旧的完整大纲
+        full = [estimate_tokens(service._build_chapter_prompt("《测试》", outline, n)) for n in range(1, 21)]
+        service.outline_window = 1
+        windowed = [estimate_tokens(service._build_chapter_prompt("《测试》", outline, n)) for n in range(1, 21)]
+        reduction = 1 - sum(windowed) / sum(full)
+        print(f"20章大纲每章提示词平均token: 完整 {sum(full) / 20:.0f}，裁剪后 {sum(windowed) / 20:.0f}，减少 {reduction:.0%}")
+        assert reduction > 0.6
+
+        print("✅ 章节提示词裁剪测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 章节提示词裁剪测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始大纲解析测试...\n")
+
+    tests = [
+        test_parse_outline,
+        test_chapter_prompt_window,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
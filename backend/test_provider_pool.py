@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# co-novel - 多服务商路由与故障切换测试脚本
+
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def make_failing(completions, status_code: int = 503):
+    """让假模型接口始终返回上游错误"""
+    from test_resilience import UpstreamError
+
+    async def down(**params):
+        completions.calls += 1
+        raise UpstreamError(status_code)
+
+    completions.create = down
+
+
+def test_load_configs():
+    """测试从环境变量和文件读取服务商配置"""
+    print("🧪 测试服务商配置...")
+
+    try:
+        import json
+        import os
+        import tempfile
+        from unittest import mock
+        from services.provider_pool import load_provider_configs
+
+        providers = [
+            {"name": "a", "base_url": "https://a.example/v1", "api_key": "k1", "weight": 3},
+            {"name": "b", "api_key_env": "B_KEY", "rpm": 60, "models": ["m1"]},
+        ]
+        with mock.patch.dict(os.environ, {"LLM_PROVIDERS": json.dumps(providers)}):
+            configs = load_provider_configs()
+        assert [c.name for c in configs] == ["a", "b"]
+        assert configs[0].weight == 3 and configs[1].rpm == 60
+
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump(providers[:1], f)
+        with mock.patch.dict(os.environ, {"LLM_PROVIDERS": "", "LLM_PROVIDERS_FILE": f.name}):
+            assert [c.name for c in load_provider_configs()] == ["a"]
+
+        # 未配置时退回单个默认服务商
+        with mock.patch.dict(os.environ, {"LLM_PROVIDERS": "", "LLM_PROVIDERS_FILE": ""}):
+            assert [c.name for c in load_provider_configs()] == ["default"]
+
+        print("✅ 服务商配置测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 服务商配置测试失败: {e}")
+        return False
+
+
+def test_routing_order():
+    """测试最低延迟路由、模型过滤，以及无额度和不健康的服务商排在后面"""
+    print("🧪 测试路由顺序...")
+
+    try:
+        from services.provider_pool import Provider, ProviderConfig, ProviderPool
+        from test_cache import StubCompletions, make_pool
+
+        pool = make_pool(StubCompletions(), StubCompletions(), StubCompletions(), strategy="least_latency")
+        fast, slow, fresh = pool.providers
+        fast.record_success(0.2, stream=True)
+        slow.record_success(1.5, stream=True)
+        # 没有样本的服务商先被探测
+        assert [p.name for p in pool.candidates("m", stream=True)] == ["stub2", "stub0", "stub1"]
+
+        fresh.record_success(3.0, stream=True)
+        assert [p.name for p in pool.candidates("m", stream=True)] == ["stub0", "stub1", "stub2"]
+
+        # 错误率过高的排在最后
+        for _ in range(5):
+            fast.record_failure()
+        assert pool.candidates("m", stream=True)[-1] is fast
+
+        # 只为支持该模型的服务商路由
+        only_m1 = Provider(ProviderConfig(name="m1-only", models=["m1"]), client=object())
+        pool.providers.append(only_m1)
+        assert only_m1 not in pool.candidates("m2")
+        assert only_m1 in pool.candidates("m1")
+
+        # RPM额度用完的服务商排在有额度的后面
+        limited = ProviderPool([
+            Provider(ProviderConfig(name="limited", rpm=1), client=object()),
+            Provider(ProviderConfig(name="spare", weight=0.001), client=object()),
+        ])
+        limited.providers[0].scheduler._rpm.take(1)
+        assert [p.name for p in limited.candidates("m")] == ["spare", "limited"]
+
+        print("✅ 路由顺序测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 路由顺序测试失败: {e}")
+        return False
+
+
+def test_failover():
+    """测试非流式和流式调用在一个服务商故障时切换到另一个"""
+    print("🧪 测试故障切换...")
+
+    try:
+        from services.circuit_breaker import CircuitBreakerRegistry
+        from test_cache import StubCompletions, make_pool, make_service
+
+        service, _ = make_service({})
+        broken, healthy = StubCompletions(), StubCompletions("备用服务商的内容")
+        make_failing(broken)
+        service.providers = make_pool(broken, healthy, strategy="least_latency")
+        service.circuit_breakers = CircuitBreakerRegistry(window_size=4, min_calls=2, open_seconds=60)
+
+        assert service.get_ai_suggestions("主角拔出了剑", "续写") == healthy.reply
+        assert broken.calls == 1 and healthy.calls == 1
+
+        streamed = "".join(service.generate_novel_content_stream("写一段开头", 50))
+        assert streamed == healthy.reply
+        assert broken.calls == 2 and healthy.calls == 2
+
+        # 故障服务商熔断后不再被调用，流量全部走健康的服务商
+        service.get_ai_suggestions("主角拔出了刀", "续写")
+        assert broken.calls == 2 and healthy.calls == 3
+
+        stats = service.get_provider_stats()["providers"]
+        assert stats["stub0"]["failures"] == 2
+        assert stats["stub1"]["ewma_error"] == 0
+        assert stats["stub1"]["ewma_ttft"] is not None
+        assert stats["stub1"]["inflight"] == 0
+        assert service.get_circuit_stats()[f"stub0/{service.model}"]["state"] == "open"
+
+        print("✅ 故障切换测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 故障切换测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始服务商池测试...\n")
+
+    tests = [
+        test_load_configs,
+        test_routing_order,
+        test_failover,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
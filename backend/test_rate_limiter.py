@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# co-novel - 上游调用限流测试脚本
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def test_concurrency_limit():
+    """测试同时在途的请求数不超过上限，排队请求按顺序放行"""
+    print("🧪 测试并发上限...")
+
+    try:
+        from services.rate_limiter import LLMScheduler
+
+        scheduler = LLMScheduler(max_concurrency=2, rpm=0, tpm=0, max_queue=10, queue_timeout=5)
+        active = 0
+        peak = 0
+
+        async def call():
+            nonlocal active, peak
+            async with scheduler.slot(100):
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.02)
+                active -= 1
+
+        async def main():
+            await asyncio.gather(*(call() for _ in range(8)))
+
+        asyncio.run(main())
+        stats = scheduler.get_stats()
+        assert peak == 2
+        assert stats["acquired"] == 8
+        assert stats["inflight"] == 0 and stats["queue_depth"] == 0
+        assert stats["max_queue_depth"] == 6
+        assert stats["max_wait"] > 0
+
+        print("✅ 并发上限测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 并发上限测试失败: {e}")
+        return False
+
+
+def test_queue_full_and_timeout():
+    """测试队列已满和排队超时时直接拒绝"""
+    print("🧪 测试排队拒绝...")
+
+    try:
+        from services.rate_limiter import LLMScheduler, SchedulerRejectedError
+
+        scheduler = LLMScheduler(max_concurrency=1, rpm=0, tpm=0, max_queue=1, queue_timeout=0.05)
+
+        async def main():
+            await scheduler.acquire()  # 占住唯一的并发
+            waiting = asyncio.ensure_future(scheduler.acquire())
+            await asyncio.sleep(0)
+
+            reasons = []
+            try:
+                await scheduler.acquire()
+            except SchedulerRejectedError as e:
+                reasons.append(e.reason)
+            try:
+                await waiting
+            except SchedulerRejectedError as e:
+                reasons.append(e.reason)
+            scheduler.release()
+            return reasons
+
+        assert asyncio.run(main()) == ["queue_full", "timeout"]
+        stats = scheduler.get_stats()
+        assert stats["rejected_queue_full"] == 1
+        assert stats["rejected_timeout"] == 1
+        assert stats["queue_depth"] == 0 and stats["inflight"] == 0
+
+        print("✅ 排队拒绝测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 排队拒绝测试失败: {e}")
+        return False
+
+
+def test_token_buckets():
+    """测试RPM和TPM令牌桶：额度用完后等待补充"""
+    print("🧪 测试令牌桶...")
+
+    try:
+        from services.rate_limiter import LLMScheduler, TokenBucket
+
+        bucket = TokenBucket(60)  # 每秒补充1个
+        now = time.monotonic()
+        assert bucket.wait_time(60, now) == 0
+        bucket.take(60)
+        assert 0.9 < bucket.wait_time(1, now) <= 1.0
+        assert TokenBucket(0).wait_time(10 ** 6, now) == 0  # 0为不限制
+
+        # 每分钟6000 token，即每秒100个：第二次调用需等待约0.5秒
+        scheduler = LLMScheduler(max_concurrency=4, rpm=0, tpm=6000, max_queue=10, queue_timeout=5)
+
+        async def main():
+            await scheduler.acquire(6000)
+            scheduler.release()
+            start = time.monotonic()
+            await scheduler.acquire(50)
+            scheduler.release()
+            return time.monotonic() - start
+
+        waited = asyncio.run(main())
+        assert 0.3 < waited < 1.5, waited
+
+        print("✅ 令牌桶测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 令牌桶测试失败: {e}")
+        return False
+
+
+def test_shared_across_loops():
+    """测试服务器事件循环和同步接口的后台循环共用同一个调度器"""
+    print("🧪 测试跨事件循环调度...")
+
+    try:
+        from services.rate_limiter import LLMScheduler
+        from utils.async_bridge import run_sync
+        import threading
+
+        scheduler = LLMScheduler(max_concurrency=1, rpm=0, tpm=0, max_queue=10, queue_timeout=5)
+        order = []
+
+        async def hold():
+            async with scheduler.slot():
+                order.append("loop")
+                await asyncio.sleep(0.1)
+
+        async def main():
+            task = asyncio.ensure_future(hold())
+            await asyncio.sleep(0.02)
+            # 另一个线程通过同步接口排队，需等这里释放后才能执行
+            worker = threading.Thread(target=lambda: run_sync(record()))
+            worker.start()
+            await task
+            await asyncio.get_running_loop().run_in_executor(None, worker.join)
+
+        async def record():
+            async with scheduler.slot():
+                order.append("bridge")
+
+        asyncio.run(main())
+        assert order == ["loop", "bridge"]
+
+        print("✅ 跨事件循环调度测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 跨事件循环调度测试失败: {e}")
+        return False
+
+
+def test_service_uses_scheduler():
+    """测试AIService的上游调用经过调度器"""
+    print("🧪 测试AI服务接入调度器...")
+
+    try:
+        from services.rate_limiter import LLMScheduler
+        from test_cache import make_service
+
+        service, completions = make_service({})
+        service.scheduler = LLMScheduler(max_concurrency=1, rpm=0, tpm=0, max_queue=10, queue_timeout=5)
+
+        service.get_ai_suggestions("主角拔出了剑", "续写")
+        "".join(service.generate_novel_content_stream("写一段开头", 50))
+
+        stats = service.get_scheduler_stats()
+        assert completions.calls == 2
+        assert stats["acquired"] == 2
+        assert stats["inflight"] == 0
+        assert stats["tokens_reserved"] >= 300 + 50
+
+        print("✅ AI服务接入调度器测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ AI服务接入调度器测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始限流测试...\n")
+
+    tests = [
+        test_concurrency_limit,
+        test_queue_full_and_timeout,
+        test_token_buckets,
+        test_shared_across_loops,
+        test_service_uses_scheduler,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# co-novel - 上游调用重试、对冲与熔断测试脚本
+
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+class UpstreamError(Exception):
+    """模拟带HTTP状态码的上游错误"""
+
+    def __init__(self, status_code: int, retry_after: str = None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        headers = {"retry-after": retry_after} if retry_after else {}
+        self.response = SimpleNamespace(status_code=status_code, headers=headers)
+
+
+def fast_policy(**overrides):
+    from services.resilience import RetryPolicy
+    params = dict(max_attempts=3, base_delay=0.01, max_delay=0.05, deadline=2.0)
+    params.update(overrides)
+    return RetryPolicy(**params)
+
+
+def test_classify_errors():
+    """测试错误分类：只重试限流、5xx、超时和连接错误"""
+    print("🧪 测试错误分类...")
+
+    try:
+        from services.resilience import classify_error, retry_after
+        from services.rate_limiter import SchedulerRejectedError
+
+        assert classify_error(UpstreamError(429)) == "rate_limit"
+        assert classify_error(UpstreamError(503)) == "server"
+        assert classify_error(UpstreamError(408)) == "timeout"
+        assert classify_error(asyncio.TimeoutError()) == "timeout"
+        assert classify_error(UpstreamError(400)) is None
+        assert classify_error(UpstreamError(401)) is None
+        assert classify_error(ValueError("bad")) is None
+        assert classify_error(SchedulerRejectedError("timeout", "排队超时")) is None
+        assert retry_after(UpstreamError(429, "1.5")) == 1.5
+
+        print("✅ 错误分类测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 错误分类测试失败: {e}")
+        return False
+
+
+def test_retry_and_deadline():
+    """测试可重试错误被重试，不可重试错误和截止时间直接失败"""
+    print("🧪 测试重试与截止时间...")
+
+    try:
+        from services.resilience import ResilientCaller
+
+        caller = ResilientCaller(fast_policy())
+        attempts = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise UpstreamError(429 if len(attempts) == 1 else 502)
+            return "ok"
+
+        assert asyncio.run(caller.call("outline", flaky)) == "ok"
+        assert len(attempts) == 3
+
+        async def bad_request():
+            attempts.append(1)
+            raise UpstreamError(400)
+
+        attempts.clear()
+        try:
+            asyncio.run(caller.call("outline", bad_request))
+            assert False, "应当抛出异常"
+        except UpstreamError:
+            pass
+        assert len(attempts) == 1
+
+        # 截止时间覆盖所有尝试
+        slow_caller = ResilientCaller(fast_policy(deadline=0.1, max_attempts=5))
+
+        async def hang():
+            await asyncio.sleep(1)
+
+        try:
+            asyncio.run(slow_caller.call("outline", hang))
+            assert False, "应当超时"
+        except asyncio.TimeoutError:
+            pass
+
+        stats = caller.get_stats()
+        assert stats["retries"] == 2
+        assert stats["retries_by_reason"] == {"rate_limit": 1, "server": 1}
+        assert stats["failures"] == 1
+        assert slow_caller.get_stats()["deadline_exceeded"] == 1
+
+        print("✅ 重试与截止时间测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 重试与截止时间测试失败: {e}")
+        return False
+
+
+def test_hedged_request():
+    """测试慢于p95时发出对冲请求，先返回者胜出"""
+    print("🧪 测试对冲请求...")
+
+    try:
+        from services.resilience import ResilientCaller
+
+        caller = ResilientCaller(fast_policy(hedge_types={"title"}, hedge_min_samples=5))
+        for _ in range(10):
+            caller.latency.record("title", 0.02)
+
+        calls = []
+
+        async def sometimes_slow():
+            calls.append(1)
+            # 第一次请求卡住，对冲请求正常返回
+            await asyncio.sleep(1 if len(calls) == 1 else 0.01)
+            return f"结果{len(calls)}"
+
+        result = asyncio.run(caller.call("title", sometimes_slow, hedge=True))
+        assert result == "结果2"
+        assert len(calls) == 2
+        stats = caller.get_stats()
+        assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+
+        # 等待对冲时机期间超过截止时间：首个请求随即被取消，不会继续占用调度许可、之后记录延迟样本
+        strict = ResilientCaller(fast_policy(deadline=0.05, hedge_types={"title"}, hedge_min_samples=5))
+        for _ in range(10):
+            strict.latency.record("title", 0.5)
+        cancelled = []
+
+        async def hanging():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return "太晚了"
+
+        async def run_deadline():
+            try:
+                await strict.call("title", hanging, hedge=True)
+                raise AssertionError("应当超过截止时间")
+            except asyncio.TimeoutError:
+                pass
+            await asyncio.sleep(0.01)
+            return list(cancelled)
+
+        assert asyncio.run(run_deadline()) == [True]
+        assert strict.get_stats()["deadline_exceeded"] == 1
+
+        # 未配置对冲的类型不会发第二个请求
+        calls.clear()
+        for _ in range(10):
+            caller.latency.record("outline", 0.02)
+
+        async def slow():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "ok"
+
+        asyncio.run(caller.call("outline", slow, hedge=True))
+        assert len(calls) == 1
+
+        print("✅ 对冲请求测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 对冲请求测试失败: {e}")
+        return False
+
+
+def test_service_retries():
+    """测试AIService的非流式和流式调用在首个片段前出错时重试"""
+    print("🧪 测试AI服务重试...")
+
+    try:
+        from services.resilience import ResilientCaller, resilient_caller
+        from test_cache import make_service
+
+        # 默认所有AIService共用同一个重试器，统计和延迟样本合并在一起
+        assert make_service({})[0].resilience is make_service({})[0].resilience is resilient_caller
+
+        service, completions = make_service({})
+        service.resilience = ResilientCaller(fast_policy())
+        original_create = completions.create
+        failures = {"left": 1}
+
+        async def flaky_create(**params):
+            completions.calls += 1
+            if failures["left"] > 0:
+                failures["left"] -= 1
+                raise UpstreamError(503)
+            completions.calls -= 1
+            return await original_create(**params)
+
+        completions.create = flaky_create
+        assert service.get_ai_suggestions("主角拔出了剑", "续写") == completions.reply
+        assert completions.calls == 2
+
+        failures["left"] = 1
+        streamed = "".join(service.generate_novel_content_stream("写一段开头", 50))
+        assert streamed == completions.reply
+        assert completions.calls == 4
+
+        # 重试次数用完后仍返回错误提示，调度许可全部归还
+        failures["left"] = 10
+        assert service.get_ai_suggestions("主角拔出了刀", "续写") == "抱歉，AI生成内容时出现错误。"
+        assert service.get_scheduler_stats()["inflight"] == 0
+        assert service.get_resilience_stats()["retries"] == 4
+
+        print("✅ AI服务重试测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ AI服务重试测试失败: {e}")
+        return False
+
+
+def test_circuit_breaker_states():
+    """测试熔断器在错误率、慢调用超过阈值时打开，半开探测成功后关闭"""
+    print("🧪 测试熔断器状态...")
+
+    try:
+        import time
+        from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+        breaker = CircuitBreaker("m", window_size=4, min_calls=4, error_rate=0.5,
+                                 slow_call_seconds=1, slow_call_rate=0.75,
+                                 open_seconds=0.05, half_open_calls=1)
+        for _ in range(2):
+            breaker.on_success(0.1)
+        breaker.on_failure()
+        assert breaker.state == "closed"
+        breaker.on_failure()  # 4次中2次失败，达到50%
+        assert breaker.state == "open"
+        try:
+            breaker.before_call()
+            assert False, "熔断打开时应拒绝调用"
+        except CircuitOpenError:
+            pass
+
+        # 冷却后半开，只放行一个探测请求
+        time.sleep(0.06)
+        breaker.before_call()
+        assert breaker.state == "half_open"
+        try:
+            breaker.before_call()
+            assert False, "探测名额已满时应拒绝调用"
+        except CircuitOpenError:
+            pass
+        breaker.on_success(0.1)
+        assert breaker.state == "closed"
+
+        # 半开探测失败则重新打开
+        for _ in range(4):
+            breaker.on_success(5)  # 慢调用
+        assert breaker.state == "open"
+        time.sleep(0.06)
+        breaker.before_call()
+        breaker.on_failure()
+        assert breaker.state == "open"
+        assert breaker.get_stats()["opened"] == 3
+
+        print("✅ 熔断器状态测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 熔断器状态测试失败: {e}")
+        return False
+
+
+def test_circuit_fast_fallback():
+    """测试熔断打开后AIService不再调用上游，直接返回备用内容"""
+    print("🧪 测试熔断快速降级...")
+
+    try:
+        import uuid
+        from services.circuit_breaker import CircuitBreakerRegistry
+        from services.resilience import ResilientCaller
+        from test_cache import make_service
+
+        service, completions = make_service({})
+        service.resilience = ResilientCaller(fast_policy(max_attempts=1))
+        service.circuit_breakers = CircuitBreakerRegistry(window_size=4, min_calls=4, open_seconds=60)
+
+        async def down(**params):
+            completions.calls += 1
+            raise UpstreamError(503)
+
+        completions.create = down
+        theme = f"熔断-{uuid.uuid4()}"
+        for _ in range(4):
+            service.generate_novel_outline("玄幻", theme, "《测试》")
+        assert completions.calls == 4
+
+        # 熔断打开：大纲直接返回备用大纲，流式接口也不再请求上游
+        outline = service.generate_novel_outline("玄幻", theme, "《测试》")
+        assert "第一章" in outline
+        streamed = "".join(service.generate_novel_outline_stream("玄幻", theme, "《测试》"))
+        assert "第一章" in streamed
+        assert completions.calls == 4
+
+        stats = service.get_circuit_stats()[f"stub0/{service.model}"]
+        assert stats["state"] == "open"
+        assert stats["rejected"] == 2
+
+        # 参数错误等客户端错误不计入熔断
+        healthy = CircuitBreakerRegistry(window_size=4, min_calls=4)
+        service.circuit_breakers = healthy
+
+        async def bad_request(**params):
+            raise UpstreamError(400)
+
+        completions.create = bad_request
+        for _ in range(4):
+            service.get_ai_suggestions(theme, "续写")
+        assert healthy.get(f"stub0/{service.model}").state == "closed"
+
+        print("✅ 熔断快速降级测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 熔断快速降级测试失败: {e}")
+        return False
+
+
+def test_fallback_stream():
+    """测试备用内容按短句流式返回，大量并发的降级请求在同一个事件循环里完成，不占用线程"""
+    print("🧪 测试降级流式输出...")
+
+    try:
+        import threading
+        import time
+        from services.provider_pool import ProviderPool
+        from utils.tokenizer import split_chunks
+        from test_cache import make_service
+
+        text = "夜色渐深，山门外落满了枯叶。“师兄，你真的要进去吗？”他说：Hello world！\n" + "长" * 45
+        chunks = split_chunks(text)
+        assert "".join(chunks) == text
+        assert chunks[:4] == ["夜色渐深，", "山门外落满了枯叶。", "“师兄，", "你真的要进去吗？”"]
+        assert "Hello world！" in chunks[-4] and max(len(c) for c in chunks) <= 20
+
+        service, completions = make_service({})
+        service.providers = ProviderPool([])
+        service.fallback_stream_interval = 0.02
+        fallback = service._build_fallback_outline("玄幻", "降级")
+
+        async def collect():
+            return "".join([chunk async for chunk in service.generate_novel_outline_stream_async("玄幻", "降级", "《测试》")])
+
+        async def concurrent(n):
+            threads = threading.active_count()
+            started = time.monotonic()
+            results = await asyncio.gather(*(collect() for _ in range(n)))
+            return results, time.monotonic() - started, threading.active_count() - threads
+
+        results, elapsed, extra_threads = asyncio.run(concurrent(200))
+        count = len(split_chunks(fallback))
+        assert all(r == fallback for r in results)
+        # 200个请求并发等待，总耗时约等于单个请求的 (片段数-1) * 间隔
+        assert elapsed < (count - 1) * 0.02 + 1.0 and extra_threads == 0
+        assert completions.calls == 0
+        print(f"备用大纲{len(fallback)}字分为{count}个片段，200个并发降级请求用时 {elapsed:.2f}s")
+
+        print("✅ 降级流式输出测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 降级流式输出测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始重试、对冲与熔断测试...\n")
+
+    tests = [
+        test_classify_errors,
+        test_retry_and_deadline,
+        test_hedged_request,
+        test_service_retries,
+        test_circuit_breaker_states,
+        test_circuit_fast_fallback,
+        test_fallback_stream,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# co-novel - 可续传流式生成测试脚本
+
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+STREAM_PATH = "/api/ai/generate-content-stream"
+
+
+def stream_content(events) -> str:
+    return "".join(data["choices"][0]["delta"].get("content") or ""
+                   for _, data in events if data.get("choices"))
+
+
+def setup(**config):
+    """内容流使用慢速假模型：100个token约0.5秒输出完"""
+    from routers import ai as ai_router
+    from test_disconnect import use_fake_llm
+    from utils.sse import stream_registry
+
+    config = {"ttft": 0.02, "tokens_per_second": 200, "chunk_tokens": 2, **config}
+    llm, _ = use_fake_llm(ai_router.ai_service, **config)
+    return llm, stream_registry
+
+
+def test_resume_with_last_event_id():
+    """测试断线后带Last-Event-ID重新请求，从断点续传且不再调用上游"""
+    print("🧪 测试Last-Event-ID续传...")
+
+    try:
+        from main import app
+        from test_fake_llm import asgi_request, parse_sse
+
+        llm, registry = setup()
+        registry.resume_grace = 5
+        body = {"prompt": "续传测试", "max_tokens": 100}
+
+        async def run():
+            _, first = await asgi_request(app, "POST", STREAM_PATH, body, disconnect_after=5)
+            first_events = parse_sse(first)
+            await asyncio.sleep(0.1)  # 断线期间生成继续进行
+            _, rest = await asgi_request(app, "POST", STREAM_PATH, body,
+                                         headers={"Last-Event-ID": first_events[-1][0]})
+            return first_events, parse_sse(rest)
+
+        first_events, rest_events = asyncio.run(run())
+        ids = [event_id for event_id, _ in first_events + rest_events]
+        seqs = [int(event_id.rsplit("-", 1)[1]) for event_id in ids]
+        assert seqs == list(range(len(seqs))), seqs
+        assert len(stream_content(first_events + rest_events)) == 100
+        assert rest_events[-1][1]["usage"]["completion_tokens"] == 100
+        assert llm.get_stats()["stream_calls"] == 1
+        assert registry.get_stats()["resumed"] >= 1
+        print(f"断线前收到{len(first_events)}个事件，续传{len(rest_events)}个，上游只调用1次")
+
+        print("✅ Last-Event-ID续传测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ Last-Event-ID续传测试失败: {e}")
+        return False
+
+
+def test_resume_endpoint():
+    """测试GET /streams/{id}续传、未知生成返回404、DELETE停止生成"""
+    print("🧪 测试续传和停止接口...")
+
+    try:
+        from main import app
+        from test_fake_llm import asgi_request, parse_sse
+
+        llm, registry = setup()
+        registry.resume_grace = 5
+        body = {"prompt": "续传接口测试", "max_tokens": 100}
+
+        def last_event(events):
+            generation_id, _, seq = events[-1][0].rpartition("-")
+            return generation_id, int(seq)
+
+        async def run():
+            _, first = await asgi_request(app, "POST", STREAM_PATH, body, disconnect_after=3)
+            generation_id, seq = last_event(parse_sse(first))
+            _, rest = await asgi_request(app, "GET", f"/api/ai/streams/{generation_id}?after={seq}")
+            # 不带Last-Event-ID和after时从头读取
+            whole_status, whole = await asgi_request(app, "GET", f"/api/ai/streams/{generation_id}")
+            missing, _ = await asgi_request(app, "GET", "/api/ai/streams/unknown")
+            foreign, _ = await asgi_request(app, "GET", f"/api/ai/streams/{generation_id}",
+                                            headers={"Last-Event-ID": "unknown-3"})
+
+            _, second = await asgi_request(app, "POST", STREAM_PATH, {"prompt": "停止测试", "max_tokens": 100},
+                                           disconnect_after=2)
+            second_id, _ = last_event(parse_sse(second))
+            _, cancelled = await asgi_request(app, "DELETE", f"/api/ai/streams/{second_id}")
+            await asyncio.sleep(0.05)
+            return (parse_sse(first) + parse_sse(rest), (whole_status, parse_sse(whole)), (missing, foreign),
+                    cancelled, registry.get(second_id))
+
+        events, (whole_status, whole), (missing, foreign), cancelled, stopped = asyncio.run(run())
+        assert len(stream_content(events)) == 100
+        assert whole_status == 200 and whole == events
+        assert missing == 404 and foreign == 404
+        assert cancelled == b'{"cancelled":true}' and stopped.done
+        # 第二次生成被停止，只输出了开头部分
+        assert llm.get_stats()["completion_tokens"] < 140
+
+        print("✅ 续传和停止接口测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 续传和停止接口测试失败: {e}")
+        return False
+
+
+def test_resume_gap():
+    """测试断点之后的事件已被挤出缓冲时，续传接口返回410，重新请求则重新生成"""
+    print("🧪 测试缓冲不足时的续传...")
+
+    try:
+        from main import app
+        from test_fake_llm import asgi_request, parse_sse
+
+        llm, registry = setup(tokens_per_second=2000)
+        registry.resume_grace, registry.max_events = 5, 10
+        body = {"prompt": "缓冲测试", "max_tokens": 100}
+
+        async def run():
+            _, first = await asgi_request(app, "POST", STREAM_PATH, body, disconnect_after=2)
+            last_id = parse_sse(first)[-1][0]
+            await asyncio.sleep(0.2)  # 生成结束，开头的事件已被挤出缓冲
+            status, _ = await asgi_request(app, "GET", f"/api/ai/streams/{last_id.rsplit('-', 1)[0]}",
+                                           headers={"Last-Event-ID": last_id})
+            _, again = await asgi_request(app, "POST", STREAM_PATH, body, headers={"Last-Event-ID": last_id})
+            return status, parse_sse(again)
+
+        try:
+            status, events = asyncio.run(run())
+        finally:
+            registry.max_events = 2000
+        assert status == 410
+        assert len(stream_content(events)) == 100 and llm.get_stats()["stream_calls"] == 2
+        assert registry.get_stats()["gaps"] >= 2
+
+        print("✅ 缓冲不足时的续传测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 缓冲不足时的续传测试失败: {e}")
+        return False
+
+
+def test_buffer_overflow_while_reading():
+    """测试订阅者读取期间缓冲区写满并挤掉左端时，仍按序号连续读取，读不到时报告缺口"""
+    print("🧪 测试读取期间缓冲区溢出...")
+
+    try:
+        from utils.sse import GenerationBuffer
+
+        async def run():
+            buffer = GenerationBuffer("g", max_events=5)
+            for i in range(5):
+                buffer.append(f"data: {i}\n\n")
+            events = buffer.subscribe(after=1)
+            received = [await events.__anext__()]
+            # 读取者挂起期间追加事件，缓冲左端被挤掉，但序号3、4仍在缓冲中
+            buffer.append("data: 5\n\n")
+            received.append(await events.__anext__())
+            buffer.append("data: 6\n\n")
+            buffer.finish()
+            received += [event async for event in events]
+
+            # 挂起期间未读的事件被挤出缓冲时，报告缺口而不是跳过
+            slow = GenerationBuffer("s", max_events=3)
+            for i in range(3):
+                slow.append(f"data: {i}\n\n")
+            slow_events = slow.subscribe()
+            first = await slow_events.__anext__()
+            for i in range(3, 6):
+                slow.append(f"data: {i}\n\n")
+            slow.finish()
+            return received, [first] + [event async for event in slow_events]
+
+        received, slow = asyncio.run(run())
+        assert [event.split("\n")[0] for event in received] == [f"id: g-{i}" for i in range(2, 7)], received
+        assert slow[0].startswith("id: s-0") and "resume_gap" in slow[1] and len(slow) == 2, slow
+
+        print("✅ 读取期间缓冲区溢出测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 读取期间缓冲区溢出测试失败: {e}")
+        return False
+
+
+def test_grace_expiry():
+    """测试宽限期内没有重连时取消生成并关闭上游"""
+    print("🧪 测试续传宽限期...")
+
+    try:
+        from main import app
+        from test_fake_llm import asgi_request
+
+        llm, registry = setup()
+        registry.resume_grace = 0.1
+        abandoned = registry.get_stats()["abandoned"]
+
+        async def run():
+            await asgi_request(app, "POST", STREAM_PATH, {"prompt": "宽限期测试", "max_tokens": 100},
+                               disconnect_after=3)
+            await asyncio.sleep(0.3)
+
+        asyncio.run(run())
+        generated = llm.get_stats()["completion_tokens"]
+        # 断开时约输出6个token，宽限期0.1秒内再输出约20个，之后停止
+        assert generated < 60, generated
+        assert registry.get_stats()["abandoned"] == abandoned + 1
+        print(f"宽限期后取消，上游共生成{generated}/100个token")
+
+        print("✅ 续传宽限期测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 续传宽限期测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始可续传流式生成测试...\n")
+
+    tests = [
+        test_resume_with_last_event_id,
+        test_resume_endpoint,
+        test_resume_gap,
+        test_buffer_overflow_while_reading,
+        test_grace_expiry,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# co-novel - SSE片段合并测试脚本
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+async def scripted(steps, closed: list):
+    """按(等待秒数, 片段)依次产出片段，结束或被关闭时记录到closed"""
+    try:
+        for delay, chunk in steps:
+            await asyncio.sleep(delay)
+            yield chunk
+    finally:
+        closed.append(True)
+
+
+async def collect(source, config):
+    """返回[(距开始的秒数, 合并后的片段)]"""
+    from utils.sse import coalesce
+
+    started = time.monotonic()
+    return [(time.monotonic() - started, chunk) async for chunk in coalesce(source, config)]
+
+
+def test_coalesce():
+    """测试首个片段立即发送、按字数和时间窗口合并、上游停顿时按时发出"""
+    print("🧪 测试片段合并...")
+
+    try:
+        from utils.sse import CoalesceConfig, coalesce
+
+        config = CoalesceConfig(max_chars=8, window=0.04)
+        # 首字后每5ms两个字，10个字后停顿0.2秒再来两个字
+        steps = [(0.01, "首")] + [(0.005, "bb")] * 5 + [(0.2, "cc")]
+        closed = []
+        frames = asyncio.run(collect(scripted(steps, closed), config))
+        chunks = [chunk for _, chunk in frames]
+        assert "".join(chunks) == "首" + "bb" * 5 + "cc"
+        assert chunks == ["首", "bbbbbbbb", "bb", "cc"], chunks
+        # 停顿前剩下的两个字在窗口到期时发出，不等停顿结束
+        assert 0.06 <= frames[2][0] < 0.15, frames[2][0]
+        assert closed == [True]
+
+        # 关闭合并参数时原样转发
+        frames = asyncio.run(collect(scripted(steps, []), CoalesceConfig(window=0)))
+        assert len(frames) == len(steps)
+
+        # 提前关闭时取消正在读取的片段，上游生成器随之关闭
+        async def close_early():
+            closed = []
+            chunks = coalesce(scripted([(0, "首"), (5, "慢")], closed), config)
+            assert await chunks.__anext__() == "首"
+            reading = asyncio.ensure_future(chunks.__anext__())
+            await asyncio.sleep(0.01)
+            reading.cancel()
+            await asyncio.gather(reading, return_exceptions=True)
+            await chunks.aclose()
+            return closed
+
+        assert asyncio.run(asyncio.wait_for(close_early(), 1)) == [True]
+
+        print("✅ 片段合并测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 片段合并测试失败: {e}")
+        return False
+
+
+def test_route_settings():
+    """测试按内容类型覆盖合并参数"""
+    print("🧪 测试按接口配置合并参数...")
+
+    try:
+        import os
+        from utils.sse import CoalesceSettings
+
+        os.environ["SSE_COALESCE_WINDOW"] = "0.03"
+        os.environ["SSE_COALESCE_ROUTES"] = '{"outline": {"window": 0}, "chapter": {"max_chars": 64}}'
+        try:
+            settings = CoalesceSettings()
+        finally:
+            os.environ.pop("SSE_COALESCE_WINDOW")
+            os.environ.pop("SSE_COALESCE_ROUTES")
+        assert settings.for_route("content").window == 0.03 and settings.for_route("content").max_chars == 32
+        assert not settings.for_route("outline").enabled
+        assert settings.for_route("chapter").max_chars == 64 and settings.for_route("chapter").window == 0.03
+
+        print("✅ 按接口配置合并参数测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 按接口配置合并参数测试失败: {e}")
+        return False
+
+
+def test_stream_overhead():
+    """用假模型对比合并前后每个内容字的字节数和每秒事件数"""
+    print("🧪 测试合并后的传输开销...")
+
+    try:
+        from main import app
+        from routers import ai as ai_router
+        from test_disconnect import use_fake_llm
+        from test_fake_llm import asgi_request, parse_sse
+        from utils.sse import CoalesceConfig, coalesce_settings
+
+        # 每个片段2个字、每秒1000个token：每2ms一个上游片段
+        use_fake_llm(ai_router.ai_service, ttft=0.02, tokens_per_second=1000, chunk_tokens=2)
+
+        def measure(config):
+            coalesce_settings.default = config
+            arrivals = []
+            _, body = asyncio.run(asgi_request(
+                app, "POST", "/api/ai/generate-content-stream", {"prompt": "合并开销测试", "max_tokens": 400},
+                on_chunk=lambda t, data: arrivals.append(t)))
+            events = [data for _, data in parse_sse(body)]
+            content = "".join(e["choices"][0]["delta"].get("content") or "" for e in events if e.get("choices"))
+            return {
+                "events": len(events),
+                "bytes_per_char": len(body) / len(content),
+                "events_per_second": len(events) / (arrivals[-1] - arrivals[0]),
+                "first_content": arrivals[1],
+                "content": content,
+            }
+
+        before = measure(CoalesceConfig(window=0))
+        after = measure(CoalesceConfig(max_chars=32, window=0.04))
+        assert after["content"] == before["content"] and len(after["content"]) == 400
+        assert before["events"] >= 4 * after["events"], (before["events"], after["events"])
+        assert before["bytes_per_char"] >= 4 * after["bytes_per_char"]
+        # 首个片段不等待合并
+        assert after["first_content"] < before["first_content"] + 0.02
+        for name, stats in (("逐片段", before), ("合并后", after)):
+            print(f"{name}: {stats['events']}个事件，每字{stats['bytes_per_char']:.0f}字节，"
+                  f"每秒{stats['events_per_second']:.0f}个事件，首个内容{stats['first_content'] * 1000:.0f}ms")
+
+        print("✅ 合并后的传输开销测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 合并后的传输开销测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始SSE片段合并测试...\n")
+
+    tests = [
+        test_coalesce,
+        test_route_settings,
+        test_stream_overhead,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# co-novel - 滚动前情提要测试脚本
+
+import re
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+MERGED = "早期剧情：主角下山历练，结识同伴，击败了第一个强敌。"
+
+
+def make_summary_service():
+    """创建使用独立数据目录的业务服务，假模型按提示词返回章节摘要、合并后的前情提要或正文"""
+    import tempfile
+    from services import novel_service as novel_module, summary_service
+    from services.data_service import DataManager
+    from test_cache import make_service
+
+    data = DataManager(tempfile.mkdtemp(prefix="co-novel-summary-"))
+    novel_module.data_manager = summary_service.data_manager = data
+    ai, completions = make_service({})
+    completions.prompts = []
+
+    async def create(**params):
+        completions.calls += 1
+        prompt = params["messages"][-1]["content"]
+        completions.prompts.append(prompt)
+        if "合并为一份新的前情提要" in prompt:
+            reply = MERGED
+        elif prompt.startswith("请用不超过150字概括"):
+            reply = f"第{re.search(r'第(\d+)章', prompt).group(1)}章的摘要。"
+        else:
+            reply = "章节正文"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))])
+
+    completions.create = create
+    service = novel_module.NovelBusinessService()
+    service.ai_service = service.summarizer.ai_service = ai
+    service.summarizer.recent_chapters = 3
+    novel = data.create_novel(novel_module.NovelGenre.FANTASY, "前情提要测试")
+    novel.title = "《前情提要测试》"
+    data.update_novel(novel)
+    return service, completions, data, novel.id
+
+
+def wait_for_summaries(service):
+    """等待后台摘要任务全部完成"""
+    service.summarizer._get_executor().submit(lambda: None).result(timeout=10)
+
+
+def test_rolling_summary():
+    """测试保存章节后生成摘要，超出最近N章的摘要合并进前情提要"""
+    print("🧪 测试滚动前情提要...")
+
+    try:
+        service, completions, data, novel_id = make_summary_service()
+        for n in range(1, 6):
+            assert service.save_chapter(novel_id, n, f"第{n}章的正文内容" * 20).success
+        wait_for_summaries(service)
+
+        chapters = data.get_chapters_by_novel(novel_id)
+        assert [ch.summary for ch in chapters] == [f"第{n}章的摘要。" for n in range(1, 6)]
+        novel = data.get_novel(novel_id)
+        assert novel.story_summary == MERGED and novel.summary_through == 2
+        # 合并期间保存的章节统计不会被覆盖
+        assert novel.chapter_count == 5
+
+        context = service.summarizer.context_for(novel, 6)
+        assert context.startswith(MERGED)
+        assert "第3章的摘要" in context and "第5章的摘要" in context
+        assert "第1章的摘要" not in context
+
+        # 重新生成已合并的早期章节时，不使用包含后续剧情的前情提要
+        assert service.summarizer.context_for(novel, 2) == "第1章：第1章的摘要。"
+
+        stats = service.summarizer.get_stats()
+        assert stats["chapter_summaries"] == 5 and stats["pending"] == 0
+
+        print("✅ 滚动前情提要测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 滚动前情提要测试失败: {e}")
+        return False
+
+
+def test_chapter_prompt_uses_summary():
+    """测试章节提示词带上前情提要，且长度不随章节数增长"""
+    print("🧪 测试章节提示词中的前情提要...")
+
+    try:
+        from models.novel import ChapterGenerationRequest
+
+        service, completions, data, novel_id = make_summary_service()
+        for n in range(1, 6):
+            service.save_chapter(novel_id, n, f"第{n}章的正文内容" * 20)
+        wait_for_summaries(service)
+
+        # 未提供novel_id时按标题找到小说
+        request = ChapterGenerationRequest(title="《前情提要测试》", outline="第六章：决战\n主角迎战强敌", chapter_number=6)
+        assert service.generate_chapter(request).success
+        prompt = completions.prompts[-1]
+        assert "前情提要：" in prompt and MERGED in prompt and "第5章：第5章的摘要。" in prompt
+        assert "第5章的正文内容" not in prompt
+
+        early = len(service.summarizer.context_for(data.get_novel(novel_id), 6))
+        for n in range(6, 16):
+            service.save_chapter(novel_id, n, f"第{n}章的正文内容" * 20)
+        wait_for_summaries(service)
+        late = len(service.summarizer.context_for(data.get_novel(novel_id), 16))
+        assert late <= early + 6  # 只有章节号位数带来的差异
+        assert data.get_novel(novel_id).summary_through == 12
+
+        print("✅ 章节提示词中的前情提要测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 章节提示词中的前情提要测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始前情提要测试...\n")
+
+    tests = [
+        test_rolling_summary,
+        test_chapter_prompt_uses_summary,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
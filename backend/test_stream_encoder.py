@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# co-novel - 流式事件编码测试与微基准脚本
+
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+MODEL = "deepseek-ai/DeepSeek-R1"
+
+
+def dict_event(completion_id: str, created: int, content, prompt_tokens: int, completion_tokens: int,
+               finish_reason=None, usage_details: bool = True) -> str:
+    """原来的编码方式：每个片段构造完整的嵌套字典再json.dumps，作为对照"""
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+    if usage_details:
+        usage["completion_tokens_details"] = {"reasoning_tokens": 0}
+    data = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": MODEL,
+        "choices": [{
+            "index": 0,
+            "delta": {"content": content, "reasoning_content": "", "role": "assistant"},
+            "finish_reason": finish_reason
+        }],
+        "system_fingerprint": "",
+        "usage": usage
+    }
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def test_envelope_output():
+    """测试预序列化信封的输出与整体json.dumps逐字节一致"""
+    print("🧪 测试事件编码输出...")
+
+    try:
+        from utils.sse import ChunkEnvelope
+
+        envelope = ChunkEnvelope("abc123", MODEL, created=1700000000)
+        contents = ["夜色渐深", '他说：“走吧。”\n', 'quote " back\\slash', "tab\t\x00ctl", "😀 emoji", "", None]
+        for content in contents:
+            assert envelope.encode(content, 12, 34) == dict_event("abc123", 1700000000, content, 12, 34)
+        assert envelope.encode("", 5, 6, finish_reason="stop") == \
+            dict_event("abc123", 1700000000, "", 5, 6, finish_reason="stop")
+        assert envelope.encode(None, 0, 0, usage_details=False) == \
+            dict_event("abc123", 1700000000, None, 0, 0, usage_details=False)
+
+        print("✅ 事件编码输出测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 事件编码输出测试失败: {e}")
+        return False
+
+
+def test_encoder_benchmark():
+    """微基准：5000个片段，整体json.dumps与预序列化信封的编码耗时"""
+    print("🧪 测试事件编码微基准...")
+
+    try:
+        from utils.sse import ChunkEnvelope
+
+        chunks = ["夜色"] * 5000
+
+        def run_dict():
+            return [dict_event("abc123", 1700000000, chunk, 100, i) for i, chunk in enumerate(chunks)]
+
+        def run_envelope():
+            envelope = ChunkEnvelope("abc123", MODEL, created=1700000000)
+            return [envelope.encode(chunk, 100, i) for i, chunk in enumerate(chunks)]
+
+        def best_of(fn, rounds: int = 5) -> float:
+            timings = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - started)
+            return min(timings)
+
+        assert run_dict() == run_envelope()
+        dict_time, envelope_time = best_of(run_dict), best_of(run_envelope)
+        print(f"5000个片段：整体json.dumps {dict_time * 1000:.1f}ms，预序列化信封 {envelope_time * 1000:.1f}ms"
+              f"（{dict_time / envelope_time:.1f}倍）")
+        assert envelope_time * 1.5 < dict_time
+
+        print("✅ 事件编码微基准测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 事件编码微基准测试失败: {e}")
+        return False
+
+
+def test_stream_generator_scaling():
+    """测试流式生成器每个片段的耗时不随已输出的片段数增长（5000和20000个片段）"""
+    print("🧪 测试流式生成器的线性开销...")
+
+    try:
+        from routers.ai import create_stream_generator
+        from utils.sse import CoalesceConfig, coalesce_settings
+
+        # 逐片段编码，测量编码器本身的开销
+        coalesce_settings.routes["benchmark"] = CoalesceConfig(window=0)
+
+        async def source(count: int):
+            for _ in range(count):
+                yield "夜色"
+
+        async def drain(count: int):
+            events = 0
+            started = time.perf_counter()
+            async for _ in create_stream_generator(source(count), "benchmark")():
+                events += 1
+            return events, time.perf_counter() - started
+
+        per_chunk = {}
+        for count in (5000, 20000):
+            events, elapsed = asyncio.run(drain(count))
+            assert events == count + 2
+            per_chunk[count] = elapsed / count
+            print(f"{count}个片段：{elapsed * 1000:.0f}ms，每个片段{per_chunk[count] * 1e6:.1f}µs")
+        # 片段数增加到4倍，每个片段的耗时基本不变（平方级时会变为约4倍）
+        assert per_chunk[20000] < per_chunk[5000] * 2
+
+        print("✅ 流式生成器的线性开销测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 流式生成器的线性开销测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始流式事件编码测试...\n")
+
+    tests = [
+        test_envelope_output,
+        test_encoder_benchmark,
+        test_stream_generator_scaling,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# co-novel - AI建议的缓存、请求合并与流式接口测试脚本
+
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+CONTENT = "夜色渐深，城门外传来马蹄声。" * 50
+
+
+def enable_suggestion_cache():
+    """假模型服务默认不缓存，这里只为建议开启缓存"""
+    from services import ai_service, cache_service
+
+    ai_service.cache_manager = cache_service.AICacheManager(
+        {"suggestion": cache_service.CachePolicy(ttl=600, max_entries=300)})
+
+
+def test_single_flight():
+    """测试进行中的相同请求共用一次调用、窗口内复用结果、出错的结果不复用"""
+    print("🧪 测试相同请求合并...")
+
+    try:
+        from utils.singleflight import SingleFlight
+
+        calls = []
+
+        async def fetch(value, delay=0.05, fail=False):
+            calls.append(value)
+            await asyncio.sleep(delay)
+            if fail:
+                raise RuntimeError("上游出错")
+            return value
+
+        async def run():
+            flight = SingleFlight(window=0.1)
+            results = await asyncio.gather(*[flight.do("a", lambda: fetch("a")) for _ in range(5)])
+            reused = await flight.do("a", lambda: fetch("a"))
+            other = await flight.do("b", lambda: fetch("b"))
+            await asyncio.sleep(0.15)
+            expired = await flight.do("a", lambda: fetch("a"))
+
+            failures = await asyncio.gather(*[flight.do("c", lambda: fetch("c", fail=True)) for _ in range(3)],
+                                            return_exceptions=True)
+            retried = await flight.do("c", lambda: fetch("c"))
+
+            # 某个等待者被取消时，其他等待者照常拿到结果
+            waiters = [asyncio.ensure_future(flight.do("d", lambda: fetch("d"))) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            waiters[0].cancel()
+            survivor = await waiters[1]
+            return results, reused, other, expired, failures, retried, survivor, flight.get_stats()
+
+        results, reused, other, expired, failures, retried, survivor, stats = asyncio.run(run())
+        assert results == ["a"] * 5 and reused == "a" and other == "b" and expired == "a"
+        assert all(isinstance(e, RuntimeError) for e in failures) and retried == "c" and survivor == "d"
+        assert calls == ["a", "b", "a", "c", "c", "d"], calls
+        assert stats["calls"] == 6 and stats["shared"] == 8
+
+        print("✅ 相同请求合并测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 相同请求合并测试失败: {e}")
+        return False
+
+
+def test_suggestion_dedupe_and_cache():
+    """测试并发的相同建议请求只调用一次上游，缓存按内容哈希存储"""
+    print("🧪 测试建议的请求合并和缓存...")
+
+    try:
+        from test_fake_llm import make_fake_service
+
+        service, llm = make_fake_service(ttft=0.05, tokens_per_second=0, chunk_tokens=20)
+        service.suggestion_flight.window = 2
+        enable_suggestion_cache()
+
+        async def burst():
+            return await asyncio.gather(*[service.get_ai_suggestions_async(CONTENT, "续写") for _ in range(8)])
+
+        results = asyncio.run(burst())
+        assert len(set(results)) == 1 and results[0]
+        assert llm.get_stats()["calls"] == 1
+        assert service.get_suggestion_stats()["shared"] == 7
+
+        # 合并窗口过后由缓存命中，仍不调用上游；不同的建议类型各自生成
+        service.suggestion_flight.window = 0
+        assert asyncio.run(service.get_ai_suggestions_async(CONTENT, "续写")) == results[0]
+        asyncio.run(service.get_ai_suggestions_async(CONTENT, "修改"))
+        assert llm.get_stats()["calls"] == 2
+
+        # 缓存参数只保存内容哈希，不保存整段内容
+        params = service._suggestion_cache_params(CONTENT, "续写")
+        assert params["suggestion_type"] == "续写" and len(params["content_hash"]) == 64
+        assert CONTENT not in json.dumps(params, ensure_ascii=False)
+
+        print("✅ 建议的请求合并和缓存测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 建议的请求合并和缓存测试失败: {e}")
+        return False
+
+
+def test_suggestion_stream_shared():
+    """测试并发的相同流式建议共享一次流式生成，后到的请求也收到完整内容"""
+    print("🧪 测试流式建议共享生成...")
+
+    try:
+        from test_fake_llm import make_fake_service
+
+        service, llm = make_fake_service(ttft=0.02, tokens_per_second=1000, chunk_tokens=4)
+        service.suggestion_flight.window = 2
+        enable_suggestion_cache()
+
+        async def consume(delay):
+            await asyncio.sleep(delay)
+            return "".join([chunk async for chunk in service.get_ai_suggestions_stream_async(CONTENT, "扩展")])
+
+        async def run():
+            return await asyncio.gather(consume(0), consume(0.05), consume(0.1))
+
+        results = asyncio.run(run())
+        assert len(set(results)) == 1 and results[0]
+        assert llm.get_stats()["stream_calls"] == 1
+
+        # 流式生成结束后写入缓存，非流式请求直接命中
+        service.suggestion_flight.window = 0
+        assert asyncio.run(service.get_ai_suggestions_async(CONTENT, "扩展")) == results[0]
+        assert llm.get_stats()["calls"] == 1
+
+        # 所有请求都断开时关闭上游
+        async def abandon():
+            chunks = service.get_ai_suggestions_stream_async(CONTENT + "断开", "扩展")
+            await chunks.__anext__()
+            await chunks.aclose()
+            await asyncio.sleep(0.05)
+
+        llm.config.tokens_per_second = 20
+        started = time.monotonic()
+        asyncio.run(asyncio.wait_for(abandon(), 2))
+        assert time.monotonic() - started < 1
+        assert llm.get_stats()["stream_calls"] == 2
+
+        print("✅ 流式建议共享生成测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 流式建议共享生成测试失败: {e}")
+        return False
+
+
+def test_failure_not_reused():
+    """测试上游失败时合并的请求都收到错误提示，合并窗口内的重试重新调用上游"""
+    print("🧪 测试失败的建议不复用...")
+
+    try:
+        from services.ai_service import ERROR_MESSAGE, STREAM_ERROR_MESSAGE
+        from services.resilience import ResilientCaller, RetryPolicy
+        from test_fake_llm import make_fake_service
+
+        service, llm = make_fake_service(ttft=0.02, tokens_per_second=0, chunk_tokens=20, error_rate=1.0)
+        service.resilience = ResilientCaller(RetryPolicy(max_attempts=1))
+        service.suggestion_flight.window = 5
+        enable_suggestion_cache()
+
+        def plain_calls():
+            stats = llm.get_stats()
+            return stats["calls"] - stats["stream_calls"]
+
+        async def stream(content):
+            return "".join([chunk async for chunk in service.get_ai_suggestions_stream_async(content, "续写")])
+
+        # 失败和重试在同一个事件循环中、合并窗口内进行
+        async def run():
+            llm.config.error_rate = 1.0
+            failed = await asyncio.gather(*[service.get_ai_suggestions_async(CONTENT + "失败", "续写")
+                                            for _ in range(3)])
+            failed_calls = plain_calls()
+            # 上游恢复后，窗口内的相同请求重新生成，而不是拿到刚才的错误提示
+            llm.config.error_rate = 0.0
+            retried = await service.get_ai_suggestions_async(CONTENT + "失败", "续写")
+
+            # 流式建议与非流式共用缓存，换一段内容
+            llm.config.error_rate = 1.0
+            failed_stream = await stream(CONTENT + "流式失败")
+            llm.config.error_rate = 0.0
+            retried_stream = await stream(CONTENT + "流式失败")
+            return failed, failed_calls, retried, failed_stream, retried_stream
+
+        failed, failed_calls, retried, failed_stream, retried_stream = asyncio.run(run())
+        assert failed == [ERROR_MESSAGE] * 3 and failed_calls == 1
+        assert retried != ERROR_MESSAGE and plain_calls() == 2
+        assert failed_stream == STREAM_ERROR_MESSAGE
+        assert retried_stream not in (STREAM_ERROR_MESSAGE, "") and llm.get_stats()["stream_calls"] == 2
+
+        print("✅ 失败的建议不复用测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 失败的建议不复用测试失败: {e}")
+        return False
+
+
+def test_suggestions_stream_endpoint():
+    """测试/suggestions-stream接口：内容与非流式接口一致，并发请求只调用一次上游"""
+    print("🧪 测试流式建议接口...")
+
+    try:
+        from main import app
+        from routers import ai as ai_router
+        from test_disconnect import use_fake_llm
+        from test_fake_llm import asgi_request, parse_sse
+
+        llm, _ = use_fake_llm(ai_router.ai_service, ttft=0.02, tokens_per_second=1000, chunk_tokens=4)
+        ai_router.ai_service.suggestion_flight.window = 2
+        enable_suggestion_cache()
+        body = {"current_content": CONTENT + "接口", "suggestion_type": "续写"}
+
+        async def run():
+            streams = await asyncio.gather(*[
+                asgi_request(app, "POST", "/api/ai/suggestions-stream", body) for _ in range(3)])
+            plain = await asgi_request(app, "POST", "/api/ai/suggestions", body)
+            stats = await asgi_request(app, "GET", "/api/ai/suggestion-stats")
+            return streams, plain, stats
+
+        streams, (status, plain), (_, stats) = asyncio.run(run())
+        contents = []
+        for stream_status, stream_body in streams:
+            assert stream_status == 200
+            events = [data for _, data in parse_sse(stream_body)]
+            contents.append("".join(e["choices"][0]["delta"].get("content") or ""
+                                    for e in events if e.get("choices")))
+        assert status == 200 and len(set(contents)) == 1
+        assert json.loads(plain)["suggestions"] == contents[0]
+        assert llm.get_stats()["stream_calls"] == 1 and llm.get_stats()["calls"] == 1
+        assert json.loads(stats)["shared"] >= 2
+
+        print("✅ 流式建议接口测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 流式建议接口测试失败: {e}")
+        return False
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始AI建议测试...\n")
+
+    tests = [
+        test_single_flight,
+        test_suggestion_dedupe_and_cache,
+        test_suggestion_stream_shared,
+        test_failure_not_reused,
+        test_suggestions_stream_endpoint,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -35,5 +35,45 @@ def test_title_generation():
     except Exception as e:
         print(f"❌ 标题生成失败: {e}")
 
+def test_batch_titles():
+    print("\n测试批量标题生成功能...")
+    
+    from test_cache import make_service
+    
+    service, completions = make_service({})
+    
+    try:
+        # 模型一次返回多个标题，其中有重复
+        completions.reply = '["剑道独尊", "《剑道独尊》", "星河长歌", "九天神帝"]'
+        titles = service.generate_multiple_titles('玄幻', '以最弱战最强', 5)
+        print(f"生成的标题: {titles}")
+        
+        if completions.calls == 1:
+            print("✅ 只调用了一次模型")
+        else:
+            print(f"❌ 调用了{completions.calls}次模型")
+        
+        if len(titles) == 5 and len(set(titles)) == 5:
+            print("✅ 标题数量正确且互不重复")
+        else:
+            print("❌ 标题数量不对或有重复")
+        
+        if titles[:3] == ["《剑道独尊》", "《星河长歌》", "《九天神帝》"]:
+            print("✅ 模型生成的标题优先，不足部分用模板补足")
+        else:
+            print("❌ 标题顺序不正确")
+        
+        # 模型输出无法解析时全部来自模板，仍然数量足够
+        completions.reply = "抱歉"
+        titles = service.generate_multiple_titles('玄幻', '重生', 10)
+        if len(titles) == 10 and len(set(titles)) == 10:
+            print("✅ 模板补足后数量正确")
+        else:
+            print(f"❌ 模板补足后数量不对: {titles}")
+            
+    except Exception as e:
+        print(f"❌ 批量标题生成失败: {e}")
+
 if __name__ == "__main__":
-    test_title_generation()
\ No newline at end of file
+    test_title_generation()
+    test_batch_titles()
\ No newline at end of file
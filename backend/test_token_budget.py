@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# co-novel - token估算、提示词预算与用量统计测试脚本
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加项目根目录到路径
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+
+def test_estimate_and_truncate():
+    """测试中英文混排的token估算，以及保留首尾的截断"""
+    print("🧪 测试token估算与截断...")
+
+    try:
+        from utils.tokenizer import estimate_tokens, truncate_tokens, TRUNCATION_MARKER
+
+        assert estimate_tokens("") == 0
+        assert estimate_tokens("你好世界") == 4
+        assert estimate_tokens("abcdefgh") == 2
+        # 汉字、全角标点各1个，英文单词按长度，空格并入单词，数字每3位1个
+        assert estimate_tokens("他说：Hello world 2024") == 3 + 2 + 2 + 2
+        assert estimate_tokens("第一段。\n\n第二段。") == 4 + 1 + 4
+
+        text = "任务说明。" + "参考内容" * 500 + "输出要求。"
+        truncated = truncate_tokens(text, 100)
+        assert estimate_tokens(truncated) <= 100
+        assert truncated.startswith("任务说明。") and truncated.endswith("输出要求。")
+        assert TRUNCATION_MARKER in truncated
+        assert truncate_tokens("很短的文本", 100) == "很短的文本"
+
+        print("✅ token估算与截断测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ token估算与截断测试失败: {e}")
+        return False
+
+
+def test_prompt_budget():
+    """测试提示词超出路由预算时被截断，并计入路由统计"""
+    print("🧪 测试提示词预算...")
+
+    try:
+        from services.model_router import ModelRoute, ModelRouter
+        from utils.tokenizer import estimate_tokens
+        from test_cache import make_service
+
+        service, completions = make_service({})
+        service.router = ModelRouter({
+            "content": ModelRoute(model="m", max_tokens=100),
+            "suggestion": ModelRoute(model="m", max_tokens=100, context_window=400, max_prompt_tokens=200),
+        })
+
+        service.get_ai_suggestions("很长的正文。" * 300, "续写")
+        sent = completions.last_params["messages"]
+        assert estimate_tokens(sent[0]["content"]) + estimate_tokens(sent[1]["content"]) <= 200
+
+        stats = service.get_route_stats()["usage"]["suggestion"]
+        assert stats["truncated_prompts"] == 1 and stats["truncated_tokens"] > 1000
+
+        # 预算之内的提示词原样发送
+        service.generate_novel_content("写一段开头", 50)
+        assert completions.last_params["messages"][1]["content"] == "写一段开头"
+        assert service.get_route_stats()["usage"]["content"]["truncated_prompts"] == 0
+
+        print("✅ 提示词预算测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 提示词预算测试失败: {e}")
+        return False
+
+
+def test_stream_usage():
+    """测试流式响应的usage来自上游真实用量，上游不返回时为本地估算"""
+    print("🧪 测试流式用量统计...")
+
+    try:
+        from routers.ai import create_stream_generator
+        from test_cache import make_service
+
+        service, completions = make_service({})
+        upstream_usage = SimpleNamespace(prompt_tokens=123, completion_tokens=45, total_tokens=168)
+
+        async def stream_with_usage():
+            for ch in completions.reply:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=ch))], usage=None)
+            # include_usage时最后一个片段没有choices，只带usage
+            yield SimpleNamespace(choices=[], usage=upstream_usage)
+
+        async def collect(generator):
+            return [json.loads(event[len("data: "):]) async for event in generator]
+
+        completions._stream = stream_with_usage
+        events = asyncio.run(collect(create_stream_generator(
+            service.generate_novel_content_stream_async("写一段开头", 50), "content")()))
+        assert completions.last_params["stream_options"] == {"include_usage": True}
+        assert events[-1]["usage"]["prompt_tokens"] == 123
+        assert events[-1]["usage"]["completion_tokens"] == 45
+        assert events[-1]["usage"]["total_tokens"] == 168
+        # 上游usage到达之前，提示词token为本地估算，不再是固定值
+        assert events[1]["usage"]["prompt_tokens"] > 4
+        assert events[1]["usage"]["completion_tokens"] == 1
+        route = service.get_route_stats()["usage"]["content"]
+        assert route["prompt_tokens"] == 123 and route["estimated_calls"] == 0
+
+        # 上游不返回usage时按本地估算
+        completions._stream = lambda: _plain_stream(completions.reply)
+        events = asyncio.run(collect(create_stream_generator(
+            service.generate_novel_content_stream_async("写另一段开头", 50), "content")()))
+        assert events[-1]["usage"]["completion_tokens"] == len(completions.reply)
+        assert service.get_route_stats()["usage"]["content"]["estimated_calls"] == 1
+
+        print("✅ 流式用量统计测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 流式用量统计测试失败: {e}")
+        return False
+
+
+def test_word_count_target():
+    """测试章节按目标字数设置提示词和max_tokens，字符/token比例按模型学习，流式输出达到目标后在句末结束"""
+    print("🧪 测试章节目标字数...")
+
+    try:
+        from services.model_router import ModelRoute, ModelRouter
+        from utils.tokenizer import WordLimit, count_words
+        from test_cache import make_service
+
+        limit = WordLimit(5, overrun=1.0)
+        assert limit.clip("一二三") == "一二三" and not limit.done
+        assert limit.clip("四五六。”接着写") == "四五六。”" and limit.done
+        assert limit.clip("后面的内容") == ""
+        limit = WordLimit(10, overrun=0.2)
+        assert limit.clip("一" * 20) == "一" * 12
+
+        service, completions = make_service({})
+        service.router = ModelRouter({
+            "content": ModelRoute(model="m", max_tokens=100),
+            "chapter": ModelRoute(model="m", max_tokens=4000),
+        })
+        service.router.default_chars_per_token = 1.0
+
+        # 样本不足时使用默认比例，max_tokens为目标字数加25%余量
+        service.generate_chapter_content("《测试》", "第一章：开端\n主角出场", 1, word_count_target=500)
+        assert "约500字" in completions.last_params["messages"][-1]["content"]
+        assert completions.last_params["max_tokens"] == 625
+
+        # 上游返回的真实用量：1000字用了800个token
+        service.router.record("chapter", 1.0, completion="字" * 1000,
+                              usage=SimpleNamespace(prompt_tokens=100, completion_tokens=800))
+        assert service.router.chars_per_token("m") == 1.25
+        assert service.router.get_stats()["chars_per_token"] == {"m": 1.25}
+        service.generate_chapter_content("《测试》", "第一章：开端\n主角出场", 2, word_count_target=3000)
+        assert completions.last_params["max_tokens"] == 3000
+
+        # chapter路由的max_tokens是上限，未配置时不限制
+        service.router.routes["chapter"].max_tokens = 1200
+        assert service._chapter_length(3000) == (3000, 1200)
+        service.router.routes["chapter"].max_tokens = None
+        assert service._chapter_length(3000) == (3000, 3000)
+        service.router.routes["chapter"].max_tokens = 4000
+
+        # 流式生成达到目标字数后在句末结束，并停止读取上游
+        pulled = []
+
+        async def long_stream():
+            for sentence in ["这是一句测试的话。"] * 200:
+                pulled.append(sentence)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=sentence))])
+
+        completions._stream = long_stream
+        content = "".join(service.generate_chapter_content_stream("《测试》", "第一章：开端\n主角出场", 3,
+                                                                   word_count_target=500))
+        assert 500 <= count_words(content) <= 550 and content.endswith("。")
+        assert len(pulled) < 200
+        print(f"目标500字，输出{count_words(content)}字，读取上游{len(pulled)}/200个片段")
+
+        print("✅ 章节目标字数测试通过")
+        return True
+    except Exception as e:
+        print(f"❌ 章节目标字数测试失败: {e}")
+        return False
+
+
+async def _plain_stream(text: str):
+    for ch in text:
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=ch))])
+
+
+def run_all_tests():
+    """运行所有测试"""
+    print("🚀 开始token预算测试...\n")
+
+    tests = [
+        test_estimate_and_truncate,
+        test_prompt_budget,
+        test_stream_usage,
+        test_word_count_target,
+    ]
+
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 测试结果: {passed}/{len(tests)} 通过")
+    return passed == len(tests)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
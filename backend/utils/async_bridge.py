@@ -0,0 +1,75 @@
+# co-novel - 同步调用异步代码的桥接工具
+import asyncio
+import threading
+from typing import AsyncIterator, Awaitable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """获取（必要时启动）后台事件循环"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="async-bridge", daemon=True)
+            thread.start()
+        return _loop
+
+
+def in_bridge_loop() -> bool:
+    """当前是否运行在后台事件循环中"""
+    try:
+        return asyncio.get_running_loop() is _loop
+    except RuntimeError:
+        return False
+
+
+def run_sync(awaitable: Awaitable[T]) -> T:
+    """
+    在后台事件循环中执行协程并等待结果
+
+    供脚本和线程池等同步代码调用异步接口。所有同步调用共用同一个后台
+    循环，因此客户端连接池等按事件循环划分的资源可以复用。
+
+    Args:
+        awaitable: 要执行的协程
+
+    Returns:
+        协程的返回值
+    """
+    if in_bridge_loop():
+        raise RuntimeError("run_sync() cannot be called from the bridge event loop")
+    return asyncio.run_coroutine_threadsafe(_await(awaitable), _get_loop()).result()
+
+
+async def _await(awaitable: Awaitable[T]) -> T:
+    return await awaitable
+
+
+def iterate_sync(async_iterator: AsyncIterator[T]) -> Iterator[T]:
+    """
+    将异步生成器转换为同步迭代器
+
+    提前停止迭代时会关闭异步生成器，使其释放上游连接。
+
+    Args:
+        async_iterator: 异步生成器
+
+    Yields:
+        异步生成器产出的每一项
+    """
+    try:
+        while True:
+            try:
+                item = run_sync(async_iterator.__anext__())
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        aclose = getattr(async_iterator, "aclose", None)
+        if aclose is not None:
+            run_sync(aclose())
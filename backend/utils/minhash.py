@@ -0,0 +1,132 @@
+# co-novel - MinHash近似去重工具
+import random
+import zlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# 梅森素数，作为哈希置换的模数
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def shingle_hashes(text: str, size: int = 3) -> Set[int]:
+    """
+    将文本切分为字符shingle并哈希
+
+    Args:
+        text: 输入文本
+        size: 每个shingle的字符数
+
+    Returns:
+        shingle哈希集合（32位，跨进程稳定）
+    """
+    # 忽略空白差异
+    normalized = "".join(text.split())
+    if len(normalized) <= size:
+        return {zlib.crc32(normalized.encode("utf-8"))} if normalized else set()
+    return {
+        zlib.crc32(normalized[i:i + size].encode("utf-8"))
+        for i in range(len(normalized) - size + 1)
+    }
+
+
+class MinHasher:
+    """MinHash签名生成器"""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        # 固定种子，保证签名可以持久化后重复使用
+        rng = random.Random(seed)
+        self._perms: List[Tuple[int, int]] = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+
+    def signature(self, text: str, ignore: Optional[Set[int]] = None) -> List[int]:
+        """
+        计算文本的MinHash签名
+
+        Args:
+            text: 输入文本
+            ignore: 需要排除的shingle哈希（如提示词模板中的固定文字）
+
+        Returns:
+            长度为num_perm的签名
+        """
+        hashes = shingle_hashes(text, self.shingle_size)
+        if ignore:
+            hashes -= ignore
+        if not hashes:
+            return [_MAX_HASH] * self.num_perm
+        return [
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+            for a, b in self._perms
+        ]
+
+
+def estimate_similarity(sig_a: List[int], sig_b: List[int]) -> float:
+    """根据两个签名估算Jaccard相似度"""
+    if not sig_a or len(sig_a) != len(sig_b):
+        return 0.0
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+
+class LSHIndex:
+    """基于分段（banding）的局部敏感哈希索引"""
+
+    def __init__(self, num_perm: int = 64, bands: int = 16):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be divisible by bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Set[str]] = {}
+        self._signatures: Dict[str, List[int]] = {}
+
+    def _band_keys(self, signature: List[int]) -> Iterable[Tuple[int, Tuple[int, ...]]]:
+        for band in range(self.bands):
+            start = band * self.rows
+            yield band, tuple(signature[start:start + self.rows])
+
+    def add(self, key: str, signature: List[int]):
+        """加入索引"""
+        self.remove(key)
+        self._signatures[key] = signature
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, set()).add(key)
+
+    def remove(self, key: str):
+        """从索引中移除"""
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if bucket:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def query(self, signature: List[int], threshold: float) -> Optional[Tuple[str, float]]:
+        """
+        查找最相似的条目
+
+        Args:
+            signature: 查询签名
+            threshold: 最低相似度
+
+        Returns:
+            (键, 相似度)，没有达到阈值的条目时返回None
+        """
+        candidates: Set[str] = set()
+        for band_key in self._band_keys(signature):
+            candidates |= self._buckets.get(band_key, set())
+
+        best: Optional[Tuple[str, float]] = None
+        for key in candidates:
+            similarity = estimate_similarity(signature, self._signatures[key])
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (key, similarity)
+        return best
+
+    def __len__(self) -> int:
+        return len(self._signatures)
@@ -0,0 +1,105 @@
+# co-novel - 章节大纲解析工具
+import re
+from typing import List, Optional
+
+from models.novel import OutlineChapter
+
+# 章节标题行，如“第十二章：xxx”“**第3章 xxx**”“## 第一章、xxx”
+_CHAPTER_HEADING = re.compile(
+    r"^\s*(?:#+\s*)?\**\s*第([零〇一二两三四五六七八九十百\d]+)章\s*[：:、.．\-—\s]*(.*)$"
+)
+_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4,
+           "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_UNITS = {"十": 10, "百": 100}
+# 标题、概括两端的Markdown符号和提示词模板里的方括号
+_DECORATION = "*#[]【】 \t"
+
+
+def chinese_number(text: str) -> int:
+    """将“十二”“一百零五”或阿拉伯数字转换为整数"""
+    if text.isdigit():
+        return int(text)
+    total, current = 0, 0
+    for ch in text:
+        if ch in _DIGITS:
+            current = _DIGITS[ch]
+        elif ch in _UNITS:
+            total += (current or 1) * _UNITS[ch]
+            current = 0
+    return total + current
+
+
+def parse_outline(outline: Optional[str]) -> List[OutlineChapter]:
+    """
+    解析大纲生成提示词要求的格式：
+
+        第一章：章节标题
+        一句话概括
+
+    标题行之后、下一个标题行之前的非空行合并为概括，第一个标题行之前的内容忽略。
+    同一章节号出现多次时保留第一次。
+
+    Args:
+        outline: 大纲文本
+
+    Returns:
+        按出现顺序排列的章节列表，无法识别任何章节时为空列表
+    """
+    chapters: List[OutlineChapter] = []
+    seen = set()
+    current: Optional[OutlineChapter] = None
+    summary: List[str] = []
+
+    def flush():
+        if current is not None and current.number not in seen:
+            current.summary = "".join(summary)
+            seen.add(current.number)
+            chapters.append(current)
+
+    for line in (outline or "").splitlines():
+        match = _CHAPTER_HEADING.match(line)
+        if match:
+            flush()
+            current = OutlineChapter(number=chinese_number(match.group(1)),
+                                     title=match.group(2).strip(_DECORATION))
+            summary = []
+        elif current is not None:
+            text = line.strip(_DECORATION)
+            if text:
+                summary.append(text)
+    flush()
+    return chapters
+
+
+def count_outline_chapters(outline: Optional[str]) -> int:
+    """大纲中规划的章节数"""
+    return len(parse_outline(outline))
+
+
+def format_chapter(chapter: OutlineChapter) -> str:
+    """单个章节的紧凑表示：第N章：标题——概括"""
+    line = f"第{chapter.number}章：{chapter.title}" if chapter.title else f"第{chapter.number}章"
+    return f"{line}——{chapter.summary}" if chapter.summary else line
+
+
+def outline_window(chapters: List[OutlineChapter], chapter_number: int, window: int = 1) -> Optional[str]:
+    """
+    章节提示词使用的大纲片段：目标章节及前后各window章
+
+    Args:
+        chapters: 解析后的章节列表
+        chapter_number: 目标章节号
+        window: 前后各保留的章节数
+
+    Returns:
+        大纲片段，目标章节不在大纲中时返回None
+    """
+    index = next((i for i, ch in enumerate(chapters) if ch.number == chapter_number), None)
+    if index is None:
+        return None
+
+    lines = [f"（全书共{len(chapters)}章，以下为本章及前后{window}章）："]
+    for i in range(max(0, index - window), min(len(chapters), index + window + 1)):
+        prefix = "【本章】" if i == index else ""
+        lines.append(prefix + format_chapter(chapters[i]))
+    return "\n".join(lines)
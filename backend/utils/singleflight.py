@@ -0,0 +1,124 @@
+# co-novel - 合并相同的并发请求
+import time
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+class _Flight:
+    """一次被共享的生成"""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.task: Optional[asyncio.Task] = None
+        self.finished_at: Optional[float] = None
+        self.failed = False  # 出错或被取消，结果不再复用
+
+    def _mark_finished(self, failed: bool):
+        self.finished_at = time.monotonic()
+        self.failed = self.failed or failed
+
+
+class _SharedStream(_Flight):
+    """被共享的流式生成：后台读取source，所有订阅者从头读取已产生的片段并跟随后续片段"""
+
+    def __init__(self, source: AsyncIterator[str]):
+        super().__init__()
+        self.chunks: List[str] = []
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._produce(source))
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _produce(self, source: AsyncIterator[str]):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.failed = True
+        except Exception as e:
+            self.error = e
+            self.failed = True
+        finally:
+            self._mark_finished(False)
+            self._notify()
+            await source.aclose()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        self.subscribers += 1
+        try:
+            index = 0
+            while True:
+                changed = self._changed
+                while index < len(self.chunks):
+                    index += 1
+                    yield self.chunks[index - 1]
+                if self.finished_at is not None:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self.subscribers -= 1
+            if not self.subscribers and self.finished_at is None:
+                # 所有请求都已离开（客户端断开），停止生成并关闭上游
+                self.failed = True
+                self.task.cancel()
+
+
+class SingleFlight:
+    """
+    合并相同的请求
+
+    同一个key的请求正在进行时，后来的请求不再调用上游，而是等待（流式时从头重放并
+    跟随）同一次生成；生成成功结束后window秒内到达的相同请求直接复用结果。
+    用于编辑器频繁触发、内容相同的建议请求。
+    """
+
+    def __init__(self, window: float = 0.0):
+        self.window = window
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._stats = {"calls": 0, "shared": 0}
+
+    def _reusable(self, flight: _Flight) -> bool:
+        if flight.loop is not asyncio.get_running_loop() or flight.failed:
+            return False
+        return flight.finished_at is None or time.monotonic() - flight.finished_at <= self.window
+
+    def _lookup(self, key: Hashable) -> Optional[_Flight]:
+        # 顺便清理已不能复用的记录，记录数不超过近期不同请求的数量
+        for stale in [k for k, f in self._flights.items() if not self._reusable(f)]:
+            del self._flights[stale]
+        flight = self._flights.get(key)
+        self._stats["shared" if flight is not None else "calls"] += 1
+        return flight
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """执行fn()，相同key正在进行或刚结束时返回同一个结果"""
+        flight = self._lookup(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.ensure_future(fn())
+            flight.task.add_done_callback(
+                lambda task: flight._mark_finished(task.cancelled() or task.exception() is not None))
+        # 某个等待者被取消时不影响其他等待者
+        return await asyncio.shield(flight.task)
+
+    def stream(self, key: Hashable, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """流式版本：factory()返回异步生成器，相同key的请求共享同一个生成器的输出"""
+        flight = self._lookup(key)
+        if not isinstance(flight, _SharedStream):
+            flight = self._flights[key] = _SharedStream(factory())
+        return flight.subscribe()
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self._stats["calls"] + self._stats["shared"]
+        return {
+            **self._stats,
+            "shared_rate": round(self._stats["shared"] / total, 4) if total else 0.0,
+            "window": self.window,
+        }
@@ -0,0 +1,382 @@
+# co-novel - SSE流式响应与可续传的生成缓冲
+import os
+import time
+import json
+import uuid
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+
+class SSEResponse(StreamingResponse):
+    """
+    客户端断开后立即停止输出的流式响应
+
+    StreamingResponse只在部分ASGI版本下监听断开，且在取消范围内清理，
+    关闭上游连接的await可能被再次取消。这里始终监听http.disconnect，断开时
+    用asyncio取消输出任务（只取消一次，生成器的finally可以正常await），
+    最后显式关闭生成器，上游连接随之关闭。
+    """
+
+    media_type = "text/event-stream; charset=utf-8"
+
+    async def __call__(self, scope, receive, send):
+        streaming = asyncio.ensure_future(self.stream_response(send))
+        watcher = asyncio.ensure_future(self.listen_for_disconnect(receive))
+        try:
+            await asyncio.wait({streaming, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watcher.cancel()
+            streaming.cancel()
+            results = await asyncio.gather(streaming, watcher, return_exceptions=True)
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+        error = results[0]
+        # 发送时连接已断开（OSError）与监听到断开同样处理
+        if isinstance(error, Exception) and not isinstance(error, OSError):
+            raise error
+        if self.background is not None:
+            await self.background()
+
+
+class ChunkEnvelope:
+    """
+    OpenAI兼容的chat.completion.chunk事件编码
+
+    信封中不变的部分（id、created、model等）在开始时序列化一次，之后每个事件
+    只转义片段内容并与用量一起拼接，不再为每个片段构造嵌套字典并整体json.dumps。
+    输出与对同样的字典调用json.dumps(..., ensure_ascii=False)完全一致。
+    """
+
+    def __init__(self, completion_id: str, model: str, created: Optional[int] = None):
+        head = json.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created if created is not None else int(time.time()),
+            "model": model,
+        }, ensure_ascii=False)
+        self._prefix = f'data: {head[:-1]}, "choices": [{{"index": 0, "delta": {{"content": '
+        self._middle = ', "reasoning_content": "", "role": "assistant"}, "finish_reason": '
+        self._usage = '}], "system_fingerprint": "", "usage": {"prompt_tokens": '
+
+    def encode(self, content: Optional[str], prompt_tokens: int, completion_tokens: int,
+               finish_reason: Optional[str] = None, usage_details: bool = True) -> str:
+        """一个SSE事件（以空行结尾）；usage_details为True时带completion_tokens_details"""
+        details = ', "completion_tokens_details": {"reasoning_tokens": 0}' if usage_details else ""
+        return (
+            f"{self._prefix}{json.dumps(content, ensure_ascii=False)}{self._middle}"
+            f"{'null' if finish_reason is None else json.dumps(finish_reason)}{self._usage}{prompt_tokens}, "
+            f'"completion_tokens": {completion_tokens}, "total_tokens": {prompt_tokens + completion_tokens}'
+            f"{details}}}}}\n\n"
+        )
+
+
+class CoalesceConfig(BaseModel):
+    """SSE片段合并参数"""
+    max_chars: int = 32  # 缓冲达到这么多字时立即发送
+    window: float = 0.04  # 缓冲中最早的片段最多等待的秒数
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_chars > 1 and self.window > 0
+
+
+class CoalesceSettings:
+    """
+    各流式接口的片段合并参数
+
+    默认值来自SSE_COALESCE_CHARS和SSE_COALESCE_WINDOW，按接口的内容类型覆盖：
+    SSE_COALESCE_ROUTES={"outline": {"window": 0}}（window为0或max_chars不大于1时不合并）
+    """
+
+    def __init__(self):
+        self.default = CoalesceConfig(
+            max_chars=int(os.getenv("SSE_COALESCE_CHARS", "32")),
+            window=float(os.getenv("SSE_COALESCE_WINDOW", "0.04")),
+        )
+        self.routes: Dict[str, CoalesceConfig] = {}
+        overrides = os.getenv("SSE_COALESCE_ROUTES")
+        if overrides:
+            try:
+                for content_type, values in json.loads(overrides).items():
+                    self.routes[content_type] = self.default.copy(update=values)
+            except (json.JSONDecodeError, AttributeError, TypeError) as e:
+                print(f"解析SSE_COALESCE_ROUTES失败，使用默认合并参数: {e}")
+
+    def for_route(self, content_type: str) -> CoalesceConfig:
+        return self.routes.get(content_type, self.default)
+
+
+async def coalesce(source: AsyncIterator[str], config: CoalesceConfig) -> AsyncIterator[str]:
+    """
+    合并上游的小片段，减少SSE事件数
+
+    首个片段立即发送（不增加首字延迟），之后的片段缓冲到max_chars字，或缓冲中
+    最早的片段等待满window秒时一起发送。等待下一个片段的同时计时，上游停顿时
+    已缓冲的内容按时发出。
+    """
+    if not config.enabled:
+        async for chunk in source:
+            yield chunk
+        return
+
+    loop = asyncio.get_running_loop()
+    iterator = source.__aiter__()
+    parts: List[str] = []
+    size = 0
+    deadline: Optional[float] = None
+    first = True
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # 窗口到期：发送已缓冲的部分，继续等待同一个片段
+                yield "".join(parts)
+                parts, size, deadline = [], 0, None
+                continue
+            task, pending = pending, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                if parts:
+                    yield "".join(parts)
+                raise
+            if not chunk:
+                continue
+            parts.append(chunk)
+            size += len(chunk)
+            if first or size >= config.max_chars:
+                first = False
+                yield "".join(parts)
+                parts, size, deadline = [], 0, None
+            elif deadline is None:
+                deadline = loop.time() + config.window
+        if parts:
+            yield "".join(parts)
+    finally:
+        if pending is not None:
+            # 提前结束：取消正在读取的片段，上游生成器随之结束
+            pending.cancel()
+            await asyncio.wait({pending})
+
+
+RESUME_GAP_ERROR = {
+    "object": "error",
+    "error": {"message": "stream events expired", "type": "resume_error", "code": "resume_gap"},
+}
+
+
+class ResumeGapError(LookupError):
+    """要续传的事件已被挤出缓冲区"""
+
+
+class GenerationBuffer:
+    """
+    一次生成的事件缓冲
+
+    生成在后台任务中进行，事件按顺序编号后放入有界的环形缓冲；HTTP连接只是订阅者，
+    断线后可以从任意仍在缓冲中的位置继续读取。
+    """
+
+    def __init__(self, generation_id: str, max_events: int):
+        self.id = generation_id
+        self.events: Deque[Tuple[int, str]] = deque(maxlen=max_events)
+        self.next_seq = 0
+        self.done = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.finished_at: Optional[float] = None
+        self.abandon_timer: Optional[asyncio.TimerHandle] = None
+        self._changed = asyncio.Event()
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.id}-{seq}"
+
+    def append(self, payload: str):
+        self.events.append((self.next_seq, payload))
+        self.next_seq += 1
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self):
+        # 唤醒所有等待者后换一个新的Event，下次等待的是之后的事件
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def can_resume(self, after: int) -> bool:
+        """序号after之后的事件是否都还在缓冲中"""
+        oldest = self.events[0][0] if self.events else self.next_seq
+        return after + 1 >= oldest
+
+    async def subscribe(self, after: int = -1, on_detach=None) -> AsyncIterator[str]:
+        """
+        从序号after之后开始读取事件（带id行的SSE文本），生成结束且读完后返回
+
+        Args:
+            after: 已收到的最后一个事件序号，-1为从头读取
+            on_detach: 订阅结束（包括客户端断开）时调用
+        """
+        self.subscribers += 1
+        try:
+            cursor = after + 1
+            while True:
+                changed = self._changed
+                while cursor < self.next_seq:
+                    if not self.can_resume(cursor - 1):
+                        # 读取太慢，未读的事件已被挤出缓冲
+                        yield f"data: {json.dumps(RESUME_GAP_ERROR, ensure_ascii=False)}\n\n"
+                        return
+                    # 每个事件都按序号重新定位：挂起期间生产者追加事件会挤掉左端，下标随之变化
+                    seq, payload = self.events[cursor - self.events[0][0]]
+                    cursor = seq + 1
+                    yield f"id: {self.event_id(seq)}\n{payload}"
+                if self.done:
+                    return
+                await changed.wait()
+        finally:
+            self.subscribers -= 1
+            if on_detach is not None:
+                on_detach(self)
+
+
+def parse_event_id(event_id: Optional[str]) -> Optional[Tuple[str, int]]:
+    """把Last-Event-ID拆成(生成ID, 序号)，格式不对时返回None"""
+    if not event_id:
+        return None
+    generation_id, _, seq = event_id.strip().rpartition("-")
+    if not generation_id or not seq.isdigit():
+        return None
+    return generation_id, int(seq)
+
+
+class StreamRegistry:
+    """
+    可续传的生成缓冲登记表
+
+    每次流式生成在后台任务中运行，与HTTP连接解耦：
+    - 客户端断线后生成继续进行，带Last-Event-ID重连时从断点续传，不再调用上游
+    - 没有订阅者超过resume_grace秒仍未重连时取消生成并关闭上游连接（为0时立即取消）
+    - 生成结束后缓冲保留ttl秒，每次生成最多保留max_events个事件
+    """
+
+    def __init__(self, max_events: Optional[int] = None, ttl: Optional[float] = None,
+                 resume_grace: Optional[float] = None):
+        self.max_events = max_events or int(os.getenv("SSE_BUFFER_EVENTS", "2000"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("SSE_BUFFER_TTL", "300"))
+        self.resume_grace = resume_grace if resume_grace is not None else \
+            float(os.getenv("SSE_RESUME_GRACE", "15"))
+        self._buffers: Dict[str, GenerationBuffer] = {}
+        self._stats = {"started": 0, "resumed": 0, "abandoned": 0, "gaps": 0}
+
+    def start(self, source: AsyncIterator[str]) -> GenerationBuffer:
+        """在后台运行source（产出SSE文本的异步生成器），返回其缓冲；需在事件循环中调用"""
+        self._evict()
+        buffer = GenerationBuffer(uuid.uuid4().hex, self.max_events)
+        buffer.task = asyncio.ensure_future(self._produce(buffer, source))
+        self._buffers[buffer.id] = buffer
+        self._stats["started"] += 1
+        return buffer
+
+    @staticmethod
+    async def _produce(buffer: GenerationBuffer, source: AsyncIterator[str]):
+        try:
+            async for payload in source:
+                buffer.append(payload)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            buffer.finish()
+            await source.aclose()
+
+    def subscribe(self, buffer: GenerationBuffer, after: int = -1) -> AsyncIterator[str]:
+        """订阅缓冲，订阅者全部断开后按resume_grace安排取消"""
+        return buffer.subscribe(after, on_detach=self._on_detach)
+
+    def resume(self, last_event_id: Optional[str]) -> Optional[AsyncIterator[str]]:
+        """
+        按Last-Event-ID续传
+
+        Returns:
+            从断点之后开始的事件流；生成不存在（或已过期）时返回None
+
+        Raises:
+            ResumeGapError: 断点之后的部分事件已被挤出缓冲
+        """
+        parsed = parse_event_id(last_event_id)
+        buffer = self._buffers.get(parsed[0]) if parsed else None
+        if buffer is None:
+            return None
+        if not buffer.can_resume(parsed[1]):
+            self._stats["gaps"] += 1
+            raise ResumeGapError(f"事件 {last_event_id} 之后的部分内容已不在缓冲中")
+        self._stats["resumed"] += 1
+        return self.subscribe(buffer, parsed[1])
+
+    def get(self, generation_id: str) -> Optional[GenerationBuffer]:
+        return self._buffers.get(generation_id)
+
+    def cancel(self, generation_id: str) -> bool:
+        """主动取消生成（例如用户点击停止）"""
+        buffer = self._buffers.get(generation_id)
+        if buffer is None or buffer.done:
+            return False
+        buffer.task.cancel()
+        return True
+
+    def _on_detach(self, buffer: GenerationBuffer):
+        if buffer.subscribers or buffer.done:
+            return
+        if buffer.abandon_timer is not None:
+            # 重连后再次断开，宽限期从这次断开重新计算
+            buffer.abandon_timer.cancel()
+        if self.resume_grace <= 0:
+            self._abandon(buffer)
+        else:
+            buffer.abandon_timer = asyncio.get_running_loop().call_later(self.resume_grace, self._abandon, buffer)
+
+    def _abandon(self, buffer: GenerationBuffer):
+        """宽限期内没有重连，取消生成"""
+        if buffer.subscribers or buffer.done:
+            return
+        self._stats["abandoned"] += 1
+        buffer.task.cancel()
+
+    def _evict(self):
+        """清理结束超过ttl的缓冲"""
+        now = time.monotonic()
+        expired = [gid for gid, b in self._buffers.items() if b.done and now - b.finished_at > self.ttl]
+        for gid in expired:
+            del self._buffers[gid]
+
+    def get_stats(self) -> Dict[str, Any]:
+        active = sum(1 for b in self._buffers.values() if not b.done)
+        return {
+            **self._stats,
+            "active": active,
+            "buffered": len(self._buffers),
+            "buffered_events": sum(len(b.events) for b in self._buffers.values()),
+            "max_events": self.max_events,
+            "resume_grace": self.resume_grace,
+        }
+
+
+# 全局登记表，所有流式接口共用
+stream_registry = StreamRegistry()
+
+# 全局合并参数，按内容类型区分
+coalesce_settings = CoalesceSettings()
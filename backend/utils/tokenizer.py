@@ -0,0 +1,219 @@
+# co-novel - 离线token估算、截断与用量记录
+import re
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+# 按常见BPE分词器的切分方式粗分：汉字/假名/谚文每字一个token，全角标点每个一个，
+# 英文单词约每4个字母一个token，数字约每3位一个token，其他符号每个一个
+_PIECE = re.compile(
+    r"(?P<cjk>[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af\u3000-\u303f\uff00-\uffef])"
+    r"|(?P<word>[A-Za-z]+)"
+    r"|(?P<digits>\d+)"
+    r"|(?P<space>\s+)"
+    r"|(?P<other>.)",
+    re.S,
+)
+
+# 聊天消息的格式开销：每条消息约4个token，回复前缀约3个token
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+TRUNCATION_MARKER = "\n……（中间内容过长，已省略）……\n"
+
+# 句末标点，以及可以跟在句末标点之后的引号和括号
+_SENTENCE_ENDINGS = "。！？!?…"
+_CLOSING_MARKS = "”’」』）)\"'"
+# 流式分段时可以断开的位置：句末和句中的停顿
+_CHUNK_BREAKS = _SENTENCE_ENDINGS + "，,；;：:、\n"
+
+
+def _piece_tokens(match: "re.Match") -> int:
+    kind = match.lastgroup
+    if kind == "word":
+        return (len(match.group()) + 3) // 4
+    if kind == "digits":
+        return (len(match.group()) + 2) // 3
+    if kind == "space":
+        # 空格通常并入下一个单词，换行单独计一个
+        return 1 if "\n" in match.group() else 0
+    return 1
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    离线估算文本的token数
+
+    针对中英文混排的小说文本，与主流模型分词器的误差一般在15%以内，
+    用于限流、预算和上游未返回usage时的用量统计。
+    """
+    if not text:
+        return 0
+    return sum(_piece_tokens(m) for m in _PIECE.finditer(text))
+
+
+def estimate_chat_tokens(system_prompt: str, prompt: str) -> int:
+    """估算一次“系统提示词 + 用户提示词”请求的输入token数"""
+    return estimate_tokens(system_prompt) + estimate_tokens(prompt) + 2 * MESSAGE_OVERHEAD + REPLY_OVERHEAD
+
+
+def count_words(text: Optional[str]) -> int:
+    """按章节字数的统计口径计数：除空格和换行外的字符数"""
+    if not text:
+        return 0
+    return len(text) - text.count(" ") - text.count("\n")
+
+
+def split_chunks(text: str, max_chars: int = 20) -> List[str]:
+    """
+    把文本切成适合流式输出的短片段
+
+    在标点或换行之后断开（连同其后的引号、括号和空白），没有标点的长句每max_chars个字符断开，
+    不拆开英文单词和数字。各片段拼接后与原文相同。
+    """
+    chunks = []
+    start = 0
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        i += 1
+        if ch in _CHUNK_BREAKS:
+            while i < len(text) and (text[i] in _CLOSING_MARKS or text[i].isspace()):
+                i += 1
+        elif i - start < max_chars:
+            continue
+        elif ch.isascii() and ch.isalnum() and i < len(text) and text[i].isascii() and text[i].isalnum():
+            continue
+        chunks.append(text[start:i])
+        start = i
+    if start < len(text):
+        chunks.append(text[start:])
+    return chunks
+
+
+def _token_offsets(text: str) -> List[Tuple[int, int]]:
+    """每个切分片段的结束位置，以及到该片段为止累计的token数"""
+    offsets = []
+    total = 0
+    for m in _PIECE.finditer(text):
+        total += _piece_tokens(m)
+        offsets.append((m.end(), total))
+    return offsets
+
+
+def truncate_tokens(text: str, max_tokens: int, marker: str = TRUNCATION_MARKER) -> str:
+    """
+    将文本截断到不超过max_tokens个token，保留开头和结尾、省略中间
+
+    提示词的开头通常是任务说明，结尾是要求和格式，中间是可以省略的参考内容。
+
+    Args:
+        text: 原文本
+        max_tokens: token上限
+        marker: 替换被省略部分的标记
+
+    Returns:
+        截断后的文本，未超出上限时原样返回
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - estimate_tokens(marker)
+    if budget <= 0:
+        return ""
+
+    offsets = _token_offsets(text)
+    total = offsets[-1][1]
+    head_budget = budget // 2
+    tail_budget = budget - head_budget
+
+    head_end = 0
+    for end, count in offsets:
+        if count > head_budget:
+            break
+        head_end = end
+    # 结尾部分：从累计token数超过 total - tail_budget 的位置开始保留
+    tail_start = len(text)
+    for end, count in reversed(offsets):
+        if total - count >= tail_budget:
+            break
+        tail_start = end
+    tail_start = max(tail_start, head_end)
+    return text[:head_end] + marker + text[tail_start:]
+
+
+class WordLimit:
+    """
+    流式输出的字数上限
+
+    累计字数达到目标后在下一个句末标点（连同其后的引号、括号）处结束，
+    超出目标overrun比例仍未遇到句末时直接结束。
+    """
+
+    def __init__(self, target: int, overrun: float = 0.1):
+        self.target = target
+        self.hard_limit = target + max(1, int(target * overrun))
+        self.count = 0
+        self.done = False
+        self._ending = False  # 已在目标之后遇到句末标点
+
+    def clip(self, text: str) -> str:
+        """返回片段中上限以内的部分，达到上限后done变为True"""
+        if self.done:
+            return ""
+        for i, ch in enumerate(text):
+            if self._ending and ch not in _CLOSING_MARKS and ch not in _SENTENCE_ENDINGS:
+                self.done = True
+                return text[:i]
+            if ch == " " or ch == "\n":
+                continue
+            self.count += 1
+            if self.count >= self.target and ch in _SENTENCE_ENDINGS:
+                self._ending = True
+            elif self.count >= self.hard_limit and not self._ending:
+                self.done = True
+                return text[:i + 1]
+        return text
+
+
+class TokenUsage:
+    """
+    一次生成的token用量
+
+    提示词token在发出请求时估算，输出token随片段累加估算；上游返回usage时
+    以上游的真实值为准（estimated变为False）。
+    """
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.estimated = True
+        self.upstream: Any = None  # 上游返回的原始usage
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add_completion(self, text: str):
+        """累加一段输出的估算token数，已有真实用量时忽略"""
+        if self.estimated:
+            self.completion_tokens += estimate_tokens(text)
+
+    def set_upstream(self, usage: Any):
+        """记录上游返回的usage"""
+        if usage is None or getattr(usage, "prompt_tokens", None) is None:
+            return
+        self.upstream = usage
+        self.prompt_tokens = usage.prompt_tokens
+        self.completion_tokens = usage.completion_tokens or 0
+        self.estimated = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+        }
+
+
+# 当前请求的用量记录。流式接口在开始输出前设置，AI服务在调用上游时写入，
+# 这样不必在每一层生成器之间传递用量对象
+current_usage: ContextVar[Optional[TokenUsage]] = ContextVar("current_usage", default=None)
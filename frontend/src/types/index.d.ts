@@ -173,7 +173,8 @@ export interface Statistics {
   total_words: number
   active_sessions: number
   cache_entries: number
-  cache_efficiency: number
+  cache_avg_reuse: number
+  cache_efficiency: number  // 真实命中率：hits / lookups
   genre_distribution: Record<string, number>
   last_updated: string
 }